@@ -0,0 +1,98 @@
+# bench_startup.py — presupuesto de arranque en frío de certtrack_mcp.server
+"""
+Mide el import de certtrack_mcp.server en procesos nuevos (python -X importtime)
+y falla (exit 1) si el arranque empeora:
+
+    python bench_startup.py                      # 7 corridas, presupuestos por defecto
+    python bench_startup.py --runs 15 --budget-ms 800 --overhead-ms 120
+
+Comprueba:
+- total: mediana del import completo <= --budget-ms
+- overhead: mediana del servidor menos la del SDK (mcp.server.fastmcp) solo,
+  es decir, lo que agrega nuestro código <= --overhead-ms
+- que no se carguen librerías pesadas que deben ser perezosas (Google, MSAL,
+  dateutil, NumPy, requests)
+- que el import no escriba en certtrack_mcp/data (sin efectos de disco)
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT, "certtrack_mcp", "data")
+LAZY_MODULES = ["googleapiclient", "google.oauth2", "google_auth_httplib2", "httplib2",
+                "msal", "dateutil", "numpy", "requests"]
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+def _import_us(module: str) -> int:
+    """Tiempo acumulado (µs) del import de 'module' en un proceso nuevo."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} falló:\n{proc.stderr[-2000:]}")
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m and m.group(4) == module and len(m.group(3)) == 1:  # fila de primer nivel
+            return int(m.group(2))
+    raise RuntimeError(f"sin datos de importtime para {module}")
+
+def _loaded_lazy_modules() -> list:
+    code = ("import sys, json, certtrack_mcp.server; "
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def _data_snapshot() -> dict:
+    if not os.path.isdir(DATA_DIR):
+        return {}
+    return {n: os.stat(os.path.join(DATA_DIR, n)).st_mtime_ns for n in os.listdir(DATA_DIR)}
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Presupuesto de arranque de certtrack_mcp.server.")
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--budget-ms", type=float, default=float(os.getenv("CERTTRACK_IMPORT_BUDGET_MS", "1000")))
+    ap.add_argument("--overhead-ms", type=float, default=float(os.getenv("CERTTRACK_IMPORT_OVERHEAD_MS", "150")))
+    args = ap.parse_args(argv)
+
+    before = _data_snapshot()
+    _import_us("certtrack_mcp.server")  # calienta caché de disco y .pyc
+    server = [_import_us("certtrack_mcp.server") / 1000 for _ in range(args.runs)]
+    sdk = [_import_us("mcp.server.fastmcp") / 1000 for _ in range(args.runs)]
+    lazy = _loaded_lazy_modules()
+    touched = sorted(n for n, t in _data_snapshot().items() if before.get(n) != t)
+
+    total_ms = statistics.median(server)
+    overhead_ms = total_ms - statistics.median(sdk)
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import total {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+    if overhead_ms > args.overhead_ms:
+        failures.append(f"overhead {overhead_ms:.0f} ms > {args.overhead_ms:.0f} ms")
+    if lazy:
+        failures.append(f"módulos que deberían ser perezosos: {lazy}")
+    if touched:
+        failures.append(f"el import escribió en {DATA_DIR}: {touched}")
+
+    print(json.dumps({
+        "ok": not failures,
+        "runs": args.runs,
+        "import_ms_median": round(total_ms, 1),
+        "import_ms_min": round(min(server), 1),
+        "sdk_ms_median": round(statistics.median(sdk), 1),
+        "overhead_ms": round(overhead_ms, 1),
+        "budget_ms": args.budget_ms,
+        "overhead_budget_ms": args.overhead_ms,
+        "eager_heavy_modules": lazy,
+        "data_files_touched": touched,
+        "failures": failures,
+    }, ensure_ascii=False, indent=2))
+    return 0 if not failures else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
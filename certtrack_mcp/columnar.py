@@ -0,0 +1,210 @@
+# certtrack_mcp/columnar.py
+"""
+Ruta columnar para cálculos masivos de vencimiento (reportes de cumplimiento).
+
+Convierte las columnas del store a arreglos NumPy (datetime64[D], int, float)
+y calcula vencimientos, días restantes y agregados en bloque. El snapshot se
+guarda por versión del store, así reportes repetidos no vuelven a parsear.
+Si NumPy no está instalado se usa el índice ya precalculado del store.
+"""
+from __future__ import annotations
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+def numpy_available() -> bool:
+    return np is not None
+
+def _to_int_array(values: List[str]):
+    arr = np.array(values, dtype=object)
+    try:
+        return np.where(arr == "", "0", arr).astype(np.int64)
+    except ValueError:
+        out = np.zeros(len(values), dtype=np.int64)
+        for i, v in enumerate(values):
+            try:
+                out[i] = int(v or 0)
+            except Exception:
+                pass
+        return out
+
+def _to_float_array(values: List[str]):
+    arr = np.array(values, dtype=object)
+    try:
+        return np.where(arr == "", "0", arr).astype(np.float64)
+    except ValueError:
+        out = np.zeros(len(values), dtype=np.float64)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v or 0)
+            except Exception:
+                pass
+        return out
+
+def _to_date_array(values: List[str]):
+    """
+    'YYYY-MM-DD' -> datetime64[D] leyendo los bytes en bloque (sin strptime por fila).
+    Lo que no tenga ese formato exacto se resuelve fila a fila; si no es válido => NaT.
+    """
+    n = len(values)
+    out = np.full(n, np.datetime64("NaT"), dtype="datetime64[D]")
+    try:
+        raw = np.array(values, dtype="S11")  # 11 bytes: el byte extra detecta cadenas largas
+    except UnicodeEncodeError:
+        raw = None
+    if raw is not None and n:
+        b = raw.view(np.uint8).reshape(n, 11).astype(np.int64)
+        digits = b[:, [0, 1, 2, 3, 5, 6, 8, 9]] - 48
+        shape_ok = (b[:, 4] == 45) & (b[:, 7] == 45) & (b[:, 10] == 0) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+        y = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        m = digits[:, 4] * 10 + digits[:, 5]
+        d = digits[:, 6] * 10 + digits[:, 7]
+        ok = shape_ok & (m >= 1) & (m <= 12) & (d >= 1)
+        months = ((y - 1970) * 12 + (m - 1)).astype("timedelta64[M]") + np.datetime64("1970-01", "M")
+        start = months.astype("datetime64[D]")
+        month_len = ((months + np.timedelta64(1, "M")).astype("datetime64[D]") - start).astype(np.int64)
+        ok &= d <= month_len
+        out[ok] = start[ok] + (d[ok] - 1).astype("timedelta64[D]")
+        pending = np.flatnonzero(~ok)
+    else:
+        pending = range(n)
+    for i in pending:
+        v = (values[i] or "").strip()
+        if not v:
+            continue
+        try:
+            out[i] = np.datetime64(datetime.strptime(v, "%Y-%m-%d").date(), "D")
+        except Exception:
+            pass
+    return out
+
+def add_months(fecha, months):
+    """
+    fecha (datetime64[D]) + months (int) con el mismo ajuste de fin de mes que
+    relativedelta: 2024-01-31 + 1 mes => 2024-02-29. NaT se propaga.
+    """
+    valid = ~np.isnat(fecha)
+    safe = np.where(valid, fecha, np.datetime64("1970-01-01", "D"))
+    month0 = safe.astype("datetime64[M]")
+    day0 = (safe - month0.astype("datetime64[D]")).astype(np.int64)
+    target = month0 + months.astype("timedelta64[M]")
+    start = target.astype("datetime64[D]")
+    month_len = ((target + np.timedelta64(1, "M")).astype("datetime64[D]") - start).astype(np.int64)
+    vence = start + np.minimum(day0, month_len - 1).astype("timedelta64[D]")
+    return np.where(valid, vence, np.datetime64("NaT"))
+
+def _factorize(values: List[str]):
+    """Códigos enteros + etiquetas (para agrupar con bincount en vez de ordenar strings)."""
+    seen: Dict[str, int] = {}
+    codes = np.fromiter((seen.setdefault(v, len(seen)) for v in values), dtype=np.int64, count=len(values))
+    return codes, list(seen)
+
+class ColumnarSnapshot:
+    """Columnas del maestro como arreglos, con 'vence' calculado en bloque."""
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.size = len(records)
+        self.proveedor, self.proveedor_labels = _factorize([(r.get("proveedor") or "").strip() for r in records])
+        self.tipo, self.tipo_labels = _factorize([(r.get("tipo") or "").strip() for r in records])
+        self.costo = _to_float_array([(r.get("costo") or "").strip() for r in records])
+        self.fecha = _to_date_array([r.get("fecha") or "" for r in records])
+        self.vigencia = _to_int_array([(r.get("vigencia_meses") or "").strip() for r in records])
+        self.vence = add_months(self.fecha, self.vigencia)
+        self.vence_mes = self.vence.astype("datetime64[M]").astype(np.int64)  # meses desde 1970-01
+
+_SNAPSHOT_LOCK = threading.Lock()
+_SNAPSHOTS: Dict[int, tuple] = {}
+
+def snapshot_for(store) -> ColumnarSnapshot:
+    """Snapshot columnar reutilizable mientras el store no cambie (versión + tamaño)."""
+    key = store.snapshot_key()
+    with _SNAPSHOT_LOCK:
+        cached = _SNAPSHOTS.get(id(store))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    snap = ColumnarSnapshot(store.iter_records())
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOTS[id(store)] = (key, snap)
+    return snap
+
+def _group(codes, labels, mask, costo) -> List[Dict[str, Any]]:
+    if not mask.any():
+        return []
+    counts = np.bincount(codes[mask], minlength=len(labels))
+    costs = np.bincount(codes[mask], weights=costo[mask], minlength=len(labels))
+    out = [{"key": labels[i], "count": int(counts[i]), "costo": round(float(costs[i]), 2)}
+           for i in np.flatnonzero(counts)]
+    return sorted(out, key=lambda g: (-g["count"], g["key"]))
+
+def expiration_report(store, start: date, end: date, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Agregados de vencimiento sobre todo el maestro:
+    vencidas a hoy, vencimientos en [start, end] por proveedor/tipo/mes y costo
+    de renovación en riesgo (suma de 'costo' de lo que vence en la ventana).
+    """
+    today = today or date.today()
+    if np is None:
+        return _expiration_report_python(store, start, end, today)
+
+    snap = snapshot_for(store)
+    valid = ~np.isnat(snap.vence)
+    d_start, d_end, d_today = (np.datetime64(x, "D") for x in (start, end, today))
+    in_window = valid & (snap.vence >= d_start) & (snap.vence <= d_end)
+    dias = (snap.vence - d_today).astype(np.int64)
+
+    meses = snap.vence_mes[in_window]
+    base = int(meses.min()) if meses.size else 0
+    mes_labels = [str(np.datetime64(base + i, "M")) for i in range(int(meses.max()) - base + 1)] if meses.size else []
+    return {
+        "engine": "numpy",
+        "total": int(snap.size),
+        "sin_fecha": int((~valid).sum()),
+        "vencidas": int((valid & (snap.vence < d_today)).sum()),
+        "en_ventana": int(in_window.sum()),
+        "dias_restantes_min": int(dias[in_window].min()) if in_window.any() else None,
+        "costo_en_riesgo": round(float(snap.costo[in_window].sum()), 2),
+        "por_proveedor": _group(snap.proveedor, snap.proveedor_labels, in_window, snap.costo),
+        "por_tipo": _group(snap.tipo, snap.tipo_labels, in_window, snap.costo),
+        "por_mes": _group(snap.vence_mes - base, mes_labels, in_window, snap.costo),
+    }
+
+def _expiration_report_python(store, start: date, end: date, today: date) -> Dict[str, Any]:
+    # sin NumPy: usa el índice de vencimientos del store (vence_el ya precalculado)
+    records = store.iter_records()
+    due = store.due_between(start, end)
+    groups: Dict[str, Dict[str, Dict[str, Any]]] = {"proveedor": {}, "tipo": {}, "mes": {}}
+    total_cost = 0.0
+    for r in due:
+        try:
+            costo = float(r.get("costo") or 0)
+        except Exception:
+            costo = 0.0
+        total_cost += costo
+        for name, key in (("proveedor", (r.get("proveedor") or "").strip()),
+                          ("tipo", (r.get("tipo") or "").strip()),
+                          ("mes", r["vence_el"][:7])):
+            g = groups[name].setdefault(key, {"key": key, "count": 0, "costo": 0.0})
+            g["count"] += 1
+            g["costo"] += costo
+    t_ord = today.toordinal()
+
+    def _sorted(gs):
+        return sorted(({**g, "costo": round(g["costo"], 2)} for g in gs.values()),
+                      key=lambda g: (-g["count"], g["key"]))
+
+    return {
+        "engine": "python",
+        "total": len(records),
+        "sin_fecha": sum(1 for r in records if r["_vence_ord"] is None),
+        "vencidas": sum(1 for r in records if r["_vence_ord"] is not None and r["_vence_ord"] < t_ord),
+        "en_ventana": len(due),
+        "dias_restantes_min": (due[0]["_vence_ord"] - t_ord) if due else None,
+        "costo_en_riesgo": round(total_cost, 2),
+        "por_proveedor": _sorted(groups["proveedor"]),
+        "por_tipo": _sorted(groups["tipo"]),
+        "por_mes": _sorted(groups["mes"]),
+    }
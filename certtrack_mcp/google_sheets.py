@@ -1,26 +1,151 @@
 from __future__ import annotations
+import hashlib
 import os
-from typing import List, Dict, Any, Optional
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import sys
+import threading
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
+
+# Las librerías de Google (~100 ms de import) se cargan recién al primer uso:
+# con el backend CSV/SQLite el servidor arranca sin tocarlas.
+if TYPE_CHECKING:
+    from google_auth_httplib2 import AuthorizedHttp
+    from google.oauth2.credentials import Credentials
 
 SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+DRIVE_SCOPE = "https://www.googleapis.com/auth/drive"
 TOKEN_PATH = os.path.join("certtrack_mcp", "token.json")
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT", "30"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# =========================
+# Servicio y credenciales en caché
+# =========================
+# El servicio (discovery ya resuelto) y las credenciales se construyen una vez
+# por proceso y se reconstruyen solo si token.json cambia (mtime/tamaño).
+# El transporte HTTP es uno por hilo: httplib2 no es thread-safe, pero cada
+# hilo conserva su conexión keep-alive entre llamadas.
+_LOCK = threading.Lock()
+_SERVICES: Dict[str, Any] = {}
+_CREDS: Optional[Credentials] = None
+_TOKEN_STAMP: Optional[tuple] = None
+_GENERATION = 0
+_local = threading.local()
+
+def _token_stamp() -> tuple:
+    try:
+        st = os.stat(TOKEN_PATH)
+    except FileNotFoundError:
+        raise FileNotFoundError("token.json no encontrado (ejecuta authorize_google.py).")
+    return (st.st_mtime_ns, st.st_size)
 
 def _creds():
+    from google.oauth2.credentials import Credentials
     if not os.path.exists(TOKEN_PATH):
         raise FileNotFoundError("token.json no encontrado (ejecuta authorize_google.py).")
-    return Credentials.from_authorized_user_file(TOKEN_PATH, [SHEETS_SCOPE])
+    # sin forzar scopes: al refrescar se conservan los concedidos (Sheets y Drive)
+    return Credentials.from_authorized_user_file(TOKEN_PATH)
+
+def _new_http(creds: Credentials) -> AuthorizedHttp:
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    # AuthorizedHttp refresca el access token cuando vence (y reintenta ante 401)
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+
+def _service(name: str, version: str):
+    """
+    Servicio compartido por API. Usa el documento de discovery empaquetado
+    con google-api-python-client (static_discovery), sin pedirlo por red.
+    """
+    global _CREDS, _TOKEN_STAMP, _GENERATION
+    from googleapiclient.discovery import build
+    stamp = _token_stamp()
+    with _LOCK:
+        if stamp != _TOKEN_STAMP:
+            _SERVICES.clear()
+            _CREDS = _creds()
+            _TOKEN_STAMP = stamp
+            _GENERATION += 1
+        svc = _SERVICES.get(name)
+        if svc is None:
+            svc = _SERVICES[name] = build(name, version, http=_new_http(_CREDS),
+                                          static_discovery=True, cache_discovery=False)
+        return svc
 
 def get_sheets_service():
-    return build("sheets", "v4", credentials=_creds())
+    return _service("sheets", "v4")
+
+def get_drive_service():
+    return _service("drive", "v3")
+
+def _thread_http() -> AuthorizedHttp:
+    # generación y credenciales se leen juntas: un reset_service() concurrente no
+    # puede dejar a este hilo con un transporte sobre credenciales None o viejas
+    with _LOCK:
+        generation, creds = _GENERATION, _CREDS
+    if getattr(_local, "generation", None) == generation:
+        return _local.http
+    if creds is None:
+        get_sheets_service()  # recarga credenciales tras reset_service()
+        with _LOCK:
+            generation, creds = _GENERATION, _CREDS
+    _local.http = _new_http(creds)
+    _local.generation = generation
+    return _local.http
+
+def _execute(req) -> Dict[str, Any]:
+    return req.execute(http=_thread_http())
+
+def reset_service():
+    """Descarta servicio, credenciales y transportes (p. ej. tras re-autorizar)."""
+    global _CREDS, _TOKEN_STAMP, _GENERATION
+    with _LOCK:
+        _SERVICES.clear()
+        _CREDS, _TOKEN_STAMP = None, None
+        _GENERATION += 1
+
+def is_http_error(exc: BaseException) -> bool:
+    """
+    HttpError de googleapiclient. Si la librería nunca se importó, ninguna
+    excepción puede serlo: se responde sin importarla.
+    """
+    errors = sys.modules.get("googleapiclient.errors")
+    return errors is not None and isinstance(exc, errors.HttpError)
+
+def is_retryable_error(exc: Exception) -> bool:
+    """Cuota excedida (429) o error del servidor (5xx): vale la pena reintentar."""
+    if not is_http_error(exc):
+        return False
+    try:
+        return int(exc.resp.status) in RETRYABLE_STATUS
+    except Exception:
+        return False
 
 def read_range(spreadsheet_id: str, rng: str) -> List[List[str]]:
     svc = get_sheets_service()
-    resp = svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng).execute()
+    resp = _execute(svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng))
     return resp.get("values", [])
 
+def read_ranges(spreadsheet_id: str, ranges: List[str],
+                fields: Optional[str] = "valueRanges(values)",
+                value_render_option: str = "FORMATTED_VALUE") -> List[List[List[str]]]:
+    """
+    Varios rangos A1 en una sola llamada (spreadsheets.values.batchGet).
+    Devuelve una lista de filas por rango, en el mismo orden que 'ranges'.
+    - fields: máscara de respuesta (por defecto solo los valores; None = todo).
+    - value_render_option: FORMATTED_VALUE | UNFORMATTED_VALUE | FORMULA.
+    """
+    svc = get_sheets_service()
+    kwargs: Dict[str, Any] = {
+        "spreadsheetId": spreadsheet_id,
+        "ranges": list(ranges),
+        "valueRenderOption": value_render_option,
+    }
+    if fields:
+        kwargs["fields"] = fields
+    resp = _execute(svc.spreadsheets().values().batchGet(**kwargs))
+    value_ranges = resp.get("valueRanges", [])
+    return [(value_ranges[i].get("values", []) if i < len(value_ranges) else []) for i in range(len(ranges))]
+
 def append_rows(spreadsheet_id: str, rng_start: str, rows: List[List[Any]]) -> Dict[str, Any]:
     svc = get_sheets_service()
     body = {"values": rows}
@@ -31,4 +156,34 @@ def append_rows(spreadsheet_id: str, rng_start: str, rows: List[List[Any]]) -> D
         insertDataOption="INSERT_ROWS",
         body=body
     )
-    return req.execute()
+    return _execute(req)
+
+# =========================
+# Detección de cambios (para el espejo local)
+# =========================
+_DRIVE_PROBE_OK = True
+
+def sheet_change_token(spreadsheet_id: str, tab: str) -> str:
+    """
+    Token barato que cambia cuando cambia la hoja.
+    1) Drive files.get(modifiedTime, version): una llamada de metadatos.
+    2) Si Drive no está disponible (scope/permiso), conteo + hash de la columna A
+       (ids): detecta altas y bajas, no ediciones de otras celdas; para esas el
+       espejo hace además una recarga completa periódica.
+    """
+    global _DRIVE_PROBE_OK
+    if _DRIVE_PROBE_OK:
+        try:
+            req = get_drive_service().files().get(
+                fileId=spreadsheet_id, fields="modifiedTime,version", supportsAllDrives=True)
+            meta = _execute(req)
+            return f"drive:{meta.get('version', '')}:{meta.get('modifiedTime', '')}"
+        except Exception as e:
+            if not is_http_error(e) or int(getattr(e.resp, "status", 0) or 0) not in (401, 403, 404):
+                raise
+            _DRIVE_PROBE_OK = False  # sin permiso de Drive: no se vuelve a intentar
+    ids = read_ranges(spreadsheet_id, [f"{tab}!A2:A"])[0]
+    h = hashlib.sha1()
+    for r in ids:
+        h.update((r[0] if r else "").encode("utf-8") + b"\x00")
+    return f"ids:{len(ids)}:{h.hexdigest()}"
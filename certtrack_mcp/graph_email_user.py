@@ -1,8 +1,9 @@
 # certtrack_mcp/graph_email_user.py
 from __future__ import annotations
-import os, json, time, hashlib
-from typing import Dict, Any
+import os, json, time, hashlib, threading
+from typing import Dict, Any, Optional
 import requests
+from requests.adapters import HTTPAdapter
 import msal
 
 GRAPH_BASE = "https://graph.microsoft.com/v1.0"
@@ -10,49 +11,168 @@ GRAPH_BASE = "https://graph.microsoft.com/v1.0"
 SCOPES = ["Mail.Send"]  # delegados, no ".default"
 
 CACHE_PATH = os.path.join("certtrack_mcp", "graph_user_cache.json")
+GRAPH_HTTP_TIMEOUT = float(os.getenv("GRAPH_HTTP_TIMEOUT", "30"))
+# Outlook admite pocas solicitudes simultáneas por buzón; el resto espera turno
+GRAPH_MAX_CONCURRENCY = int(os.getenv("GRAPH_MAX_CONCURRENCY", "4"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+# margen antes del vencimiento en el que el token ya no se reutiliza
+GRAPH_TOKEN_SKEW = float(os.getenv("GRAPH_TOKEN_SKEW", "300"))
+THROTTLE_STATUS = {429, 503, 504}
 
 class GraphUserEmailError(Exception):
-    pass
+    def __init__(self, message: str, status: Optional[int] = None, needs_login: bool = False):
+        super().__init__(message)
+        self.status = status  # código HTTP de Graph (None si el error no vino de la respuesta)
+        self.needs_login = needs_login  # no hay token y no se permitió el device code
+
+# =========================
+# Cliente, token y sesión en caché
+# =========================
+# La app MSAL y su caché se cargan una vez por proceso; el access token se
+# reutiliza hasta poco antes de su vencimiento (una sola adquisición a la vez,
+# así un envío masivo no dispara varios device code). La sesión HTTP es
+# compartida (keep-alive): una ráfaga de envíos usa un solo handshake TLS.
+_LOCK = threading.Lock()
+_TOKEN_LOCK = threading.Lock()
+_APP: Optional[msal.PublicClientApplication] = None
+_CACHE: Optional[msal.SerializableTokenCache] = None
+_TOKEN: Optional[str] = None
+_TOKEN_EXPIRES = 0.0
+_HTTP: Optional[requests.Session] = None
+_SLOTS = threading.BoundedSemaphore(max(1, GRAPH_MAX_CONCURRENCY))
+_PAUSED_UNTIL = 0.0  # Retry-After de Graph: nadie envía antes de este instante
+stats = {"token_acquired": 0, "sent": 0, "throttled": 0, "retries": 0}
 
 def _public_client():
-    client_id = os.getenv("MS_CLIENT_ID", "").strip()
-    if not client_id:
-        raise GraphUserEmailError("MS_CLIENT_ID vacío. Registra la app como 'Public client' y coloca el client_id.")
-    # 'consumers' funciona para cuentas personales (@outlook.com)
-    authority = "https://login.microsoftonline.com/consumers"
-    cache = msal.SerializableTokenCache()
-    if os.path.exists(CACHE_PATH):
-        cache.deserialize(open(CACHE_PATH, "r", encoding="utf-8").read())
-    app = msal.PublicClientApplication(client_id=client_id, authority=authority, token_cache=cache)
-    return app, cache
-
-def _acquire_user_token() -> str:
-    app, cache = _public_client()
-    # 1) Intenta silent
-    accounts = app.get_accounts()
-    if accounts:
-        res = app.acquire_token_silent(scopes=SCOPES, account=accounts[0])
-        if res and "access_token" in res:
-            return res["access_token"]
-
-    # 2) Device Code Flow (interactivo en consola 1a vez)
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if "user_code" not in flow:
-        raise GraphUserEmailError("No se pudo iniciar device flow.")
-    print("\n== Microsoft Device Code ==")
-    print(flow["message"])  # incluye URL y código
-    res = app.acquire_token_by_device_flow(flow)
-    if "access_token" not in res:
-        raise GraphUserEmailError(f"Error en device flow: {res.get('error_description')}")
-    # persistir cache
-    if isinstance(cache, msal.SerializableTokenCache):
+    global _APP, _CACHE
+    with _LOCK:
+        if _APP is None:
+            client_id = os.getenv("MS_CLIENT_ID", "").strip()
+            if not client_id:
+                raise GraphUserEmailError("MS_CLIENT_ID vacío. Registra la app como 'Public client' y coloca el client_id.")
+            # 'consumers' funciona para cuentas personales (@outlook.com)
+            authority = "https://login.microsoftonline.com/consumers"
+            cache = msal.SerializableTokenCache()
+            if os.path.exists(CACHE_PATH):
+                with open(CACHE_PATH, "r", encoding="utf-8") as f:
+                    cache.deserialize(f.read())
+            _APP = msal.PublicClientApplication(client_id=client_id, authority=authority, token_cache=cache)
+            _CACHE = cache
+        return _APP, _CACHE
+
+def _save_cache(cache: msal.SerializableTokenCache):
+    # persistir cache solo si MSAL la modificó (refresh token nuevo, login)
+    if cache.has_state_changed:
         with open(CACHE_PATH, "w", encoding="utf-8") as f:
             f.write(cache.serialize())
-    return res["access_token"]
 
-def send_mail_via_graph_user(to: str, subject: str, html: str) -> Dict[str, Any]:
-    token = _acquire_user_token()
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+def _acquire_user_token(interactive: bool = True) -> str:
+    global _TOKEN, _TOKEN_EXPIRES
+    if _TOKEN and time.time() < _TOKEN_EXPIRES - GRAPH_TOKEN_SKEW:
+        return _TOKEN
+    with _TOKEN_LOCK:
+        # otro hilo pudo haberlo renovado mientras esperábamos
+        if _TOKEN and time.time() < _TOKEN_EXPIRES - GRAPH_TOKEN_SKEW:
+            return _TOKEN
+        app, cache = _public_client()
+        res = None
+        # 1) Intenta silent
+        accounts = app.get_accounts()
+        if accounts:
+            res = app.acquire_token_silent(scopes=SCOPES, account=accounts[0])
+
+        # 2) Device Code Flow (interactivo en consola 1a vez)
+        if (not res or "access_token" not in res) and not interactive:
+            raise GraphUserEmailError("Se requiere iniciar sesión (device code) antes de enviar.", needs_login=True)
+        if not res or "access_token" not in res:
+            flow = app.initiate_device_flow(scopes=SCOPES)
+            if "user_code" not in flow:
+                raise GraphUserEmailError("No se pudo iniciar device flow.")
+            print("\n== Microsoft Device Code ==")
+            print(flow["message"])  # incluye URL y código
+            res = app.acquire_token_by_device_flow(flow)
+            if "access_token" not in res:
+                raise GraphUserEmailError(f"Error en device flow: {res.get('error_description')}")
+        _save_cache(cache)
+        _TOKEN = res["access_token"]
+        _TOKEN_EXPIRES = time.time() + float(res.get("expires_in") or 3600)
+        stats["token_acquired"] += 1
+        return _TOKEN
+
+def _drop_token():
+    global _TOKEN, _TOKEN_EXPIRES
+    with _TOKEN_LOCK:
+        _TOKEN, _TOKEN_EXPIRES = None, 0.0
+
+def _session() -> requests.Session:
+    global _HTTP
+    with _LOCK:
+        if _HTTP is None:
+            sess = requests.Session()
+            sess.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(1, GRAPH_MAX_CONCURRENCY)))
+            _HTTP = sess
+        return _HTTP
+
+def reset_client():
+    """Descarta app MSAL, token y sesión (p. ej. tras cambiar de cuenta)."""
+    global _APP, _CACHE, _HTTP
+    _drop_token()
+    with _LOCK:
+        _APP = _CACHE = None
+        if _HTTP is not None:
+            _HTTP.close()
+            _HTTP = None
+
+# =========================
+# Limitador (Retry-After)
+# =========================
+def _retry_after(resp: requests.Response, attempt: int) -> float:
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return min(60.0, 2.0 ** attempt)
+
+def _pause(seconds: float):
+    global _PAUSED_UNTIL
+    with _LOCK:
+        _PAUSED_UNTIL = max(_PAUSED_UNTIL, time.time() + seconds)
+
+def _wait_turn():
+    while True:
+        left = _PAUSED_UNTIL - time.time()
+        if left <= 0:
+            return
+        time.sleep(left)
+
+def _post(path: str, payload: Dict[str, Any], interactive: bool = True) -> requests.Response:
+    body = json.dumps(payload)
+    refreshed = False
+    attempt = 0
+    while True:
+        attempt += 1
+        token = _acquire_user_token(interactive)
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        _wait_turn()
+        with _SLOTS:
+            resp = _session().post(f"{GRAPH_BASE}{path}", headers=headers, data=body, timeout=GRAPH_HTTP_TIMEOUT)
+        if resp.status_code == 401 and not refreshed:
+            # token revocado o vencido antes de lo previsto: se pide otro una vez
+            refreshed = True
+            _drop_token()
+            continue
+        if resp.status_code in THROTTLE_STATUS and attempt <= GRAPH_MAX_RETRIES:
+            # Graph pide esperar: la pausa vale para todos los hilos, no solo para este
+            stats["throttled"] += 1
+            stats["retries"] += 1
+            _pause(_retry_after(resp, attempt))
+            continue
+        return resp
+
+def ensure_login() -> None:
+    """Obtiene un token (device code si hace falta) fuera de los hilos de la bandeja de salida."""
+    _acquire_user_token(interactive=True)
+
+def send_mail_via_graph_user(to: str, subject: str, html: str, interactive: bool = True) -> Dict[str, Any]:
     payload = {
         "message": {
             "subject": subject,
@@ -62,9 +182,10 @@ def send_mail_via_graph_user(to: str, subject: str, html: str) -> Dict[str, Any]
         "saveToSentItems": True
     }
     # Delegado: enviamos como el usuario autenticado -> /me/sendMail
-    resp = requests.post(f"{GRAPH_BASE}/me/sendMail", headers=headers, data=json.dumps(payload), timeout=30)
+    resp = _post("/me/sendMail", payload, interactive)
     if resp.status_code not in (200, 202):
-        raise GraphUserEmailError(f"Graph (delegado) fallo: {resp.status_code} {resp.text}")
+        raise GraphUserEmailError(f"Graph (delegado) fallo: {resp.status_code} {resp.text}", status=resp.status_code)
+    stats["sent"] += 1
 
     stamp = str(time.time())
     message_id = "graph-user-" + hashlib.sha1(f"{to}|{subject}|{stamp}".encode("utf-8")).hexdigest()[:16]
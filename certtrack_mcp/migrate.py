@@ -0,0 +1,42 @@
+# certtrack_mcp/migrate.py
+"""
+Migración única de master.csv al backend SQLite.
+
+Uso:
+    python -m certtrack_mcp.migrate                  # data/master.csv -> data/master.sqlite
+    python -m certtrack_mcp.migrate --csv otro.csv --db /ruta/master.sqlite --replace
+
+Después, arrancar el servidor con CERTTRACK_BACKEND=sqlite
+(y CERTTRACK_SQLITE_PATH si se usó otra ruta).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from .store import migrate_csv_to_sqlite
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Migra master.csv a SQLite (WAL).")
+    ap.add_argument("--csv", default=os.path.join(DATA_DIR, "master.csv"), help="CSV de origen")
+    ap.add_argument("--db", default=os.getenv("CERTTRACK_SQLITE_PATH") or os.path.join(DATA_DIR, "master.sqlite"),
+                    help="base SQLite de destino")
+    ap.add_argument("--replace", action="store_true", help="vacía la tabla de destino antes de copiar")
+    args = ap.parse_args(argv)
+
+    if not os.path.isfile(args.csv):
+        print(json.dumps({"ok": False, "error": f"no existe el CSV: {args.csv}"}, ensure_ascii=False))
+        return 1
+    t0 = time.perf_counter()
+    out = migrate_csv_to_sqlite(args.csv, args.db, replace=args.replace)
+    out["seconds"] = round(time.perf_counter() - t0, 2)
+    out["skipped_count"] = len(out["skipped"])
+    out["skipped"] = out["skipped"][:50]
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
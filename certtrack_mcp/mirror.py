@@ -0,0 +1,179 @@
+# certtrack_mcp/mirror.py
+"""
+Espejo local (SQLite) de la hoja maestra de Google Sheets.
+
+Un hilo de fondo consulta cada SHEETS_MIRROR_INTERVAL segundos un token de
+cambio barato (modifiedTime de Drive o conteo+hash de ids) y solo vuelve a
+descargar la hoja cuando el token cambia, o cada SHEETS_MIRROR_FULL_REFRESH
+segundos como red de seguridad. Las lecturas salen del espejo; si la última
+comprobación tiene más de SHEETS_MIRROR_MAX_STALENESS segundos, se sincroniza
+antes de responder. El archivo persiste entre reinicios: al arrancar basta la
+consulta del token para confirmar la copia en disco, sin descargar la hoja.
+"""
+from __future__ import annotations
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+log = logging.getLogger("certtrack.mirror")
+
+SHEETS_MIRROR_INTERVAL = float(os.getenv("SHEETS_MIRROR_INTERVAL", "15"))
+SHEETS_MIRROR_MAX_STALENESS = float(os.getenv("SHEETS_MIRROR_MAX_STALENESS", "60"))
+SHEETS_MIRROR_FULL_REFRESH = float(os.getenv("SHEETS_MIRROR_FULL_REFRESH", "600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS sheet_rows (n INTEGER PRIMARY KEY, data TEXT NOT NULL);
+"""
+
+def mirror_path(data_dir: str, spreadsheet_id: str, tab: str) -> str:
+    key = hashlib.sha1(f"{spreadsheet_id}\x00{tab}".encode("utf-8")).hexdigest()[:12]
+    return os.path.join(data_dir, f"sheets_mirror_{key}.sqlite")
+
+class SheetMirror:
+    """
+    load_rows() -> (headers, filas) descarga la hoja completa.
+    change_token() -> str cambia cuando cambia la hoja (consulta barata).
+    'revision' aumenta solo cuando el contenido descargado es distinto.
+    """
+
+    def __init__(self, db_path: str,
+                 load_rows: Callable[[], Tuple[List[str], List[List[str]]]],
+                 change_token: Callable[[], str],
+                 interval: float = SHEETS_MIRROR_INTERVAL,
+                 max_staleness: float = SHEETS_MIRROR_MAX_STALENESS,
+                 full_refresh: float = SHEETS_MIRROR_FULL_REFRESH):
+        self.db_path = db_path
+        self._load_rows = load_rows
+        self._change_token = change_token
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.full_refresh = full_refresh
+
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"probes": 0, "pulls": 0, "changes": 0, "errors": 0}
+        self.last_error: Optional[str] = None
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as db, db:
+            db.executescript(_SCHEMA)
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+        self.revision = int(meta.get("revision", "0"))
+        self.token = meta.get("token")
+        self.checksum = meta.get("checksum")
+        self.pulled_at = float(meta.get("pulled_at", "0"))
+        self.checked_at = 0.0  # lo del disco cuenta como no comprobado en este proceso
+
+    def _connect(self) -> contextlib.closing:
+        """
+        Conexión que se cierra al salir del 'with' (el 'with' de sqlite3 solo
+        confirma la transacción): 'with self._connect() as db, db:'.
+        """
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return contextlib.closing(db)
+
+    # --- lectura ---
+    def has_data(self) -> bool:
+        return self.revision > 0
+
+    def read(self) -> Tuple[List[str], List[List[str]]]:
+        with self._connect() as db, db:
+            row = db.execute("SELECT value FROM meta WHERE key='headers'").fetchone()
+            headers = json.loads(row[0]) if row else []
+            rows = [json.loads(d) for (d,) in db.execute("SELECT data FROM sheet_rows ORDER BY n")]
+        return headers, rows
+
+    def ensure_fresh(self) -> int:
+        """Sincroniza si no hay datos o si la última comprobación excede max_staleness."""
+        self.start()
+        if not self.has_data() or time.time() - self.checked_at > self.max_staleness:
+            try:
+                self.sync()
+            except Exception as e:
+                if not self.has_data():
+                    raise
+                # sin red: se responde con el espejo (más viejo de lo pedido) y se avisa
+                self.stats["errors"] += 1
+                self.last_error = str(e)
+                log.warning("sync del espejo falló; se usa la copia local: %s", e)
+        return self.revision
+
+    # --- sincronización ---
+    def sync(self, force: bool = False) -> bool:
+        """Comprueba el token y descarga si cambió. Devuelve True si el contenido cambió."""
+        with self._sync_lock:
+            now = time.time()
+            self.stats["probes"] += 1
+            token = self._change_token()
+            due_full = now - self.pulled_at > self.full_refresh
+            if not force and self.has_data() and token == self.token and not due_full:
+                self.checked_at = now
+                return False
+            headers, rows = self._load_rows()
+            self.stats["pulls"] += 1
+            payload = [json.dumps(r, ensure_ascii=False) for r in rows]
+            h = hashlib.sha1(json.dumps(headers, ensure_ascii=False).encode("utf-8"))
+            for p in payload:
+                h.update(p.encode("utf-8"))
+                h.update(b"\n")
+            checksum = h.hexdigest()
+            changed = checksum != self.checksum
+            revision = self.revision + 1 if changed else self.revision
+            with self._connect() as db, db:
+                if changed:
+                    db.execute("DELETE FROM sheet_rows")
+                    db.executemany("INSERT INTO sheet_rows (n, data) VALUES (?, ?)",
+                                   ((i + 2, p) for i, p in enumerate(payload)))
+                db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                    ("headers", json.dumps(headers, ensure_ascii=False)),
+                    ("token", token), ("checksum", checksum),
+                    ("revision", str(revision)), ("pulled_at", str(now)),
+                ])
+            self.token, self.checksum, self.revision = token, checksum, revision
+            self.pulled_at = self.checked_at = now
+            if changed:
+                self.stats["changes"] += 1
+                log.info("espejo actualizado: %d filas (revisión %d)", len(rows), revision)
+            return changed
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="sheets-mirror", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+                self.last_error = None
+            except Exception as e:
+                # la red puede fallar: se sigue sirviendo el espejo y se reintenta en el próximo ciclo
+                self.stats["errors"] += 1
+                self.last_error = str(e)
+                log.warning("sync del espejo falló: %s", e)
+
+    def status(self) -> dict:
+        now = time.time()
+        return {
+            "db": self.db_path,
+            "revision": self.revision,
+            "token": self.token,
+            "checked_s_ago": round(now - self.checked_at, 1) if self.checked_at else None,
+            "pulled_s_ago": round(now - self.pulled_at, 1) if self.pulled_at else None,
+            "last_error": self.last_error,
+            **self.stats,
+        }
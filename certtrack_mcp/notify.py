@@ -0,0 +1,188 @@
+# certtrack_mcp/notify.py
+"""
+Avisos de vencimiento en bloque: un correo resumen por destinatario.
+
+Las alertas (registros del índice de vencimientos) se agrupan por email, se
+renderiza el HTML desde una plantilla (string.Template, valores escapados) y
+los envíos salen por un pool acotado de hilos. Cada certificación avisada se
+anota en un registro local (SQLite) para que una nueva corrida no repita
+correos ya enviados.
+"""
+from __future__ import annotations
+import html
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from string import Template
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "8"))
+NOTIFY_TEMPLATE_PATH = os.getenv("NOTIFY_TEMPLATE_PATH") or os.path.join(
+    os.path.dirname(__file__), "templates", "digest.html")
+NOTIFY_MAX_ERRORS = 20
+
+_ROW = Template('<tr><td>$certificacion</td><td>$vence_el</td><td align="right">$dias</td></tr>')
+
+def load_template(path: str = NOTIFY_TEMPLATE_PATH) -> Template:
+    with open(path, encoding="utf-8") as f:
+        return Template(f.read())
+
+def notification_key(email: str, item: Dict[str, Any]) -> str:
+    # misma certificación y mismo vencimiento => mismo aviso (una renovación genera otra clave)
+    cert = (item.get("id") or item.get("certificacion") or "").strip()
+    return f"{email.lower()}|{cert}|{item.get('vence_el', '')}"
+
+def render_digest(template: Template, nombre: str, items: List[Dict[str, Any]],
+                  start: date, end: date, today: date) -> str:
+    rows = "\n    ".join(_ROW.substitute(
+        certificacion=html.escape(it.get("certificacion", "")),
+        vence_el=html.escape(it.get("vence_el", "")),
+        dias=(date.fromisoformat(it["vence_el"]) - today).days if it.get("vence_el") else "",
+    ) for it in items)
+    return template.safe_substitute(
+        nombre=html.escape(nombre), count=len(items), rows=rows,
+        desde=start.isoformat(), hasta=end.isoformat(),
+    )
+
+class SentLedger:
+    """Registro local de avisos enviados (clave -> message_id, proveedor, fecha)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sent (key TEXT PRIMARY KEY, email TEXT NOT NULL, "
+            "message_id TEXT, provider TEXT, sent_at REAL NOT NULL)")
+        self._db.commit()
+
+    def already_sent(self, keys: List[str]) -> set:
+        found: set = set()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                found.update(r[0] for r in self._db.execute(f"SELECT key FROM sent WHERE key IN ({marks})", chunk))
+        return found
+
+    def record(self, email: str, keys: List[str], message_id: str, provider: str):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO sent (key, email, message_id, provider, sent_at) VALUES (?, ?, ?, ?, ?)",
+                [(k, email, message_id, provider, now) for k in keys])
+            self._db.commit()
+
+    def set_provider(self, message_id: str, provider: str):
+        # UPDATE y no INSERT: si el mensaje ya se olvidó (falló), no lo vuelve a marcar
+        with self._lock:
+            self._db.execute("UPDATE sent SET provider = ? WHERE message_id = ?", (provider, message_id))
+            self._db.commit()
+
+    def forget_message(self, message_id: str) -> int:
+        """Borra los avisos de un mensaje que no se entregó (la próxima corrida lo reintenta)."""
+        with self._lock:
+            cur = self._db.execute("DELETE FROM sent WHERE message_id = ?", (message_id,))
+            self._db.commit()
+            return cur.rowcount
+
+def group_by_recipient(records: Iterable[Dict[str, Any]],
+                       email_of: Callable[[str], str]) -> Dict[str, Tuple[str, List[Dict[str, Any]]]]:
+    """email -> (nombre, items) recorriendo las alertas una sola vez."""
+    groups: Dict[str, Tuple[str, List[Dict[str, Any]]]] = {}
+    for rec in records:
+        nombre = (rec.get("nombre") or "").strip()
+        email = email_of(nombre)
+        item = {"id": (rec.get("id") or "").strip(),
+                "certificacion": (rec.get("certificacion") or "").strip(),
+                "vence_el": rec.get("vence_el", "")}
+        groups.setdefault(email, (nombre, []))[1].append(item)
+    return groups
+
+def notify_due(records: Iterable[Dict[str, Any]], *,
+               email_of: Callable[[str], str],
+               send: Callable[[str, str, str], Dict[str, Any]],
+               ledger: SentLedger,
+               start: date, end: date, today: Optional[date] = None,
+               subject: str = "", workers: int = NOTIFY_WORKERS,
+               dry_run: bool = False, resend: bool = False,
+               template: Optional[Template] = None,
+               reserve_id: Optional[Callable[[], str]] = None) -> Dict[str, Any]:
+    """
+    Con reserve_id (envío asíncrono, p. ej. la bandeja de salida) cada resumen se
+    anota en el registro con su id ANTES de send(..., message_id=id): el fallo
+    definitivo (que borra la anotación) puede llegar antes de que send() vuelva,
+    y una anotación posterior lo marcaría como enviado para siempre.
+    """
+    today = today or date.today()
+    template = template or load_template()
+    groups = group_by_recipient(records, email_of)
+
+    # descarta lo ya avisado (una consulta por lote de claves)
+    jobs: List[Tuple[str, str, List[Dict[str, Any]], List[str]]] = []
+    skipped = 0
+    all_keys = [notification_key(e, it) for e, (_, items) in groups.items() for it in items]
+    sent_before = set() if resend else ledger.already_sent(all_keys)
+    for email, (nombre, items) in groups.items():
+        fresh = [it for it in items if notification_key(email, it) not in sent_before]
+        skipped += len(items) - len(fresh)
+        if fresh:
+            jobs.append((email, nombre, fresh, [notification_key(email, it) for it in fresh]))
+
+    out: Dict[str, Any] = {
+        "recipients": len(groups), "alerts": sum(len(g[1]) for g in groups.values()),
+        "to_send": len(jobs), "already_notified": skipped,
+        "sent": 0, "failed": 0, "providers": {}, "errors": [],
+    }
+    if dry_run:
+        if jobs:
+            email, nombre, items, _ = jobs[0]
+            out["preview"] = {"to": email, "html": render_digest(template, nombre, items, start, end, today)}
+        return out
+
+    def _one(job):
+        email, nombre, items, keys = job
+        subj = subject or f"Recordatorio: {len(items)} certificación(es) por vencer"
+        mid = reserve_id() if reserve_id is not None else ""
+        try:
+            body = render_digest(template, nombre, items, start, end, today)
+            if mid:
+                ledger.record(email, keys, mid, "")
+                res = send(email, subj, body, message_id=mid)
+            else:
+                res = send(email, subj, body)
+        except Exception as e:
+            res = {"ok": False, "error": str(e)}
+        if not res.get("ok"):
+            if mid:
+                ledger.forget_message(mid)
+        elif mid:
+            ledger.set_provider(mid, res.get("provider", ""))
+        else:
+            ledger.record(email, keys, res.get("message_id", ""), res.get("provider", ""))
+        return email, res
+
+    def _collect(email, res):
+        if res.get("ok"):
+            out["sent"] += 1
+            prov = res.get("provider", "") or "desconocido"
+            out["providers"][prov] = out["providers"].get(prov, 0) + 1
+        else:
+            out["failed"] += 1
+            if len(out["errors"]) < NOTIFY_MAX_ERRORS:
+                out["errors"].append({"to": email, "error": res.get("error", "")})
+
+    if not jobs:
+        return out
+    # el primero va solo: si hace falta login (device code) ocurre una vez, no en cada hilo
+    _collect(*_one(jobs[0]))
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="notify") as pool:
+        futures = [pool.submit(_one, job) for job in jobs[1:]]
+        for fut in as_completed(futures):
+            _collect(*fut.result())
+    return out
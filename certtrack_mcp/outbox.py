@@ -0,0 +1,284 @@
+# certtrack_mcp/outbox.py
+"""
+Bandeja de salida persistente (SQLite) para correos.
+
+enqueue() guarda el mensaje y devuelve su id de inmediato; hilos de fondo
+(OUTBOX_WORKERS) lo entregan. Los errores transitorios (red, 429/5xx) se
+reintentan con backoff exponencial hasta OUTBOX_MAX_ATTEMPTS; los permanentes
+dejan el mensaje en 'failed' con el error. Estados:
+queued -> sending -> sent | retry -> ... | failed.
+Un mensaje en 'sending' cuyo lease vence (proceso caído a mitad de envío)
+vuelve a tomarse, así nada queda colgado entre reinicios. Mientras un envío
+está en curso su lease se renueva, y cada toma lleva un token (claim): solo
+quien tiene el token vigente puede cerrar el mensaje, así un envío lento no
+termina entregado dos veces.
+"""
+from __future__ import annotations
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger("certtrack.outbox")
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "900"))
+OUTBOX_POLL = float(os.getenv("OUTBOX_POLL", "5"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "300"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    to_addr TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    html TEXT NOT NULL,
+    quiet INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    sent_at REAL,
+    provider TEXT,
+    provider_message_id TEXT,
+    last_error TEXT,
+    claim TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_at);
+"""
+_PUBLIC = ("id", "to_addr", "subject", "status", "attempts", "created_at", "updated_at",
+           "sent_at", "next_at", "provider", "provider_message_id", "last_error")
+
+class Outbox:
+    """
+    deliver(to, subject, html, quiet) -> {"message_id", "provider"} o lanza excepción.
+    is_retryable(exc) decide si un error se reintenta.
+    on_failed(message_id), si se da, se llama antes de marcar un mensaje como
+    'failed' definitivo (p. ej. para olvidar avisos que nunca llegaron).
+    """
+
+    def __init__(self, db_path: str,
+                 deliver: Callable[[str, str, str, bool], Dict[str, Any]],
+                 is_retryable: Callable[[Exception], bool],
+                 workers: int = OUTBOX_WORKERS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_base: float = OUTBOX_BACKOFF_BASE,
+                 backoff_max: float = OUTBOX_BACKOFF_MAX,
+                 poll: float = OUTBOX_POLL,
+                 lease: float = OUTBOX_LEASE,
+                 on_failed: Optional[Callable[[str], None]] = None):
+        self.db_path = db_path
+        self._deliver = deliver
+        self._is_retryable = is_retryable
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll = poll
+        self.lease = lease
+        self._on_failed = on_failed
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, str] = {}  # id -> claim de los envíos en curso
+        self._wake = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self.stats = {"sent": 0, "retries": 0, "failed": 0}
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        cols = {r["name"] for r in self._db.execute("PRAGMA table_info(outbox)")}
+        if "claim" not in cols:  # bases creadas antes del claim
+            self._db.execute("ALTER TABLE outbox ADD COLUMN claim TEXT")
+
+    # --- API ---
+    @staticmethod
+    def new_id() -> str:
+        return "msg-" + uuid.uuid4().hex[:20]
+
+    def enqueue(self, to: str, subject: str, html: str, quiet: bool = False, message_id: str = "") -> str:
+        """
+        Persiste el mensaje (commit antes de volver) y despierta a los workers.
+        message_id (de new_id()) permite anotar el id en otro lado antes de encolar.
+        """
+        mid = message_id or self.new_id()
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO outbox (id, to_addr, subject, html, quiet, status, next_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (mid, to, subject, html, int(bool(quiet)), now, now, now))
+        self.start()
+        with self._wake:
+            self._wake.notify()
+        return mid
+
+    def status(self, ids: List[str]) -> List[Dict[str, Any]]:
+        out = []
+        with self._lock:
+            for mid in ids:
+                mid = str(mid).strip()
+                row = self._db.execute(f"SELECT {', '.join(_PUBLIC)} FROM outbox WHERE id = ?", (mid,)).fetchone()
+                out.append(dict(row) if row else {"id": mid, "status": "unknown"})
+        return out
+
+    def recent(self, limit: int = 20, status: str = "") -> List[Dict[str, Any]]:
+        sql = f"SELECT {', '.join(_PUBLIC)} FROM outbox"
+        args: list = []
+        if status:
+            sql += " WHERE status = ?"
+            args.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        args.append(max(1, int(limit)))
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, args)]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(created_at) FROM outbox WHERE status IN ('queued', 'retry', 'sending')").fetchone()[0]
+        return {
+            "db": self.db_path,
+            "by_status": counts,
+            "oldest_pending_s": round(time.time() - oldest, 1) if oldest else None,
+            "workers": self.workers if self._threads else 0,
+            **self.stats,
+        }
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._renew_leases, name="outbox-lease", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+
+    # --- internos ---
+    def _claim(self) -> Optional[Tuple[sqlite3.Row, str]]:
+        """
+        Toma el próximo mensaje vencido (transacción IMMEDIATE: válido entre procesos).
+        Devuelve (fila, claim); el claim identifica esta toma al renovar y al cerrar.
+        """
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, to_addr, subject, html, quiet, attempts FROM outbox "
+                    "WHERE (status IN ('queued', 'retry') AND next_at <= ?) "
+                    "   OR (status = 'sending' AND lease_until <= ?) "
+                    "ORDER BY next_at LIMIT 1", (now, now)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE outbox SET status = 'sending', attempts = attempts + 1, lease_until = ?, "
+                        "updated_at = ?, claim = ? WHERE id = ?", (now + self.lease, now, claim, row["id"]))
+                    self._inflight[row["id"]] = claim
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return (row, claim) if row is not None else None
+
+    def _renew_leases(self):
+        """Extiende el lease de los envíos en curso (device code, Retry-After largos, red lenta)."""
+        every = max(0.05, self.lease / 3)
+        while not self._stop.wait(every):
+            now = time.time()
+            with self._lock:
+                for mid, claim in list(self._inflight.items()):
+                    self._db.execute(
+                        "UPDATE outbox SET lease_until = ? WHERE id = ? AND status = 'sending' AND claim = ?",
+                        (now + self.lease, mid, claim))
+
+    def _finish(self, mid: str, claim: str, sql: str, args: tuple) -> bool:
+        """Cierra el envío solo si este worker conserva la toma; False si otro la reclamó."""
+        with self._lock:
+            self._inflight.pop(mid, None)
+            cur = self._db.execute(sql + " WHERE id = ? AND status = 'sending' AND claim = ?", args + (mid, claim))
+        if cur.rowcount == 0:
+            log.warning("outbox: %s ya no pertenece a este worker (lease vencido); no se actualiza", mid)
+            return False
+        return True
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            nxt = self._db.execute(
+                "SELECT MIN(next_at) FROM outbox WHERE status IN ('queued', 'retry')").fetchone()[0]
+        if nxt is None:
+            return self.poll
+        return min(self.poll, max(0.0, nxt - time.time()))
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self._claim()
+            except sqlite3.OperationalError as e:
+                # base ocupada por otro proceso: se reintenta en el próximo ciclo
+                log.warning("outbox: no se pudo tomar mensaje: %s", e)
+                claimed = None
+            if claimed is None:
+                with self._wake:
+                    self._wake.wait(self._next_due_in())
+                continue
+            self._send(*claimed)
+
+    def _send(self, row: sqlite3.Row, claim: str):
+        attempt = row["attempts"] + 1
+        try:
+            res = self._deliver(row["to_addr"], row["subject"], row["html"], bool(row["quiet"])) or {}
+        except Exception as e:
+            self._fail(row["id"], claim, attempt, e)
+            return
+        now = time.time()
+        if self._finish(row["id"], claim,
+                        "UPDATE outbox SET status = 'sent', sent_at = ?, updated_at = ?, lease_until = NULL, "
+                        "provider = ?, provider_message_id = ?, last_error = NULL, claim = NULL",
+                        (now, now, res.get("provider", ""), res.get("message_id", ""))):
+            self.stats["sent"] += 1
+
+    def _fail(self, mid: str, claim: str, attempt: int, e: Exception):
+        now = time.time()
+        retry = self._is_retryable(e) and attempt < self.max_attempts
+        if retry:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+            delay *= random.uniform(0.5, 1.0)  # jitter para no sincronizar reintentos
+            self.stats["retries"] += 1
+            log.warning("outbox: envío %s falló (%s); reintento %d en %.0fs", mid, e, attempt, delay)
+        else:
+            delay = 0.0
+            self.stats["failed"] += 1
+            log.error("outbox: envío %s descartado tras %d intento(s): %s", mid, attempt, e)
+            if self._on_failed is not None:
+                # antes de persistir 'failed': si el proceso cae justo aquí el mensaje se reintenta,
+                # a lo sumo se repite un aviso, nunca se pierde
+                try:
+                    self._on_failed(mid)
+                except Exception as cb_err:
+                    log.warning("outbox: on_failed(%s) falló: %s", mid, cb_err)
+        self._finish(mid, claim,
+                     "UPDATE outbox SET status = ?, next_at = ?, updated_at = ?, lease_until = NULL, "
+                     "last_error = ?, claim = NULL",
+                     ("retry" if retry else "failed", now + delay, now, str(e)[:1000]))
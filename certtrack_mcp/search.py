@@ -0,0 +1,255 @@
+# certtrack_mcp/search.py
+"""
+Índice de búsqueda sobre 'nombre' y 'certificacion'.
+
+Los textos se pliegan (minúsculas, sin acentos ni signos) y se parten en
+tokens. Índice invertido token -> filas, vocabulario ordenado para prefijos
+("lop" -> "lopez") y trigramas del vocabulario para candidatos con errores de
+tipeo (distancia de edición acotada). El índice se reconstruye solo cuando
+cambia el store (snapshot_key), igual que el snapshot columnar.
+"""
+from __future__ import annotations
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Tuple
+
+FIELDS = ("nombre", "certificacion")
+FIELD_WEIGHT = {"nombre": 1.0, "certificacion": 0.8}
+EXACT, PREFIX, FUZZY = 1.0, 0.85, 0.7
+MAX_EXPANSIONS = 64  # tokens del vocabulario por término (prefijo o fuzzy)
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_FOLD_CACHE: Dict[str, str] = {}
+
+def fold(text: str) -> str:
+    """'Laura López-Díaz' -> 'laura lopez diaz'."""
+    text = text or ""
+    out = _FOLD_CACHE.get(text)
+    if out is None:
+        t = unicodedata.normalize("NFKD", text.lower())
+        t = "".join(c for c in t if not unicodedata.combining(c))
+        out = _NON_ALNUM.sub(" ", t).strip()
+        if len(_FOLD_CACHE) < 200_000:  # los nombres se repiten mucho entre filas
+            _FOLD_CACHE[text] = out
+    return out
+
+def _trigrams(token: str) -> set:
+    t = f" {token} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein con corte: devuelve limit+1 si se pasa."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        best = i
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            best = min(best, cur[j])
+        if best > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+class SearchIndex:
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records: List[Dict[str, Any]] = []
+        # postings[campo][token] = posiciones en records
+        self.postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in FIELDS}
+        # nombre plegado completo -> posiciones (para "laura lopez" == "Laura López")
+        self.by_name: Dict[str, List[int]] = {}
+        self.vocab: List[str] = []
+        self.trigrams: Dict[str, List[str]] = {}
+        self.extend(records)
+
+    def extend(self, records: List[Dict[str, Any]]):
+        """Agrega filas nuevas al índice (las altas no obligan a reconstruirlo)."""
+        self._add(records, cow=False)
+
+    def extended(self, records: List[Dict[str, Any]]) -> "SearchIndex":
+        """
+        Copia del índice con las filas nuevas; este queda intacto (otros hilos
+        pueden estar consultándolo). Se comparten las listas que no cambian:
+        solo se copian los diccionarios y las listas que reciben posiciones.
+        """
+        idx = SearchIndex.__new__(SearchIndex)
+        idx.records = list(self.records)
+        idx.postings = {f: dict(p) for f, p in self.postings.items()}
+        idx.by_name = dict(self.by_name)
+        idx.vocab = list(self.vocab)
+        idx.trigrams = dict(self.trigrams)
+        idx._add(records, cow=True)
+        return idx
+
+    def _add(self, records: List[Dict[str, Any]], cow: bool):
+        owned = set()  # id() de las listas propias de este índice (copiadas o nuevas)
+
+        def _append(d: Dict[str, List], key: str, value):
+            lst = d.get(key)
+            if lst is None or (cow and id(lst) not in owned):
+                lst = d[key] = list(lst or ())
+                owned.add(id(lst))
+            lst.append(value)
+
+        new_tokens = set()
+        known = self.postings["nombre"].keys() | self.postings["certificacion"].keys()
+        for rec in records:
+            pos = len(self.records)
+            self.records.append(rec)
+            for field in FIELDS:
+                folded = fold(rec.get(field, ""))
+                if field == "nombre" and folded:
+                    _append(self.by_name, folded, pos)
+                plist = self.postings[field]
+                for tok in set(folded.split()):
+                    _append(plist, tok, pos)
+                    if tok not in known:
+                        new_tokens.add(tok)
+        if not new_tokens:
+            return
+        if len(new_tokens) > 64:
+            self.vocab = sorted(set(self.vocab) | new_tokens)
+        else:
+            for tok in new_tokens:
+                bisect.insort(self.vocab, tok)
+        for tok in new_tokens:
+            for g in _trigrams(tok):
+                _append(self.trigrams, g, tok)
+
+    # --- términos ---
+    def expand(self, term: str) -> Dict[str, float]:
+        """Tokens del vocabulario que corresponden a 'term', con su puntaje."""
+        out: Dict[str, float] = {}
+        i = bisect.bisect_left(self.vocab, term)
+        if i < len(self.vocab) and self.vocab[i] == term:
+            out[term] = EXACT
+        if len(term) >= 2:
+            j = i
+            while j < len(self.vocab) and self.vocab[j].startswith(term) and len(out) < MAX_EXPANSIONS:
+                out.setdefault(self.vocab[j], PREFIX)
+                j += 1
+        if not out and len(term) >= 3:
+            out.update(self._fuzzy(term))
+        return out
+
+    def _fuzzy(self, term: str) -> Dict[str, float]:
+        limit = 1 if len(term) <= 5 else 2
+        grams = _trigrams(term)
+        overlap: Dict[str, int] = {}
+        for g in grams:
+            for tok in self.trigrams.get(g, ()):
+                overlap[tok] = overlap.get(tok, 0) + 1
+        need = max(1, len(grams) - 3 * limit)  # cada edición rompe a lo sumo 3 trigramas
+        cands = sorted((t for t, n in overlap.items() if n >= need), key=lambda t: -overlap[t])[:MAX_EXPANSIONS]
+        out = {}
+        for tok in cands:
+            d = _edit_distance(term, tok, limit)
+            if d <= limit:
+                out[tok] = FUZZY - 0.1 * (d - 1)
+        return out
+
+    def _levels(self, term: str, fields: Tuple[str, ...]) -> List[Tuple[float, set]]:
+        """Posiciones que corresponden a 'term', agrupadas por peso (mayor primero)."""
+        by_weight: Dict[float, List[List[int]]] = {}
+        for tok, score in self.expand(term).items():
+            for field in fields:
+                plist = self.postings[field].get(tok)
+                if plist:
+                    by_weight.setdefault(round(score * FIELD_WEIGHT[field], 4), []).append(plist)
+        return sorted(((w, set().union(*lists)) for w, lists in by_weight.items()),
+                      key=lambda x: -x[0])
+
+    # --- consultas ---
+    def search(self, query: str, limit: int = 20, fields: Tuple[str, ...] = FIELDS,
+               require_all: bool = False) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Ranking: primero las filas que cubren todos los términos; luego por puntaje
+        (exacto > prefijo > fuzzy, 'nombre' pesa más que 'certificacion').
+        Con require_all=True no se devuelven coincidencias parciales.
+        Se opera con conjuntos por nivel de peso: solo se puntúa fila a fila
+        la intersección (o la unión, si nada cubre todos los términos).
+        """
+        full = fold(query)
+        terms = full.split()
+        if not terms:
+            return []
+        per_term = [self._levels(t, fields) for t in terms]
+        matched = [set().union(*(s for _, s in lv)) if lv else set() for lv in per_term]
+        pool = set.intersection(*sorted(matched, key=len))
+        complete = bool(pool)
+        if not complete:
+            if require_all:
+                return []
+            pool = set().union(*matched)
+        bonus = set(self.by_name.get(full, ())) if "nombre" in fields else set()
+        n = len(terms)
+        k = max(0, limit) or len(pool)
+
+        if n == 1 and complete:
+            # un término: el puntaje es el del nivel; se llena por niveles hasta 'limit'
+            out: List[Tuple[float, int]] = [(round(per_term[0][0][0] + 0.5, 4), p) for p in sorted(bonus & pool)]
+            taken = set(p for _, p in out)
+            for w, positions in per_term[0]:
+                if len(out) >= k:
+                    break
+                fresh = sorted(positions - taken)[:k - len(out)]
+                out.extend((round(w, 4), p) for p in fresh)
+                taken.update(fresh)
+            return [(score, self.records[p]) for score, p in out[:k]]
+
+        def _score(pos: int) -> float:
+            covered, total = 0, 0.0
+            for lv in per_term:
+                for w, positions in lv:
+                    if pos in positions:
+                        covered += 1
+                        total += w
+                        break
+            return total / n * (covered / n) + (0.5 if pos in bonus else 0.0)
+
+        best = heapq.nsmallest(k, ((-_score(p), p) for p in pool))
+        return [(round(-neg, 4), self.records[p]) for neg, p in best]
+
+    def by_folded_name(self, nombre: str) -> List[Dict[str, Any]]:
+        return [self.records[p] for p in self.by_name.get(fold(nombre), [])]
+
+    def suggest_names(self, nombre: str, limit: int = 5, require_all: bool = False) -> List[Tuple[str, float]]:
+        """Nombres distintos más parecidos, con el mejor puntaje de cada uno."""
+        best: Dict[str, Tuple[str, float]] = {}
+        for score, rec in self.search(nombre, limit=0, fields=("nombre",), require_all=require_all):
+            key = fold(rec.get("nombre", ""))
+            if key not in best or score > best[key][1]:
+                best[key] = (rec.get("nombre", ""), score)
+        return sorted(best.values(), key=lambda x: -x[1])[:limit]
+
+_INDEX_LOCK = threading.Lock()
+_INDEXES: Dict[int, tuple] = {}
+
+def index_for(store) -> SearchIndex:
+    """
+    Índice reutilizable mientras el store no cambie. Si solo hubo altas (las
+    filas previas siguen siendo los mismos objetos), se extiende una copia en
+    lugar de reconstruirlo; el índice publicado nunca se modifica, así que las
+    búsquedas en curso no necesitan lock.
+    """
+    key = store.snapshot_key()
+    with _INDEX_LOCK:
+        cached = _INDEXES.get(id(store))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        records = store.iter_records()
+        if cached is not None:
+            idx = cached[1]
+            n = len(idx.records)
+            if n and len(records) >= n and records[0] is idx.records[0] and records[n - 1] is idx.records[-1]:
+                idx = idx.extended(records[n:])
+                _INDEXES[id(store)] = (key, idx)
+                return idx
+        idx = SearchIndex(records)
+        _INDEXES[id(store)] = (key, idx)
+        return idx
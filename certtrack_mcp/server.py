@@ -1,18 +1,67 @@
 # certtrack_mcp/server.py
 import os
 import csv
-from dateutil.relativedelta import relativedelta
+import json
+import time
+import logging
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime
-from googleapiclient.errors import HttpError
-from .google_sheets import read_range, append_rows
+from datetime import date, datetime
+from .google_sheets import read_ranges, append_rows, is_http_error, is_retryable_error, sheet_change_token
+from .mirror import SheetMirror, mirror_path
+from .store import (
+    HEADERS, CertStore, CsvCertStore, SheetsCertStore, SqliteCertStore, DuplicateIdError,
+    get_store, peek_store,
+)
+from .search import index_for
+from .notify import NOTIFY_WORKERS, SentLedger, notify_due
+from .outbox import Outbox
+from .write_behind import AppendQueue, call_with_backoff, register_for_exit
 
 
 # SDK servidor MCP (está en mcp[cli])
 from mcp.server.fastmcp import FastMCP
 
+# Herramientas síncronas (Sheets/Graph/CSV/SQLite) en un pool de hilos acotado:
+# el event loop sigue atendiendo otras solicitudes mientras una espera red o disco.
+CERTTRACK_WORKERS = int(os.getenv("CERTTRACK_WORKERS", "8"))
+_TOOL_POOL: ThreadPoolExecutor | None = None
+_TOOL_POOL_LOCK = threading.Lock()
+
+def _tool_pool() -> ThreadPoolExecutor:
+    global _TOOL_POOL
+    with _TOOL_POOL_LOCK:
+        if _TOOL_POOL is None:
+            _TOOL_POOL = ThreadPoolExecutor(max_workers=max(1, CERTTRACK_WORKERS), thread_name_prefix="certtrack-tool")
+        return _TOOL_POOL
+
+class CertTrackMCP(FastMCP):
+    """FastMCP cuyas herramientas síncronas corren en _tool_pool() en lugar del event loop."""
+
+    def tool(self, *args, **kwargs):
+        register = super().tool(*args, **kwargs)
+
+        def deco(fn):
+            if inspect.iscoroutinefunction(fn):
+                return register(fn)
+
+            @functools.wraps(fn)
+            async def run_in_pool(*a, **kw):
+                if not _BACKGROUND_STARTED:
+                    _start_background()  # proceso de reserva promovido: arranca lo diferido
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(_tool_pool(), functools.partial(fn, *a, **kw))
+
+            register(run_in_pool)
+            return fn  # el nombre del módulo sigue siendo la función síncrona
+        return deco
+
 # Nombre del server (así lo verá el cliente)
-mcp = FastMCP("CertTrack-MCP")
+mcp = CertTrackMCP("CertTrack-MCP")
 
 # Carga variables (luego usaremos GOOGLE_SHEETS_MASTER_ID, etc.)
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
@@ -22,18 +71,28 @@ SHEET_TAB = os.getenv("GOOGLE_SHEETS_TAB", "Master")
 
 CSV_PATH = os.path.join("certtrack_mcp", "data", "master.csv")
 
-HEADERS = [
-    "id","certificacion","nombre","fecha",
-    "vigencia_meses","proveedor","tipo","costo","drive_file_id"
-]
 HEADER_RANGE = f"{SHEET_TAB}!A1:I1"
 DATA_RANGE   = f"{SHEET_TAB}!A2:I"
 
+# Altas a Sheets en diferido y por lotes (0 = un values.append por fila, síncrono)
+SHEETS_WRITE_BEHIND = os.getenv("SHEETS_WRITE_BEHIND", "1").lower() not in ("0", "false", "no")
+# Espejo local SQLite de la hoja (0 = recarga completa por TTL, sin espejo)
+SHEETS_MIRROR = os.getenv("SHEETS_MIRROR", "1").lower() not in ("0", "false", "no")
+
+# Correo por bandeja de salida persistente (0 = envío síncrono dentro de la llamada)
+EMAIL_OUTBOX = os.getenv("EMAIL_OUTBOX", "1").lower() not in ("0", "false", "no")
+
+# Importación masiva: filas por llamada a values.append (límite de tamaño de request)
+SHEETS_IMPORT_CHUNK_ROWS = int(os.getenv("SHEETS_IMPORT_CHUNK_ROWS", "5000"))
+
 
 DATA_CSV = os.path.join(os.path.dirname(__file__), "data", "master.csv")
-os.makedirs(os.path.dirname(DATA_CSV), exist_ok=True)
-# Si no existe un CSV maestro local, creamos uno de ejemplo
-if not os.path.isfile(DATA_CSV):
+
+def _ensure_sample_csv():
+    # Si no existe un CSV maestro local, creamos uno de ejemplo (al primer uso, no al importar)
+    if os.path.isfile(DATA_CSV):
+        return
+    os.makedirs(os.path.dirname(DATA_CSV), exist_ok=True)
     with open(DATA_CSV, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(["id","certificacion","nombre","fecha","vigencia_meses","proveedor","tipo","costo","drive_file_id"])
@@ -43,143 +102,219 @@ if not os.path.isfile(DATA_CSV):
 def _parse_date(yyyy_mm_dd: str) -> datetime:
     return datetime.strptime(yyyy_mm_dd, "%Y-%m-%d")
 
-def _vence_el(fecha: str, vigencia_meses: int) -> str:
-    d = _parse_date(fecha) + relativedelta(months=vigencia_meses)
-    return d.strftime("%Y-%m-%d")
+# Backend de datos: auto (Sheets si está configurado, si no CSV) | csv | sheets | sqlite
+CERTTRACK_BACKEND = os.getenv("CERTTRACK_BACKEND", "auto").strip().lower()
+DATA_SQLITE = os.getenv("CERTTRACK_SQLITE_PATH") or os.path.join(os.path.dirname(__file__), "data", "master.sqlite")
 
 def _use_sheets() -> bool:
     # Sheets solo si hay ID y credenciales listas
     return bool(SHEET_ID) and os.path.exists(os.path.join("certtrack_mcp","token.json"))
 
-def _ensure_csv_exists():
-    os.makedirs(os.path.dirname(DATA_CSV), exist_ok=True)
-    if not os.path.isfile(DATA_CSV):
-        with open(DATA_CSV, "w", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([
-                "id","certificacion","nombre","fecha","vigencia_meses","proveedor","tipo","costo","drive_file_id"
-            ])
-
-def _read_all_rows_csv():
-    _ensure_csv_exists()
-    with open(DATA_CSV, newline="", encoding="utf-8") as f:
-        rows = list(csv.reader(f))
-    if not rows:
-        return HEADERS, []
-    return rows[0], rows[1:]
-
-def _normalize_headers(hs):
-    return [h.strip().lower() for h in hs]
-
-def _as_row_from_payload(payload: dict, headers_lower: list[str]) -> list[str]:
-    p = {k.lower(): v for k, v in payload.items()}
-    return [str(p.get(h, "")) for h in headers_lower]
-
 def _load_sheet_rows():
-    headers = read_range(SHEET_ID, HEADER_RANGE)
+    # encabezado + datos en un solo viaje (values.batchGet)
+    headers, data = read_ranges(SHEET_ID, [HEADER_RANGE, DATA_RANGE])
     headers = headers[0] if headers else HEADERS
-    data = read_range(SHEET_ID, DATA_RANGE)
     return headers, data
 
+def _append_sheet_rows(rows: list[list[str]]):
+    return append_rows(SHEET_ID, f"{SHEET_TAB}!A1", rows)  # values.append (USER_ENTERED)
+
+def _on_append_failed(tickets: list[dict]):
+    # las filas descartadas ya estaban en el índice: se fuerza una recarga desde la hoja
+    store = peek_store("sheets")
+    if store is not None:
+        store.invalidate()
+
+_WRITE_QUEUE: AppendQueue | None = None
+
+# las herramientas corren en varios hilos: los singletons perezosos se crean bajo este lock
+_INIT_LOCK = threading.RLock()
+
+def _write_queue() -> AppendQueue:
+    global _WRITE_QUEUE
+    with _INIT_LOCK:
+        if _WRITE_QUEUE is None:
+            _WRITE_QUEUE = register_for_exit(AppendQueue(_append_sheet_rows, is_retryable_error, _on_append_failed))
+        return _WRITE_QUEUE
+
+def _append_sheet_row(row_out: list[str], rid: str = ""):
+    if SHEETS_WRITE_BEHIND:
+        return _write_queue().submit(row_out, rid)
+    return _append_sheet_rows([row_out])
+
+def _append_sheet_rows_bulk(rows: list[list[str]]):
+    # importación: escritura directa (sin cola), en trozos y con backoff ante 429/5xx
+    for i in range(0, len(rows), SHEETS_IMPORT_CHUNK_ROWS):
+        chunk = rows[i:i + SHEETS_IMPORT_CHUNK_ROWS]
+        call_with_backoff(lambda: _append_sheet_rows(chunk), is_retryable_error)
+
+def _pending_sheet_rows() -> list[list[str]]:
+    return _WRITE_QUEUE.pending_rows() if _WRITE_QUEUE is not None else []
+
+_MIRROR: SheetMirror | None = None
+
+def _sheet_mirror() -> SheetMirror | None:
+    global _MIRROR
+    with _INIT_LOCK:
+        if SHEETS_MIRROR and _MIRROR is None:
+            _MIRROR = SheetMirror(
+                mirror_path(os.path.dirname(DATA_CSV), SHEET_ID, SHEET_TAB),
+                _load_sheet_rows, lambda: sheet_change_token(SHEET_ID, SHEET_TAB),
+            )
+        return _MIRROR
+
+def _backend() -> str:
+    if CERTTRACK_BACKEND in ("csv", "sheets", "sqlite"):
+        return CERTTRACK_BACKEND
+    return "sheets" if _use_sheets() else "csv"
+
+def _get_store() -> CertStore:
+    """Store del proceso para el backend activo (todos comparten la interfaz de CertStore)."""
+    backend = _backend()
+    if backend == "sqlite":
+        return get_store("sqlite", lambda: SqliteCertStore(DATA_SQLITE))
+    if backend == "sheets":
+        if not _use_sheets():
+            raise RuntimeError("CERTTRACK_BACKEND=sheets requiere GOOGLE_SHEETS_MASTER_ID y certtrack_mcp/token.json")
+        return get_store("sheets", lambda: SheetsCertStore(
+            SHEET_ID, SHEET_TAB, _load_sheet_rows, _append_sheet_row,
+            pending_rows=_pending_sheet_rows, append_rows=_append_sheet_rows_bulk,
+            mirror=_sheet_mirror()))
+    _ensure_sample_csv()
+    return get_store("csv", lambda: CsvCertStore(DATA_CSV))
+
 def _validate_date(fmtdate: str) -> None:
+    if len(fmtdate) == 10 and fmtdate[4] == "-" and fmtdate[7] == "-":
+        date.fromisoformat(fmtdate)  # camino rápido para YYYY-MM-DD exacto
+        return
     datetime.strptime(fmtdate, "%Y-%m-%d")  # YYYY-MM-DD
 
+REQUIRED_FIELDS = ["id", "certificacion", "nombre", "fecha", "vigencia_meses"]
+
+def _validate_row(row: dict) -> tuple[dict | None, str | None]:
+    """
+    Reglas de alta compartidas por sheets_append_cert y sheets_append_certs.
+    Devuelve (payload con todas las columnas, None) o (None, motivo del rechazo).
+    """
+    missing = [k for k in REQUIRED_FIELDS if not str(row.get(k, "")).strip()]
+    if missing:
+        return None, f"faltan campos obligatorios: {', '.join(missing)}"
+
+    # valida fecha
+    try:
+        _validate_date(str(row["fecha"]))
+    except Exception:
+        return None, "fecha debe tener formato YYYY-MM-DD"
+
+    # normaliza tipos
+    row = dict(row)
+    try:
+        row["vigencia_meses"] = int(row.get("vigencia_meses", 0))
+    except Exception:
+        return None, "vigencia_meses debe ser entero"
+
+    try:
+        row["costo"] = float(row.get("costo", 0) or 0)
+    except Exception:
+        return None, "costo debe ser numérico"
+
+    # completa llaves faltantes
+    return {**{k: "" for k in HEADERS}, **row}, None
+
+def _email_from_nombre(nombre: str) -> str:
+    # email simple a partir del nombre
+    parts = [p for p in nombre.split(" ") if p]
+    if len(parts) >= 2:
+        return f"{parts[0].lower()}.{parts[-1].lower()}@example.com"
+    return f"{(nombre or 'user').lower().replace(' ', '.')}@example.com"
+
+def _cert_item(rec: dict) -> dict:
+    # tipados suaves
+    try:
+        vig_meses = int(rec.get("vigencia_meses") or 0)
+    except:
+        vig_meses = 0
+    try:
+        costo = float(rec.get("costo") or 0)
+    except:
+        costo = 0.0
+    return {
+        "certificacion": rec.get("certificacion", ""),
+        "fecha": rec.get("fecha", ""),
+        "vigencia_meses": vig_meses,
+        "vence_el": rec.get("vence_el", ""),  # precalculado al cargar
+        "proveedor": rec.get("proveedor", ""),
+        "tipo": rec.get("tipo", ""),
+        "costo": costo,
+        "drive_file_id": rec.get("drive_file_id", "")
+    }
+
 @mcp.tool()
 def health() -> dict:
     """
-    Comprobación simple del servidor.
+    Comprobación simple del servidor (incluye el estado del espejo de Sheets, si existe).
     """
-    return {"ok": True, "server": "CertTrack-MCP"}
+    out = {"ok": True, "server": "CertTrack-MCP", "tool_workers": CERTTRACK_WORKERS}
+    if _MIRROR is not None:
+        out["sheets_mirror"] = _MIRROR.status()
+    if _OUTBOX is not None:
+        out["email_outbox"] = _OUTBOX.summary()
+    return out
 
 @mcp.tool()
 def list_my_certs(spreadsheet_id: str, nombre: str) -> dict:
     """
     Lista certificaciones por 'nombre' (case-insensitive).
     Lee desde Google Sheets si hay SHEET_ID + token; si no, CSV local (fallback).
+    Usa el índice por nombre del store (O(1) por consulta). Si no hay coincidencia
+    exacta prueba sin acentos ("laura lopez") y luego por tokens/prefijos/errores
+    de tipeo ("lopez"): si un solo nombre encaja, devuelve sus certificaciones
+    (match='fuzzy', matched_nombre); si hay varios, los devuelve en 'suggestions'.
     """
-    def _normalize_headers(hs):
-        return [h.strip().lower() for h in hs]
-
-    def _load_sheet_rows():
-        headers = read_range(SHEET_ID, HEADER_RANGE)
-        headers = headers[0] if headers else HEADERS
-        data = read_range(SHEET_ID, DATA_RANGE)
-        return headers, data
-
     try:
-        if SHEET_ID and os.path.exists(os.path.join("certtrack_mcp","token.json")):
-            # === Sheets ===
-            headers, data = _load_sheet_rows()
-            hnorm = _normalize_headers(headers)
-            # mapeo robusto por nombre de columna
-            needed = ["id","certificacion","nombre","fecha","vigencia_meses","proveedor","tipo","costo","drive_file_id"]
-            idx = {col: hnorm.index(col) for col in needed if col in hnorm}
-
-            out = []
-            for r in data:
-                if not r:
-                    continue
-                nm = r[idx["nombre"]] if "nombre" in idx and len(r) > idx["nombre"] else ""
-                if nm.strip().lower() == nombre.strip().lower():
-                    item = {}
-                    for col in ["certificacion","fecha","vigencia_meses","proveedor","tipo","costo","drive_file_id"]:
-                        if col in idx and len(r) > idx[col]:
-                            item[col] = r[idx[col]]
-                        else:
-                            item[col] = ""
-                    # tipados suaves
-                    try:
-                        item["vigencia_meses"] = int(item["vigencia_meses"] or 0)
-                    except:
-                        item["vigencia_meses"] = 0
-                    try:
-                        item["costo"] = float(item["costo"] or 0)
-                    except:
-                        item["costo"] = 0.0
-
-                    # calcula vence_el localmente
-                    try:
-                        vence = _vence_el(item["fecha"] or "1970-01-01", item["vigencia_meses"])
-                    except:
-                        vence = ""
-                    item["vence_el"] = vence
-                    out.append(item)
-
-            return {"ok": True, "source": "sheets", "count": len(out), "certs": out}
-
-        else:
-            # === CSV fallback ===
-            if not os.path.isfile(DATA_CSV):
-                return {"ok": True, "source": "csv", "count": 0, "certs": [], "note": "no master.csv found"}
-
-            certs = []
-            with open(DATA_CSV, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if (row.get("nombre","") or "").strip().lower() == nombre.strip().lower():
-                        try:
-                            vig_meses = int(row.get("vigencia_meses","0") or 0)
-                        except:
-                            vig_meses = 0
-                        try:
-                            costo = float(row.get("costo","0") or 0)
-                        except:
-                            costo = 0.0
-                        try:
-                            vence = _vence_el(row.get("fecha","1970-01-01"), vig_meses)
-                        except:
-                            vence = ""
-                        certs.append({
-                            "certificacion": row.get("certificacion",""),
-                            "fecha": row.get("fecha",""),
-                            "vigencia_meses": vig_meses,
-                            "vence_el": vence,
-                            "proveedor": row.get("proveedor",""),
-                            "tipo": row.get("tipo",""),
-                            "costo": costo,
-                            "drive_file_id": row.get("drive_file_id","")
-                        })
-            return {"ok": True, "source": "csv", "count": len(certs), "certs": certs}
+        store = _get_store()
+        recs, match, matched, suggestions = store.find_by_nombre(nombre), "exact", None, []
+        if not recs:
+            idx = index_for(store)
+            recs, match = idx.by_folded_name(nombre), "folded"
+            if not recs:
+                # un solo nombre que cubra todos los términos => se usa; si no, sugerencias
+                cands = idx.suggest_names(nombre, limit=5, require_all=True)
+                if len(cands) == 1:
+                    matched, match = cands[0][0], "fuzzy"
+                    recs = idx.by_folded_name(matched)
+                else:
+                    cands = cands or idx.suggest_names(nombre, limit=5)
+                    match, suggestions = "none", [c[0] for c in cands]
+            else:
+                matched = recs[0].get("nombre", "")
+        certs = [_cert_item(r) for r in recs]
+        out = {"ok": True, "source": store.source, "count": len(certs), "certs": certs, "match": match}
+        if matched:
+            out["matched_nombre"] = matched
+        if suggestions:
+            out["suggestions"] = suggestions
+        return out
+    except Exception as e:
+        return {"ok": False, "error": f"{e}"}
 
+@mcp.tool()
+def search_certs(query: str, limit: int = 20, field: str = "") -> dict:
+    """
+    Búsqueda tolerante sobre 'nombre' y 'certificacion': sin acentos ni
+    mayúsculas, por tokens, prefijos ("lop") y errores de tipeo leves.
+    'field' = "nombre" | "certificacion" restringe el campo. Resultados
+    ordenados por relevancia (score), como mucho 'limit'.
+    """
+    t0 = time.perf_counter()
+    fields = (field,) if field in ("nombre", "certificacion") else ("nombre", "certificacion")
+    try:
+        store = _get_store()
+        hits = index_for(store).search(query, limit=max(1, min(int(limit), 500)), fields=fields)
+        results = [{"score": score, "id": r.get("id", ""), "nombre": r.get("nombre", ""), **_cert_item(r)}
+                   for score, r in hits]
+        return {"ok": True, "source": store.source, "query": query, "count": len(results),
+                "results": results, "ms": round((time.perf_counter() - t0) * 1000, 1)}
     except Exception as e:
         return {"ok": False, "error": f"{e}"}
 
@@ -194,184 +329,357 @@ def sheets_append_cert(
     Requiere: id, certificacion, nombre, fecha, vigencia_meses
     Opcional: proveedor, tipo, costo, drive_file_id
     """
-    required = ["id", "certificacion", "nombre", "fecha", "vigencia_meses"]
-    missing = [k for k in required if not str(row.get(k, "")).strip()]
-    if missing:
-        return {"status": f"error: faltan campos obligatorios: {', '.join(missing)}"}
-
-    # valida fecha
-    try:
-        _validate_date(str(row["fecha"]))
-    except Exception:
-        return {"status": "error: fecha debe tener formato YYYY-MM-DD"}
+    payload, error = _validate_row(row)
+    if error:
+        return {"status": f"error: {error}"}
 
-    # normaliza tipos
     try:
-        row["vigencia_meses"] = int(row.get("vigencia_meses", 0))
-    except Exception:
-        return {"status": "error: vigencia_meses debe ser entero"}
+        # duplicado por 'id' contra el índice en memoria; la fila se agrega al índice sin releer
+        store = _get_store()
+        rec = store.append(payload)
+        if store.source == "sheets":
+            if SHEETS_WRITE_BEHIND:
+                # la fila ya cuenta para duplicados/consultas; la escritura va en el próximo lote
+                return {"status": "queued", "store": "sheets", "ticket": rec["_write"]["ticket"]}
+            return {"status": "ok", "store": "sheets"}
+        return {"status": "ok", "store": store.source, "inserted_at_row": rec["_row"]}
 
-    try:
-        row["costo"] = float(row.get("costo", 0) or 0)
-    except Exception:
-        return {"status": "error: costo debe ser numérico"}
+    except DuplicateIdError:
+        return {"status": f"error: id duplicado: {payload['id']}"}
+    except Exception as e:
+        if is_http_error(e):
+            return {"status": f"error: Sheets API error: {e}"}
+        return {"status": f"error: {e}"}
 
-    # completa llaves faltantes
-    payload = {**{k: "" for k in HEADERS}, **{k: v for k, v in row.items()}}
+def _iter_import_file(path: str, fmt: str):
+    """Lee un CSV (con encabezado) o JSONL fila a fila: (posición 1-based, dict o None, error)."""
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = [h.strip().lower() for h in next(reader, [])]
+            for i, r in enumerate(reader, start=1):
+                if not any(c.strip() for c in r):
+                    continue
+                yield i, dict(zip(header, r)), None
+    else:
+        with open(path, encoding="utf-8-sig") as f:
+            for i, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                except ValueError as e:
+                    yield i, None, f"JSON inválido: {e.msg}"
+                    continue
+                if not isinstance(obj, dict):
+                    yield i, None, "cada línea debe ser un objeto JSON"
+                    continue
+                yield i, {str(k).strip().lower(): v for k, v in obj.items()}, None
 
+@mcp.tool()
+def sheets_append_certs(
+    spreadsheet_id: str = "local",  # se ignora por ahora; usamos GOOGLE_SHEETS_MASTER_ID del .env
+    rows: list[dict] | None = None,
+    path: str = "",
+    format: str = "",
+    dry_run: bool = False,
+    max_errors: int = 50,
+) -> dict:
+    """
+    Alta masiva: 'rows' (lista de objetos) o 'path' a un archivo CSV/JSONL
+    (formato por extensión o 'format'="csv"|"jsonl"). Cada fila se valida con las
+    mismas reglas que sheets_append_cert; los ids duplicados (contra el maestro o
+    dentro del lote) se detectan en una pasada. Las filas aceptadas se escriben de
+    una vez: un values.append por lote (Sheets) o una escritura con buffer (CSV).
+    Con dry_run=true solo valida. El reporte de errores se corta en 'max_errors'.
+    """
+    t0 = time.perf_counter()
+    if rows and path:
+        return {"status": "error: usa 'rows' o 'path', no ambos"}
+    if path:
+        fmt = (format or os.path.splitext(path)[1].lstrip(".")).lower()
+        fmt = {"ndjson": "jsonl", "json": "jsonl"}.get(fmt, fmt)
+        if fmt not in ("csv", "jsonl"):
+            return {"status": "error: formato no soportado (usa csv o jsonl)"}
+        if not os.path.isfile(path):
+            return {"status": f"error: no existe el archivo: {path}"}
+        source = _iter_import_file(path, fmt)
+    else:
+        source = ((i, r if isinstance(r, dict) else None, None if isinstance(r, dict) else "cada fila debe ser un objeto")
+                  for i, r in enumerate(rows or [], start=1))
+
+    max_errors = max(0, int(max_errors))
+    errors: list[dict] = []
+    by_reason: dict[str, int] = {}
+
+    def _reject(pos: int, rid, reason: str):
+        by_reason[reason.split(":")[0]] = by_reason.get(reason.split(":")[0], 0) + 1
+        if len(errors) < max_errors:
+            errors.append({"row": pos, "id": rid, "error": reason})
+
+    received = 0
+    payloads: list[dict] = []
+    positions: list[int] = []
     try:
-        if _use_sheets():
-            # === Google Sheets ===
-            headers, data = _load_sheet_rows()
-            hnorm = _normalize_headers(headers)
-
-            # validar duplicado por 'id'
-            if "id" in hnorm:
-                id_idx = hnorm.index("id")
-                existing = {r[id_idx] for r in data if r and len(r) > id_idx}
-                if str(payload["id"]).strip() in existing:
-                    return {"status": f"error: id duplicado: {payload['id']}"}
-            else:
-                # si la hoja no tiene encabezado, usamos HEADERS canónicos
-                headers, hnorm = HEADERS, _normalize_headers(HEADERS)
+        for pos, row, err in source:
+            received += 1
+            if row is not None:
+                payload, err = _validate_row(row)
+            if err:
+                _reject(pos, (row or {}).get("id"), err)
+                continue
+            payloads.append(payload)
+            positions.append(pos)
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        return {"status": f"error: no se pudo leer el archivo: {e}"}
+
+    store = None
+    try:
+        store = _get_store()
+        if dry_run:
+            seen = store.known_ids([str(p.get("id", "")).strip() for p in payloads])
+            duplicates = []
+            for k, p in enumerate(payloads):
+                rid = str(p.get("id", "")).strip()
+                if rid in seen:
+                    duplicates.append(k)
+                seen.add(rid)
+            accepted = len(payloads) - len(duplicates)
+        else:
+            recs, duplicates = store.append_many(payloads)
+            accepted = len(recs)
+    except Exception as e:
+        if store is not None and store.source == "sheets":
+            # cualquier falla (HTTP, socket, timeout) pudo llegar tras escribir un trozo: se relee la hoja
+            store.invalidate()
+        if not is_http_error(e):
+            return {"status": f"error: {e}"}
+        return {"status": f"error: Sheets API error: {e}"}
 
-            row_out = _as_row_from_payload(payload, hnorm)
-            if len(row_out) < len(headers):
-                row_out += [""] * (len(headers) - len(row_out))
+    for k in duplicates:
+        _reject(positions[k], payloads[k].get("id"), f"id duplicado: {payloads[k].get('id')}")
+
+    errors.sort(key=lambda e: e["row"])
+    rejected = received - accepted
+    return {
+        "status": "ok",
+        "store": store.source,
+        "dry_run": bool(dry_run),
+        "received": received,
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors_by_reason": by_reason,
+        "errors": errors,
+        "errors_truncated": rejected > len(errors),
+        "ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
 
-            append_rows(SHEET_ID, f"{SHEET_TAB}!A1", [row_out])  # values.append (USER_ENTERED)
-            return {"status": "ok", "store": "sheets"}
+@mcp.tool()
+def sheets_flush(timeout: float = 30.0) -> dict:
+    """
+    Envía ya las altas pendientes de la cola write-behind y espera a que terminen.
+    Devuelve flushed=false si quedaron filas sin confirmar al vencer 'timeout'.
+    """
+    if _WRITE_QUEUE is None:
+        return {"ok": True, "flushed": True, "pending": 0, "in_flight": 0}
+    flushed = _WRITE_QUEUE.flush(timeout=max(0.0, float(timeout)))
+    return {"ok": True, "flushed": flushed, **_WRITE_QUEUE.summary()}
 
-        else:
-            # === CSV fallback ===
-            headers, data = _read_all_rows_csv()
-            hnorm = _normalize_headers(headers)
-            if "id" in hnorm:
-                id_idx = hnorm.index("id")
-                existing = {r[id_idx] for r in data if r and len(r) > id_idx}
-                if str(payload["id"]).strip() in existing:
-                    return {"status": f"error: id duplicado: {payload['id']}"}
-            else:
-                headers, hnorm = HEADERS, _normalize_headers(HEADERS)
+@mcp.tool()
+def sheets_append_status(tickets: list[int] | None = None, ids: list[str] | None = None) -> dict:
+    """
+    Estado por fila de las altas en Sheets (pending, in_flight, committed, failed),
+    consultando por número de ticket o por 'id' de certificación.
+    Sin argumentos devuelve solo el resumen de la cola.
+    """
+    if _WRITE_QUEUE is None:
+        return {"ok": True, "rows": [], "pending": 0, "in_flight": 0}
+    return {"ok": True, "rows": _WRITE_QUEUE.status(tickets, ids), **_WRITE_QUEUE.summary()}
 
-            row_out = _as_row_from_payload(payload, hnorm)
-            if len(row_out) < len(headers):
-                row_out += [""] * (len(headers) - len(row_out))
+@mcp.tool()
+def alerts_schedule_due(
+    spreadsheet_id: str,
+    days_before: int = 30,
+    from_date: str = "",
+    to_date: str = "",
+    offset: int = 0,
+    limit: int = 0,
+) -> dict:
+    """
+    Calcula certificaciones que vencen dentro de 'days_before' días.
+    Lee desde Google Sheets si hay SHEET_ID + token; si no, CSV local (fallback).
+    Opcional: ventana explícita from_date/to_date (YYYY-MM-DD) en lugar de
+    [hoy, hoy + days_before], y paginación con offset/limit (limit=0 => todo).
+    Retorna: { count, alerts: [ { email, nombre, certificacion, vence_el, sheet_row } ], next_offset? }
+    ordenadas por vencimiento.
+    """
+    from datetime import date, timedelta
+    today = date.today()
 
-            _ensure_csv_exists()
-            with open(DATA_CSV, "a", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(row_out)
+    try:
+        start = _parse_date(from_date).date() if from_date else today
+        end = _parse_date(to_date).date() if to_date else today + timedelta(days=int(days_before))
+    except Exception:
+        return {"count": 0, "alerts": [], "error": "from_date/to_date deben tener formato YYYY-MM-DD"}
 
-            # calcula número de fila (incluye encabezado)
-            with open(DATA_CSV, "r", encoding="utf-8") as f:
-                total_rows = sum(1 for _ in f)
+    try:
+        store = _get_store()
+        if store.source == "sheets" and not store.has_columns(["nombre","certificacion","fecha","vigencia_meses"]):
+            return {"count": 0, "alerts": [], "error": "Encabezados incompletos en la hoja"}
 
-            return {"status": "ok", "store": "csv", "inserted_at_row": total_rows}
+        # rango sobre el índice ordenado de vencimientos
+        due = store.due_between(start, end)
+        offset = max(int(offset or 0), 0)
+        limit = max(int(limit or 0), 0)  # negativo = sin límite, igual que 0
+        page = due[offset:offset + limit] if limit else due[offset:]
+
+        alerts = []
+        for rec in page:
+            nombre = (rec.get("nombre") or "").strip()
+            alerts.append({
+                "email": _email_from_nombre(nombre),
+                "nombre": nombre,
+                "certificacion": (rec.get("certificacion") or "").strip(),
+                "vence_el": rec["vence_el"],
+                "sheet_row": rec["_row"]
+            })
+
+        out = {"count": len(due), "alerts": alerts, "source": store.source}
+        if offset or limit:
+            out["offset"] = offset
+            if offset + len(page) < len(due):
+                out["next_offset"] = offset + len(page)
+        return out
 
-    except HttpError as e:
-        return {"status": f"error: Sheets API error: {e}"}
     except Exception as e:
-        return {"status": f"error: {e}"}
+        return {"count": 0, "alerts": [], "error": f"{e}"}
 
 @mcp.tool()
-def alerts_schedule_due(spreadsheet_id: str, days_before: int = 30) -> dict:
+def certs_expiration_report(
+    spreadsheet_id: str,
+    days_before: int = 30,
+    from_date: str = "",
+    to_date: str = "",
+) -> dict:
     """
-    Calcula certificaciones que vencen dentro de 'days_before' días.
-    Lee desde Google Sheets si hay SHEET_ID + token; si no, CSV local (fallback).
-    Retorna: { count, alerts: [ { email, certificacion, vence_el, sheet_row } ] }
+    Reporte agregado de vencimientos sobre todo el maestro (cumplimiento mensual).
+    Ventana [from_date, to_date] (YYYY-MM-DD) o, por defecto, [hoy, hoy + days_before].
+    Retorna: { total, vencidas, en_ventana, costo_en_riesgo,
+               por_proveedor/por_tipo/por_mes: [ { key, count, costo } ] }
+    Cálculo columnar con NumPy si está instalado (fallback: índice del store).
     """
-    from datetime import date
+    import time
+    from datetime import date, timedelta
+    from .columnar import expiration_report
     today = date.today()
 
     try:
-        alerts = []
-        if _use_sheets():
-            # === Sheets ===
-            headers, data = _load_sheet_rows()
-            h = _normalize_headers(headers)
-            # columnas requeridas
-            need = ["nombre","certificacion","fecha","vigencia_meses"]
-            if not all(c in h for c in need):
-                return {"count": 0, "alerts": [], "error": "Encabezados incompletos en la hoja"}
-
-            idx = {c: h.index(c) for c in need}
-            # fila 1 es encabezado; datos empiezan en A2 => row_index arranca en 2
-            row_index = 2
-            for r in data:
-                nombre = (r[idx["nombre"]] if len(r) > idx["nombre"] else "").strip()
-                cert   = (r[idx["certificacion"]] if len(r) > idx["certificacion"] else "").strip()
-                fecha  = (r[idx["fecha"]] if len(r) > idx["fecha"] else "").strip()
-                try:
-                    vig_m = int((r[idx["vigencia_meses"]] if len(r) > idx["vigencia_meses"] else "0") or 0)
-                except:
-                    vig_m = 0
-
-                # calcula vence_el
-                try:
-                    vence = _parse_date(fecha) + relativedelta(months=vig_m)
-                    dias_restantes = (vence.date() - today).days
-                except:
-                    row_index += 1
-                    continue
+        start = _parse_date(from_date).date() if from_date else today
+        end = _parse_date(to_date).date() if to_date else today + timedelta(days=int(days_before))
+    except Exception:
+        return {"ok": False, "error": "from_date/to_date deben tener formato YYYY-MM-DD"}
 
-                if 0 <= dias_restantes <= int(days_before):
-                    # email simple a partir del nombre
-                    parts = [p for p in nombre.split(" ") if p]
-                    if len(parts) >= 2:
-                        email = f"{parts[0].lower()}.{parts[-1].lower()}@example.com"
-                    else:
-                        email = f"{(nombre or 'user').lower().replace(' ', '.')}@example.com"
+    try:
+        t0 = time.perf_counter()
+        store = _get_store()
+        report = expiration_report(store, start, end, today)
+        return {
+            "ok": True, "source": store.source,
+            "from_date": start.isoformat(), "to_date": end.isoformat(),
+            **report,
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+        }
+    except Exception as e:
+        return {"ok": False, "error": f"{e}"}
 
-                    alerts.append({
-                        "email": email,
-                        "certificacion": cert,
-                        "vence_el": vence.strftime("%Y-%m-%d"),
-                        "sheet_row": row_index
-                    })
-                row_index += 1
+def _deliver_email(to_s: str, subj: str, body: str, quiet: bool = False, interactive: bool = True) -> dict:
+    """
+    Entrega directa por el proveedor configurado (Graph delegado / aplicación).
+    Si el proveedor falla se lanza la excepción (la bandeja de salida decide si
+    reintenta); el MOCK se usa solo cuando no hay proveedor configurado.
+    interactive=False nunca abre el device code (falla con needs_login).
+    """
+    mode = (os.getenv("MS_AUTH_MODE", "user") or "user").lower()
+    # 1) Modo usuario (delegado) para cuentas personales
+    if mode == "user" and os.getenv("MS_CLIENT_ID", "").strip():
+        try:
+            from .graph_email_user import send_mail_via_graph_user
+        except ImportError:
+            send_mail_via_graph_user = None  # msal no instalado: sin proveedor
+        if send_mail_via_graph_user is not None:
+            res = send_mail_via_graph_user(to_s, subj, body, interactive=interactive)
+            return {"ok": True, "message_id": res.get("message_id",""), "provider": "graph_user"}
 
-            return {"count": len(alerts), "alerts": alerts, "source": "sheets"}
+    # 2) Modo aplicación (si el usuario decide configurarlo)
+    if mode == "app":
+        try:
+            from .graph_email import send_mail_via_graph
+        except ImportError:
+            send_mail_via_graph = None
+        if send_mail_via_graph is not None:
+            res = send_mail_via_graph(to_s, subj, body)
+            return {"ok": True, "message_id": res.get("message_id",""), "provider": "graph"}
 
-        else:
-            # === CSV fallback (tu lógica actual) ===
-            if not os.path.isfile(DATA_CSV):
-                return {"count": 0, "alerts": [], "note": "no master.csv found", "source": "csv"}
-
-            with open(DATA_CSV, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                row_index = 1  # +1 por encabezado; DictReader arranca en datos
-                for row in reader:
-                    row_index += 1
-                    try:
-                        vig_meses = int(row.get("vigencia_meses", "0") or 0)
-                    except:
-                        vig_meses = 0
-                    fecha = row.get("fecha", "1970-01-01")
-                    try:
-                        vence = _parse_date(fecha) + relativedelta(months=vig_meses)
-                        dias_restantes = (vence.date() - today).days
-                    except:
-                        continue
-
-                    if 0 <= dias_restantes <= int(days_before):
-                        nombre = (row.get("nombre", "") or "").strip()
-                        parts = [p for p in nombre.split(" ") if p]
-                        if len(parts) >= 2:
-                            email = f"{parts[0].lower()}.{parts[-1].lower()}@example.com"
-                        else:
-                            email = f"{(nombre or 'user').lower().replace(' ', '.') }@example.com"
-
-                        alerts.append({
-                            "email": email,
-                            "certificacion": row.get("certificacion", ""),
-                            "vence_el": vence.strftime("%Y-%m-%d"),
-                            "sheet_row": row_index
-                        })
-
-            return {"count": len(alerts), "alerts": alerts, "source": "csv"}
+    # 3) MOCK (no hay config)
+    import time, hashlib
+    stamp = str(time.time())
+    message_id = "mock-" + hashlib.sha1(f"{to_s}|{subj}|{stamp}".encode("utf-8")).hexdigest()[:16]
+    if not quiet:
+        # stdout es el canal MCP (y esto puede correr en los hilos del outbox): va al log (warning:
+        # sin handlers configurados es el nivel que llega a stderr)
+        logging.getLogger("certtrack").warning(
+            "MOCK OUTLOOK SEND | to=%s | subject=%s | message_id=%s | html (preview 200): %s%s",
+            to_s, subj, message_id, body[:200], "..." if len(body) > 200 else "",
+        )
+    return {"ok": True, "message_id": message_id, "provider": "mock"}
 
-    except Exception as e:
-        return {"count": 0, "alerts": [], "error": f"{e}"}
+def _is_transient_mail_error(e: Exception) -> bool:
+    # red caída, timeouts y 408/429/5xx de Graph se reintentan; lo demás es permanente
+    try:
+        import requests
+        if isinstance(e, requests.RequestException):
+            return True
+    except ImportError:
+        pass
+    if getattr(e, "needs_login", False):
+        return True  # se entrega cuando alguien complete el login (ver _ensure_mail_login)
+    status = getattr(e, "status", None)
+    return status in (408, 429) or (isinstance(status, int) and status >= 500)
+
+def _deliver_outbox(to_s: str, subj: str, body: str, quiet: bool = False) -> dict:
+    # en un worker de la bandeja no hay nadie para un device code: sin token válido se reintenta luego
+    return _deliver_email(to_s, subj, body, quiet=quiet, interactive=False)
+
+def _ensure_mail_login():
+    """
+    Con Graph delegado, el device code (si hace falta) ocurre aquí, en la llamada
+    a la herramienta, antes de encolar; los workers de la bandeja nunca lo piden.
+    """
+    mode = (os.getenv("MS_AUTH_MODE", "user") or "user").lower()
+    if mode != "user" or not os.getenv("MS_CLIENT_ID", "").strip():
+        return
+    try:
+        from .graph_email_user import ensure_login
+    except ImportError:
+        return  # msal no instalado: sin proveedor (MOCK)
+    ensure_login()
+
+def _forget_notified(message_id: str):
+    # un resumen que terminó en 'failed' no cuenta como aviso: la próxima corrida lo vuelve a enviar
+    n = _sent_ledger().forget_message(message_id)
+    if n:
+        logging.getLogger("certtrack").warning("aviso %s no entregado: %d vencimiento(s) vuelven a quedar pendientes", message_id, n)
+
+_OUTBOX: Outbox | None = None
+
+def _outbox() -> Outbox:
+    global _OUTBOX
+    with _INIT_LOCK:
+        if _OUTBOX is None:
+            _OUTBOX = Outbox(os.path.join(os.path.dirname(DATA_CSV), "outbox.sqlite"),
+                             deliver=_deliver_outbox, is_retryable=_is_transient_mail_error,
+                             on_failed=_forget_notified)
+        return _OUTBOX
 
 @mcp.tool()
 def outlook_send_email(to: str, subject: str, html: str) -> dict:
@@ -379,7 +687,10 @@ def outlook_send_email(to: str, subject: str, html: str) -> dict:
     Envío de correo:
     - Si MS_AUTH_MODE=user => usa OAuth delegado (Device Code) con cuenta @outlook.com
     - Si MS_AUTH_MODE=app  => usa credenciales de aplicación (si están configuradas)
-    - Si falla o falta config => fallback MOCK
+    - Si falta config => MOCK
+    Con EMAIL_OUTBOX activo (por defecto) el mensaje se guarda en la bandeja de
+    salida y se devuelve su id al instante (status='queued'); la entrega, con
+    reintentos, se consulta con email_status.
     """
     to_s = (to or "").strip()
     subj = (subject or "").strip()
@@ -391,42 +702,159 @@ def outlook_send_email(to: str, subject: str, html: str) -> dict:
     if not body:
         return {"ok": False, "message_id": "", "error": "html vacío"}
 
-    mode = (os.getenv("MS_AUTH_MODE", "user") or "user").lower()
-    # 1) Modo usuario (delegado) para cuentas personales
-    if mode == "user":
+    if EMAIL_OUTBOX:
         try:
-            from .graph_email_user import send_mail_via_graph_user, GraphUserEmailError
-            res = send_mail_via_graph_user(to_s, subj, body)
-            if res.get("ok"):
-                return {"ok": True, "message_id": res.get("message_id",""), "provider": "graph_user"}
+            _ensure_mail_login()
         except Exception as e:
-            # print(f"[graph_user] {e}")
-            pass
-
-    # 2) Modo aplicación (si el usuario decide configurarlo)
-    if mode == "app":
+            return {"ok": False, "message_id": "", "error": f"login de correo: {e}"}
         try:
-            from .graph_email import send_mail_via_graph, GraphEmailError
-            res = send_mail_via_graph(to_s, subj, body)
-            if res.get("ok"):
-                return {"ok": True, "message_id": res.get("message_id",""), "provider": "graph"}
+            mid = _outbox().enqueue(to_s, subj, body)
         except Exception as e:
-            # print(f"[graph_app] {e}")
-            pass
+            return {"ok": False, "message_id": "", "error": f"no se pudo encolar: {e}"}
+        return {"ok": True, "message_id": mid, "status": "queued", "provider": "outbox"}
+    try:
+        return _deliver_email(to_s, subj, body)
+    except Exception as e:
+        return {"ok": False, "message_id": "", "error": f"{e}"}
 
-    # 3) Fallback MOCK (si falla o no hay config)
-    import time, hashlib
-    stamp = str(time.time())
-    message_id = "mock-" + hashlib.sha1(f"{to_s}|{subj}|{stamp}".encode("utf-8")).hexdigest()[:16]
-    print("\n--- MOCK OUTLOOK SEND ---")
-    print(f"To: {to_s}")
-    print(f"Subject: {subj}")
-    print(f"HTML (preview 200): {body[:200]}{'...' if len(body)>200 else ''}")
-    print(f"Message-Id: {message_id}")
-    print("-------------------------\n")
-    return {"ok": True, "message_id": message_id, "provider": "mock"}
+@mcp.tool()
+def email_status(ids: list[str] | None = None, limit: int = 20, status: str = "") -> dict:
+    """
+    Estado de entrega de correos de la bandeja de salida.
+    - ids: message_id devueltos por outlook_send_email (desconocidos => status 'unknown')
+    - sin ids: los 'limit' más recientes (opcionalmente filtrados por status:
+      queued | sending | retry | sent | failed)
+    Incluye siempre el resumen de la bandeja (conteo por estado, pendiente más antiguo).
+    """
+    try:
+        box = _outbox()
+        items = box.status(list(ids)) if ids else box.recent(limit=limit, status=(status or "").strip())
+        return {"ok": True, "messages": items, "outbox": box.summary()}
+    except Exception as e:
+        return {"ok": False, "error": f"{e}"}
+
+_LEDGER: SentLedger | None = None
+
+def _sent_ledger() -> SentLedger:
+    global _LEDGER
+    with _INIT_LOCK:
+        if _LEDGER is None:
+            _LEDGER = SentLedger(os.path.join(os.path.dirname(DATA_CSV), "notify_ledger.sqlite"))
+        return _LEDGER
+
+def _notify_send(to: str, subj: str, body: str, message_id: str = "") -> dict:
+    if EMAIL_OUTBOX:
+        # queda registrado en disco: la entrega (y sus reintentos) sigue en la bandeja
+        mid = _outbox().enqueue(to, subj, body, quiet=True, message_id=message_id)
+        return {"ok": True, "message_id": mid, "provider": "outbox"}
+    try:
+        return _deliver_email(to, subj, body, quiet=True)
+    except Exception as e:
+        return {"ok": False, "error": f"{e}"}
+
+@mcp.tool()
+def alerts_notify_due(
+    spreadsheet_id: str = "local",
+    days_before: int = 30,
+    from_date: str = "",
+    to_date: str = "",
+    subject: str = "",
+    dry_run: bool = False,
+    resend: bool = False,
+    max_workers: int = 0,
+) -> dict:
+    """
+    Avisa por correo los vencimientos de la ventana (misma que alerts_schedule_due):
+    un resumen HTML por destinatario (plantilla templates/digest.html o
+    NOTIFY_TEMPLATE_PATH). Con EMAIL_OUTBOX se encolan en la bandeja de salida
+    (delivery='outbox'); si no, se envían en paralelo (NOTIFY_WORKERS hilos).
+    Lo ya avisado (mismo destinatario, certificación y vencimiento) se omite
+    salvo resend=true. dry_run=true solo cuenta y devuelve una vista previa.
+    """
+    from datetime import date, timedelta
+    t0 = time.perf_counter()
+    today = date.today()
+    try:
+        start = _parse_date(from_date).date() if from_date else today
+        end = _parse_date(to_date).date() if to_date else today + timedelta(days=int(days_before))
+    except Exception:
+        return {"ok": False, "error": "from_date/to_date deben tener formato YYYY-MM-DD"}
 
+    try:
+        if EMAIL_OUTBOX and not dry_run:
+            _ensure_mail_login()
+        store = _get_store()
+        out = notify_due(
+            store.due_between(start, end),
+            email_of=_email_from_nombre,
+            send=_notify_send,
+            ledger=_sent_ledger(),
+            start=start, end=end, today=today, subject=(subject or "").strip(),
+            workers=int(max_workers) or NOTIFY_WORKERS,
+            dry_run=bool(dry_run), resend=bool(resend),
+            # el id se anota en el registro antes de encolar (ver notify_due)
+            reserve_id=Outbox.new_id if EMAIL_OUTBOX else None,
+        )
+    except Exception as e:
+        return {"ok": False, "error": f"{e}"}
+    return {"ok": True, "source": store.source, "from_date": start.isoformat(), "to_date": end.isoformat(),
+            "dry_run": bool(dry_run), "delivery": "outbox" if EMAIL_OUTBOX else "direct", **out, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+def _parse_args(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Servidor MCP de CertTrack.")
+    ap.add_argument("--transport", choices=["stdio", "streamable-http", "sse"],
+                    default=os.getenv("CERTTRACK_TRANSPORT", "stdio"),
+                    help="stdio (un proceso por cliente) o HTTP compartido por varios clientes")
+    ap.add_argument("--host", default=os.getenv("CERTTRACK_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("CERTTRACK_PORT", "8000")))
+    ap.add_argument("--workers", type=int, default=CERTTRACK_WORKERS,
+                    help="hilos para herramientas síncronas (Sheets/Graph/CSV)")
+    return ap.parse_args(argv)
+
+
+# Precarga de store e índice al arrancar por STDIO (0 = a la primera llamada)
+CERTTRACK_PRELOAD = os.getenv("CERTTRACK_PRELOAD", "1").strip().lower() not in ("0", "false", "no")
+# Proceso de reserva lanzado por el cliente (MCP_STANDBY=1): no arranca workers de la
+# bandeja, precarga ni espejo de Sheets hasta la primera llamada a una herramienta
+MCP_STANDBY = os.getenv("MCP_STANDBY", "0").strip().lower() in ("1", "true", "yes")
+_BACKGROUND_STARTED = False
+
+def _start_background():
+    """Servicios de fondo del proceso; una vez."""
+    global _BACKGROUND_STARTED
+    with _INIT_LOCK:
+        if _BACKGROUND_STARTED:
+            return
+        _BACKGROUND_STARTED = True
+    if EMAIL_OUTBOX:
+        _outbox().start()  # retoma lo que haya quedado pendiente de una corrida anterior
+
+def _preload():
+    try:
+        index_for(_get_store())
+    except Exception as e:
+        # stdout es el canal MCP: nada de print aquí
+        logging.getLogger("certtrack").warning("precarga omitida: %s", e)
 
 if __name__ == "__main__":
-    # Corre por STDIO (ideal para integrarlo con tu cliente)
-    mcp.run()
+    args = _parse_args()
+    CERTTRACK_WORKERS = max(1, args.workers)
+    mcp.settings.host, mcp.settings.port = args.host, args.port
+    if MCP_STANDBY and args.transport == "stdio":
+        pass  # reserva ociosa: todo queda para la primera llamada (run_in_pool)
+    else:
+        _start_background()
+    if args.transport != "stdio":
+        # un solo proceso caliente para todos: se cargan store e índice antes de aceptar clientes
+        try:
+            index_for(_get_store())
+        except Exception as e:
+            print(f"[certtrack] precarga omitida: {e}")
+    elif CERTTRACK_PRELOAD and not MCP_STANDBY:
+        # por STDIO no se demora el handshake: store e índice se cargan en un hilo, así
+        # un proceso precalentado por el cliente también llega con las cachés listas
+        threading.Thread(target=_preload, name="certtrack-preload", daemon=True).start()
+    # STDIO (por defecto, ideal para integrarlo con tu cliente) o HTTP en /mcp (streamable-http) o /sse
+    mcp.run(transport=args.transport)
@@ -0,0 +1,626 @@
+# certtrack_mcp/store.py
+"""
+Almacén del maestro de certificaciones (interfaz común a todos los backends).
+
+CSV y Google Sheets se cargan una vez por proceso y mantienen índices hash por
+'id' y por 'nombre' (en minúsculas), más un índice ordenado por fecha de
+vencimiento ('vence_el' se calcula una sola vez al cargar). El CSV se invalida
+por mtime/tamaño; Google Sheets por TTL o por el espejo local. Las altas hechas
+por este proceso se aplican de forma incremental, sin releer.
+SQLite (WAL) responde las mismas consultas con índices de la base, sin cargar
+el maestro en memoria, y admite varios procesos escribiendo a la vez.
+"""
+from __future__ import annotations
+import bisect
+import csv
+import os
+import sqlite3
+import threading
+import time
+import calendar
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+HEADERS = [
+    "id","certificacion","nombre","fecha",
+    "vigencia_meses","proveedor","tipo","costo","drive_file_id"
+]
+
+SHEETS_CACHE_TTL = float(os.getenv("SHEETS_CACHE_TTL", "30"))
+
+class DuplicateIdError(Exception):
+    pass
+
+def normalize_headers(hs: List[str]) -> List[str]:
+    return [h.strip().lower() for h in hs]
+
+def add_months(d: date, months: int) -> date:
+    # mismo resultado que relativedelta(months=n): el día se ajusta al último del mes
+    m = d.month - 1 + months
+    y, m = d.year + m // 12, m % 12 + 1
+    return d.replace(year=y, month=m, day=min(d.day, calendar.monthrange(y, m)[1]))
+
+def parse_fecha(fecha: str) -> date:
+    fecha = (fecha or "").strip()
+    if len(fecha) == 10 and fecha[4] == "-" and fecha[7] == "-":
+        return date.fromisoformat(fecha)  # mucho más rápido que strptime
+    return datetime.strptime(fecha, "%Y-%m-%d").date()
+
+def compute_vence(fecha: str, vigencia_meses: str) -> Optional[date]:
+    try:
+        vig_m = int(vigencia_meses or 0)
+    except Exception:
+        vig_m = 0
+    try:
+        return add_months(parse_fecha(fecha), vig_m)
+    except Exception:
+        return None
+
+def row_from_payload(payload: dict, headers_lower: List[str]) -> List[str]:
+    p = {k.lower(): v for k, v in payload.items()}
+    return [str(p.get(h, "")) for h in headers_lower]
+
+class CertStore(ABC):
+    """
+    Base común: registros como dicts con las columnas canónicas (HEADERS) más
+    '_row' (número de fila en la hoja/CSV, contando el encabezado como 1) y
+    'vence_el' precalculado ("" si fecha/vigencia no son válidas).
+    Las subclases implementan _version(), _read() y _write() (abstractos: un
+    backend incompleto falla al instanciarse, no en la primera consulta).
+    """
+    source = ""
+
+    def __init__(self):
+        self.headers: List[str] = list(HEADERS)
+        self.records: List[Dict[str, Any]] = []
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_nombre: Dict[str, List[Dict[str, Any]]] = {}
+        # índice de vencimientos: ordinales ordenados + registros alineados
+        self._exp_keys: List[int] = []
+        self._exp_recs: List[Dict[str, Any]] = []
+        self._version_token: Any = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    # --- hooks de cada backend ---
+    @abstractmethod
+    def _version(self) -> Any:
+        ...
+
+    @abstractmethod
+    def _read(self) -> Tuple[List[str], List[List[str]]]:
+        ...
+
+    @abstractmethod
+    def _write(self, row_out: List[str]) -> Any:
+        # puede devolver un comprobante (p. ej. ticket de la cola write-behind)
+        ...
+
+    def _write_many(self, rows_out: List[List[str]]) -> Any:
+        # por defecto fila a fila; los backends lo reemplazan por una sola escritura
+        for row_out in rows_out:
+            self._write(row_out)
+
+    def _refresh_source(self):
+        """
+        Trabajo lento para tener datos nuevos (red, sincronizar un espejo). Corre
+        fuera de self._lock: lectores y escritores no esperan la red; bajo el
+        lock solo se compara la versión y se cambia el snapshot.
+        """
+
+    # --- carga e índices ---
+    def ensure_fresh(self) -> "CertStore":
+        self._refresh_source()
+        with self._lock:
+            self._ensure_loaded()
+        return self
+
+    def _ensure_loaded(self):
+        version = self._version()
+        if not self._loaded or version != self._version_token:
+            self._reload(version)
+
+    def _reload(self, version: Any):
+        headers, rows = self._read()
+        self.headers = headers or list(HEADERS)
+        self.records, self.by_id, self.by_nombre = [], {}, {}
+        hnorm = normalize_headers(self.headers)
+        for i, r in enumerate(rows):
+            self._index(self._record(hnorm, r, i + 2), sorted_insert=False)
+        # orden estable: a igual vencimiento, por número de fila
+        dated = sorted((r for r in self.records if r["_vence_ord"] is not None), key=lambda r: r["_vence_ord"])
+        self._exp_keys = [r["_vence_ord"] for r in dated]
+        self._exp_recs = dated
+        self._version_token = version
+        self._loaded = True
+
+    @staticmethod
+    def _record(hnorm: List[str], r: List[str], row_number: int) -> Dict[str, Any]:
+        rec = {col: "" for col in HEADERS}
+        for j, col in enumerate(hnorm):
+            if j < len(r) and col:
+                rec[col] = r[j]
+        rec["_row"] = row_number
+        rec["_empty"] = not any((v or "").strip() for v in r)
+        vence = None if rec["_empty"] else compute_vence(rec["fecha"], rec["vigencia_meses"])
+        rec["vence_el"] = vence.strftime("%Y-%m-%d") if vence else ""
+        rec["_vence_ord"] = vence.toordinal() if vence else None
+        return rec
+
+    def _index(self, rec: Dict[str, Any], sorted_insert: bool = True):
+        self.records.append(rec)
+        if rec["_empty"]:
+            return
+        if sorted_insert and rec["_vence_ord"] is not None:
+            pos = bisect.bisect_right(self._exp_keys, rec["_vence_ord"])
+            self._exp_keys.insert(pos, rec["_vence_ord"])
+            self._exp_recs.insert(pos, rec)
+        rid = (rec.get("id") or "").strip()
+        if rid:
+            self.by_id.setdefault(rid, rec)
+        nm = (rec.get("nombre") or "").strip().lower()
+        self.by_nombre.setdefault(nm, []).append(rec)
+
+    # --- consultas ---
+    def has_columns(self, cols: List[str]) -> bool:
+        hnorm = normalize_headers(self.headers)
+        return all(c in hnorm for c in cols)
+
+    def has_id(self, rid: str) -> bool:
+        with self._lock:
+            return str(rid).strip() in self.by_id
+
+    def known_ids(self, ids: List[str]) -> set:
+        """Subconjunto de 'ids' que ya existe en el maestro."""
+        with self._lock:
+            return {i for i in ids if i in self.by_id}
+
+    def find_by_nombre(self, nombre: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.by_nombre.get((nombre or "").strip().lower(), []))
+
+    def due_between(self, start: date, end: date) -> List[Dict[str, Any]]:
+        """Registros con start <= vence_el <= end, ordenados por vencimiento (bisect)."""
+        with self._lock:
+            lo = bisect.bisect_left(self._exp_keys, start.toordinal())
+            hi = bisect.bisect_right(self._exp_keys, end.toordinal())
+            return self._exp_recs[lo:hi]
+
+    def iter_records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [r for r in self.records if not r["_empty"]]
+
+    def snapshot_key(self) -> Any:
+        """Clave que cambia cuando cambian los datos (para cachés derivadas, p. ej. columnar)."""
+        with self._lock:
+            return (self._version_token, len(self.records))
+
+    # --- altas ---
+    def append(self, payload: dict) -> Dict[str, Any]:
+        """
+        Valida duplicado por 'id' contra el índice, escribe la fila en el backend
+        y la incorpora a los índices. Devuelve el registro indexado ('_row' =
+        fila insertada; '_write' = lo que devolvió el backend, si algo).
+        """
+        self._refresh_source()
+        with self._lock:
+            self._ensure_loaded()
+            rid = str(payload.get("id", "")).strip()
+            if rid in self.by_id:
+                raise DuplicateIdError(rid)
+            hnorm = normalize_headers(self.headers)
+            if "id" not in hnorm:
+                # si la hoja no tiene encabezado, usamos HEADERS canónicos
+                self.headers, hnorm = list(HEADERS), normalize_headers(HEADERS)
+            row_out = row_from_payload(payload, hnorm)
+            if len(row_out) < len(self.headers):
+                row_out += [""] * (len(self.headers) - len(row_out))
+            written = self._write(row_out)
+            rec = self._record(hnorm, row_out, len(self.records) + 2)
+            rec["_write"] = written
+            self._index(rec)
+            self._version_token = self._version()
+            return rec
+
+    def append_many(self, payloads: List[dict]) -> Tuple[List[Dict[str, Any]], List[int]]:
+        """
+        Alta en bloque: un solo recorrido para detectar ids duplicados (contra el
+        índice y dentro del mismo lote), una sola escritura al backend y un solo
+        reordenamiento del índice de vencimientos.
+        Devuelve (registros agregados, posiciones en 'payloads' con id duplicado).
+        """
+        self._refresh_source()
+        with self._lock:
+            self._ensure_loaded()
+            hnorm = normalize_headers(self.headers)
+            if "id" not in hnorm:
+                self.headers, hnorm = list(HEADERS), normalize_headers(HEADERS)
+            width = len(self.headers)
+            seen = set(self.by_id)
+            rows_out: List[List[str]] = []
+            duplicates: List[int] = []
+            for i, payload in enumerate(payloads):
+                rid = str(payload.get("id", "")).strip()
+                if rid in seen:
+                    duplicates.append(i)
+                    continue
+                seen.add(rid)
+                row_out = row_from_payload(payload, hnorm)
+                if len(row_out) < width:
+                    row_out += [""] * (width - len(row_out))
+                rows_out.append(row_out)
+            if not rows_out:
+                return [], duplicates
+            self._write_many(rows_out)
+            base = len(self.records) + 2
+            recs = [self._record(hnorm, r, base + k) for k, r in enumerate(rows_out)]
+            for rec in recs:
+                self._index(rec, sorted_insert=False)
+            dated = [r for r in recs if r["_vence_ord"] is not None]
+            if dated:
+                # timsort aprovecha que el índice existente ya viene ordenado
+                merged = sorted(self._exp_recs + dated, key=lambda r: r["_vence_ord"])
+                self._exp_keys = [r["_vence_ord"] for r in merged]
+                self._exp_recs = merged
+            self._version_token = self._version()
+            return recs, duplicates
+
+class CsvCertStore(CertStore):
+    source = "csv"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def ensure_file(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.isfile(self.path):
+            with open(self.path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(HEADERS)
+
+    def _version(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self):
+        self.ensure_file()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        if not rows:
+            return list(HEADERS), []
+        return rows[0], rows[1:]
+
+    def _write(self, row_out):
+        self.ensure_file()
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerow(row_out)
+
+    def _write_many(self, rows_out):
+        self.ensure_file()
+        with open(self.path, "a", newline="", encoding="utf-8", buffering=1 << 20) as f:
+            csv.writer(f).writerows(rows_out)
+
+class SheetsCertStore(CertStore):
+    """
+    Con 'mirror' (espejo SQLite, ver mirror.py) la versión es la revisión del
+    espejo y la carga sale del disco local; sin él, se recarga la hoja completa
+    cuando vence SHEETS_CACHE_TTL. La consulta de cambios y la descarga ocurren
+    en _refresh_source(), fuera del lock del store. Las altas propias se aplican al índice sin
+    esperar; con escritura diferida, pending_rows() devuelve las filas aún no
+    confirmadas para reponerlas en el índice al recargar.
+    """
+    source = "sheets"
+
+    def __init__(self, spreadsheet_id: str, tab: str,
+                 load_rows: Callable[[], Tuple[List[str], List[List[str]]]],
+                 append_row: Callable[[List[str], str], Any],
+                 ttl: float = SHEETS_CACHE_TTL,
+                 pending_rows: Optional[Callable[[], List[List[str]]]] = None,
+                 append_rows: Optional[Callable[[List[List[str]]], Any]] = None,
+                 mirror: Any = None):
+        super().__init__()
+        self.spreadsheet_id = spreadsheet_id
+        self.tab = tab
+        self.ttl = ttl
+        self._load_rows = load_rows
+        self._append_row = append_row
+        self._pending_rows = pending_rows
+        self._append_rows = append_rows
+        self.mirror = mirror
+        self._loaded_at = 0.0
+        self._fetch_lock = threading.Lock()  # una descarga de la hoja a la vez
+        self._staged: Optional[Tuple[float, Tuple[List[str], List[List[str]]]]] = None
+
+    def _expired(self) -> bool:
+        return not self._loaded or time.monotonic() - self._loaded_at >= self.ttl
+
+    def _refresh_source(self):
+        if self.mirror is not None:
+            self.mirror.ensure_fresh()  # sondeo/sync del espejo (tiene su propio lock)
+            return
+        if not self._expired() or self._staged is not None:
+            return
+        with self._fetch_lock:
+            if not self._expired() or self._staged is not None:
+                return  # otro hilo ya la descargó
+            data = self._load_rows()
+            with self._lock:
+                self._staged = (time.monotonic(), data)
+
+    def _version(self):
+        if self.mirror is not None:
+            return self.mirror.revision
+        if self._staged is not None:
+            return self._staged[0]  # hoja descargada fuera del lock, lista para cambiarse
+        # el token cambia cuando vence el TTL
+        if not self._expired():
+            return self._version_token
+        return time.monotonic()
+
+    def _read(self):
+        if self.mirror is not None:
+            headers, data = self.mirror.read()
+        elif self._staged is not None:
+            (_, (headers, data)), self._staged = self._staged, None
+        else:
+            headers, data = self._load_rows()
+        self._loaded_at = time.monotonic()
+        pending = self._pending_rows() if self._pending_rows else []
+        if pending:
+            hnorm = normalize_headers(headers or HEADERS)
+            j = hnorm.index("id") if "id" in hnorm else 0
+            seen = {r[j].strip() for r in data if len(r) > j}
+            data = data + [r for r in pending if len(r) > j and r[j].strip() not in seen]
+        return headers, data
+
+    def _write(self, row_out):
+        hnorm = normalize_headers(self.headers)
+        rid = row_out[hnorm.index("id")].strip() if "id" in hnorm else ""
+        return self._append_row(row_out, rid)
+
+    def _write_many(self, rows_out):
+        if self._append_rows is None:
+            return super()._write_many(rows_out)
+        return self._append_rows(rows_out)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._staged = None
+            if self.mirror is not None:
+                self.mirror.checked_at = 0.0  # fuerza la consulta de cambios en la próxima lectura
+
+class SqliteCertStore(CertStore):
+    """
+    Maestro en SQLite (modo WAL: lectores y un escritor a la vez, también entre
+    procesos). Índices por id (UNIQUE), nombre normalizado y vence_el, que se
+    calcula al insertar. Las consultas van directo a la base; la versión
+    combina PRAGMA data_version (cambios de otras conexiones) y las altas propias.
+    """
+    source = "sqlite"
+
+    _COLUMNS = HEADERS + ["nombre_key", "vence_el", "vence_ord"]
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS certs (
+        rownum INTEGER PRIMARY KEY,
+        id TEXT NOT NULL UNIQUE,
+        certificacion TEXT NOT NULL DEFAULT '',
+        nombre TEXT NOT NULL DEFAULT '',
+        fecha TEXT NOT NULL DEFAULT '',
+        vigencia_meses TEXT NOT NULL DEFAULT '',
+        proveedor TEXT NOT NULL DEFAULT '',
+        tipo TEXT NOT NULL DEFAULT '',
+        costo TEXT NOT NULL DEFAULT '',
+        drive_file_id TEXT NOT NULL DEFAULT '',
+        nombre_key TEXT NOT NULL DEFAULT '',
+        vence_el TEXT NOT NULL DEFAULT '',
+        vence_ord INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS certs_nombre_key ON certs (nombre_key);
+    CREATE INDEX IF NOT EXISTS certs_vence_ord ON certs (vence_ord) WHERE vence_ord IS NOT NULL;
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._local_writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self._SCHEMA)
+            self._db = db
+        return self._db
+
+    def _version(self):
+        return (self._conn().execute("PRAGMA data_version").fetchone()[0], self._local_writes)
+
+    def ensure_fresh(self) -> "CertStore":
+        with self._lock:
+            self._version_token = self._version()
+            self._loaded = True
+        return self
+
+    # hooks de la base: las consultas y altas de arriba ya van directo a SQLite,
+    # estos solo sirven a quien use la interfaz genérica (filas en orden HEADERS)
+    def _read(self):
+        return list(HEADERS), [[r[c] for c in HEADERS] for r in self._select()]
+
+    def _write(self, row_out):
+        rownums, duplicates = self._transaction([dict(zip(HEADERS, row_out))])
+        if duplicates:
+            raise DuplicateIdError(str(row_out[0]).strip())
+        return None
+
+    def _write_many(self, rows_out):
+        return self._transaction([dict(zip(HEADERS, r)) for r in rows_out])
+
+    @staticmethod
+    def _row_values(row_out: Dict[str, str]) -> Tuple:
+        vence = compute_vence(row_out["fecha"], row_out["vigencia_meses"])
+        return tuple(row_out[c] for c in HEADERS) + (
+            (row_out["nombre"] or "").strip().lower(),
+            vence.strftime("%Y-%m-%d") if vence else "",
+            vence.toordinal() if vence else None,
+        )
+
+    def _from_db(self, r: Tuple) -> Dict[str, Any]:
+        rec = dict(zip(HEADERS, r[1:1 + len(HEADERS)]))
+        rec["_row"] = r[0]
+        rec["_empty"] = False
+        rec["vence_el"] = r[-2]
+        rec["_vence_ord"] = r[-1]
+        return rec
+
+    def _select(self, where: str = "", params: Tuple = (), order: str = "rownum") -> List[Dict[str, Any]]:
+        cols = ", ".join(["rownum"] + HEADERS + ["vence_el", "vence_ord"])
+        sql = f"SELECT {cols} FROM certs {('WHERE ' + where) if where else ''} ORDER BY {order}"
+        with self._lock:
+            return [self._from_db(r) for r in self._conn().execute(sql, params)]
+
+    # --- consultas ---
+    def has_columns(self, cols: List[str]) -> bool:
+        return all(c in HEADERS for c in cols)
+
+    def has_id(self, rid: str) -> bool:
+        with self._lock:
+            return self._conn().execute("SELECT 1 FROM certs WHERE id = ?", (str(rid).strip(),)).fetchone() is not None
+
+    def known_ids(self, ids: List[str]) -> set:
+        found: set = set()
+        ids = list(ids)
+        with self._lock:
+            db = self._conn()
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                found.update(r[0] for r in db.execute(f"SELECT id FROM certs WHERE id IN ({marks})", chunk))
+        return found
+
+    def find_by_nombre(self, nombre: str) -> List[Dict[str, Any]]:
+        return self._select("nombre_key = ?", ((nombre or "").strip().lower(),))
+
+    def due_between(self, start: date, end: date) -> List[Dict[str, Any]]:
+        return self._select("vence_ord BETWEEN ? AND ?", (start.toordinal(), end.toordinal()),
+                            order="vence_ord, rownum")
+
+    def iter_records(self) -> List[Dict[str, Any]]:
+        return self._select()
+
+    def snapshot_key(self) -> Any:
+        with self._lock:
+            return self._version()
+
+    # --- altas (transaccionales) ---
+    def _insert(self, db: sqlite3.Connection, payloads: List[dict]) -> Tuple[List[int], List[int]]:
+        p_lower = [{k.lower(): v for k, v in p.items()} for p in payloads]
+        ids = [str(p.get("id", "")).strip() for p in p_lower]
+        existing = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            existing.update(r[0] for r in db.execute(f"SELECT id FROM certs WHERE id IN ({marks})", chunk))
+        rows, duplicates, positions = [], [], []
+        for i, (rid, p) in enumerate(zip(ids, p_lower)):
+            if rid in existing:
+                duplicates.append(i)
+                continue
+            existing.add(rid)
+            row_out = {h: str(p.get(h, "")) for h in HEADERS}
+            row_out["id"] = rid
+            rows.append(self._row_values(row_out))
+            positions.append(i)
+        marks = ",".join("?" * len(self._COLUMNS))
+        first = db.execute("SELECT COALESCE(MAX(rownum), 0) + 1 FROM certs").fetchone()[0]
+        db.executemany(f"INSERT INTO certs ({', '.join(self._COLUMNS)}) VALUES ({marks})", rows)
+        return list(range(first, first + len(rows))), duplicates
+
+    def _transaction(self, payloads: List[dict], replace: bool = False) -> Tuple[List[int], List[int]]:
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")  # toma el lock de escritura antes de comprobar duplicados
+            try:
+                if replace:
+                    db.execute("DELETE FROM certs")
+                out = self._insert(db, payloads)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self._local_writes += 1
+            self._version_token = self._version()
+            return out
+
+    def append(self, payload: dict) -> Dict[str, Any]:
+        try:
+            rownums, duplicates = self._transaction([payload])
+        except sqlite3.IntegrityError:
+            raise DuplicateIdError(str(payload.get("id", "")).strip())
+        if duplicates:
+            raise DuplicateIdError(str(payload.get("id", "")).strip())
+        rec = self._select("rownum = ?", (rownums[0],))[0]
+        rec["_write"] = None
+        return rec
+
+    def append_many(self, payloads: List[dict]) -> Tuple[List[Dict[str, Any]], List[int]]:
+        if not payloads:
+            return [], []
+        rownums, duplicates = self._transaction(payloads)
+        if not rownums:
+            return [], duplicates
+        return self._select("rownum BETWEEN ? AND ?", (rownums[0], rownums[-1])), duplicates
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+def migrate_csv_to_sqlite(csv_path: str, db_path: str, replace: bool = False) -> Dict[str, Any]:
+    """
+    Copia master.csv a SQLite en una sola transacción. Filas vacías se omiten;
+    ids vacíos o repetidos se reportan y no se insertan.
+    Con replace=True se vacía antes la tabla de destino.
+    """
+    store = SqliteCertStore(db_path)
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        hnorm = normalize_headers(next(reader, []) or HEADERS)
+        payloads, skipped = [], []
+        for line, r in enumerate(reader, start=2):
+            if not any((v or "").strip() for v in r):
+                continue
+            p = dict(zip(hnorm, r))
+            if not (p.get("id") or "").strip():
+                skipped.append({"line": line, "error": "id vacío"})
+                continue
+            p["_line"] = line
+            payloads.append(p)
+    rownums, duplicates = store._transaction(payloads, replace=replace)
+    skipped += [{"line": payloads[i]["_line"], "id": payloads[i].get("id"), "error": "id duplicado"} for i in duplicates]
+    store.close()
+    return {"ok": True, "db": db_path, "inserted": len(rownums), "skipped": skipped}
+
+_STORES: Dict[str, CertStore] = {}
+_STORES_LOCK = threading.Lock()
+
+def get_store(key: str, factory: Callable[[], CertStore]) -> CertStore:
+    """Instancia única por proceso para cada backend ('csv', 'sheets')."""
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = factory()
+    return store.ensure_fresh()
+
+def peek_store(key: str) -> Optional[CertStore]:
+    """Store ya creado para 'key', sin refrescarlo (None si aún no existe)."""
+    with _STORES_LOCK:
+        return _STORES.get(key)
@@ -0,0 +1,282 @@
+# certtrack_mcp/write_behind.py
+"""
+Cola write-behind para altas en Google Sheets.
+
+Las filas se validan y se agregan al índice en memoria de inmediato; la
+escritura real se agrupa en una sola llamada a values.append cuando se junta
+SHEETS_BATCH_MAX_ROWS filas o la más antigua espera SHEETS_BATCH_MAX_DELAY
+segundos. Errores transitorios (429/5xx) se reintentan con backoff
+exponencial. Cada fila recibe un ticket con su estado:
+pending -> in_flight -> committed | failed.
+"""
+from __future__ import annotations
+import atexit
+import itertools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger("certtrack.write_behind")
+
+SHEETS_BATCH_MAX_ROWS = int(os.getenv("SHEETS_BATCH_MAX_ROWS", "200"))
+SHEETS_BATCH_MAX_DELAY = float(os.getenv("SHEETS_BATCH_MAX_DELAY", "2.0"))
+SHEETS_BATCH_MAX_RETRIES = int(os.getenv("SHEETS_BATCH_MAX_RETRIES", "6"))
+SHEETS_BATCH_BACKOFF_BASE = float(os.getenv("SHEETS_BATCH_BACKOFF_BASE", "1.0"))
+SHEETS_BATCH_BACKOFF_MAX = float(os.getenv("SHEETS_BATCH_BACKOFF_MAX", "60"))
+# tickets terminados que se conservan para consultar su estado
+SHEETS_TICKETS_KEEP = int(os.getenv("SHEETS_TICKETS_KEEP", "5000"))
+
+_RANGE_ROWS = re.compile(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+def rows_from_updated_range(updated_range: str) -> Optional[List[int]]:
+    """'Master!A10:I12' -> [10, 11, 12] (None si no se puede interpretar)."""
+    m = _RANGE_ROWS.search(updated_range or "")
+    if not m:
+        return None
+    first = int(m.group(1))
+    last = int(m.group(2) or first)
+    return list(range(first, last + 1))
+
+def call_with_backoff(fn: Callable[[], Any], is_retryable: Callable[[Exception], bool],
+                      max_retries: int = SHEETS_BATCH_MAX_RETRIES,
+                      backoff_base: float = SHEETS_BATCH_BACKOFF_BASE,
+                      backoff_max: float = SHEETS_BATCH_BACKOFF_MAX,
+                      on_retry: Optional[Callable[[int, Exception, float], None]] = None) -> Any:
+    """Ejecuta fn(); ante errores reintentables espera base*2^n (con jitter) y reintenta."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable(e) or attempt > max_retries:
+                raise
+            delay = min(backoff_max, backoff_base * (2 ** (attempt - 1)))
+            delay *= random.uniform(0.5, 1.0)  # jitter para no sincronizar reintentos
+            if on_retry:
+                on_retry(attempt, e, delay)
+            time.sleep(delay)
+
+class AppendQueue:
+    """
+    flush_fn(rows) escribe un lote y devuelve la respuesta de values.append.
+    is_retryable(exc) decide si un error se reintenta.
+    on_failed(tickets) se llama cuando un lote se descarta (p. ej. para invalidar el índice).
+    """
+
+    def __init__(self, flush_fn: Callable[[List[List[str]]], Dict[str, Any]],
+                 is_retryable: Callable[[Exception], bool],
+                 on_failed: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+                 max_rows: int = SHEETS_BATCH_MAX_ROWS,
+                 max_delay: float = SHEETS_BATCH_MAX_DELAY,
+                 max_retries: int = SHEETS_BATCH_MAX_RETRIES,
+                 backoff_base: float = SHEETS_BATCH_BACKOFF_BASE,
+                 backoff_max: float = SHEETS_BATCH_BACKOFF_MAX):
+        self._flush_fn = flush_fn
+        self._is_retryable = is_retryable
+        self._on_failed = on_failed
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._pending: List[Dict[str, Any]] = []
+        self._in_flight: List[Dict[str, Any]] = []
+        self._tickets: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._by_id: Dict[str, int] = {}
+        self._seq = itertools.count(1)
+        self._force = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"batches": 0, "rows_committed": 0, "rows_failed": 0, "retries": 0}
+
+    # --- API ---
+    def submit(self, row: List[str], rid: str = "") -> Dict[str, Any]:
+        with self._cond:
+            self._start_locked()
+            ticket = {
+                "ticket": next(self._seq), "id": rid, "row": list(row),
+                "status": "pending", "queued_at": time.time(),
+                "attempts": 0, "error": None, "sheet_row": None,
+            }
+            self._pending.append(ticket)
+            self._tickets[ticket["ticket"]] = ticket
+            if rid:
+                self._by_id[rid] = ticket["ticket"]
+            self._trim_locked()
+            self._cond.notify_all()
+            return self._public(ticket)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Fuerza el envío de lo pendiente y espera; True si la cola quedó vacía."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._pending:
+                self._start_locked()
+                self._force = True
+                self._cond.notify_all()
+            while self._pending or self._in_flight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            return True
+
+    def pending_rows(self) -> List[List[str]]:
+        """Filas aún no confirmadas (para reponerlas en el índice tras recargar)."""
+        with self._cond:
+            return [t["row"] for t in self._in_flight + self._pending]
+
+    def status(self, tickets: Optional[List[int]] = None, ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        with self._cond:
+            out = []
+            for n in tickets or []:
+                try:
+                    t = self._tickets.get(int(n))
+                except Exception:
+                    t = None
+                out.append(self._public(t) if t else {"ticket": n, "status": "unknown"})
+            for rid in ids or []:
+                rid = str(rid).strip()
+                t = self._tickets.get(self._by_id.get(rid, -1))
+                out.append(self._public(t) if t else {"id": rid, "status": "unknown"})
+            return out
+
+    def summary(self) -> Dict[str, Any]:
+        with self._cond:
+            counts: Dict[str, int] = {}
+            for t in self._tickets.values():
+                counts[t["status"]] = counts.get(t["status"], 0) + 1
+            oldest = min((t["queued_at"] for t in self._pending), default=None)
+            return {
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "by_status": counts,
+                "oldest_pending_s": round(time.time() - oldest, 3) if oldest else None,
+                **self.stats,
+            }
+
+    def close(self, timeout: float = 10.0):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # --- internos ---
+    @staticmethod
+    def _public(t: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: t[k] for k in ("ticket", "id", "status", "attempts", "error", "sheet_row")}
+
+    def _trim_locked(self):
+        # descarta los tickets terminados más antiguos
+        excess = len(self._tickets) - SHEETS_TICKETS_KEEP
+        if excess <= 0:
+            return
+        for n in list(self._tickets):
+            if excess <= 0:
+                break
+            t = self._tickets[n]
+            if t["status"] in ("committed", "failed"):
+                del self._tickets[n]
+                if self._by_id.get(t["id"]) == n:
+                    del self._by_id[t["id"]]
+                excess -= 1
+
+    def _start_locked(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._closed = False
+            self._thread = threading.Thread(target=self._worker, name="sheets-write-behind", daemon=True)
+            self._thread.start()
+
+    def _take_batch_locked(self) -> List[Dict[str, Any]]:
+        batch, self._pending = self._pending[:self.max_rows], self._pending[self.max_rows:]
+        if not self._pending:
+            self._force = False
+        for t in batch:
+            t["status"] = "in_flight"
+        self._in_flight = batch
+        return batch
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending:
+                        waited = time.time() - self._pending[0]["queued_at"]
+                        if self._force or len(self._pending) >= self.max_rows or waited >= self.max_delay:
+                            break
+                        self._cond.wait(self.max_delay - waited)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._take_batch_locked()
+            self._send(batch)
+
+    def _send(self, batch: List[Dict[str, Any]]):
+        rows = [t["row"] for t in batch]
+        attempts = [0]
+
+        def _attempt():
+            attempts[0] += 1
+            for t in batch:
+                t["attempts"] = attempts[0]
+            return self._flush_fn(rows) or {}
+
+        def _on_retry(attempt: int, e: Exception, delay: float):
+            self.stats["retries"] += 1
+            log.warning("append de %d filas falló (%s); reintento %d en %.1fs", len(rows), e, attempt, delay)
+
+        try:
+            resp = call_with_backoff(_attempt, self._is_retryable, self.max_retries,
+                                     self.backoff_base, self.backoff_max, _on_retry)
+        except Exception as e:
+            self._finish(batch, error=str(e))
+            return
+        self._finish(batch, resp=resp)
+
+    def _finish(self, batch: List[Dict[str, Any]], resp: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        sheet_rows = None
+        if resp is not None:
+            sheet_rows = rows_from_updated_range((resp.get("updates") or {}).get("updatedRange", ""))
+            if sheet_rows is not None and len(sheet_rows) != len(batch):
+                sheet_rows = None
+        with self._cond:
+            for i, t in enumerate(batch):
+                if error is None:
+                    t["status"], t["sheet_row"] = "committed", (sheet_rows[i] if sheet_rows else None)
+                else:
+                    t["status"], t["error"] = "failed", error
+            self._in_flight = []
+            self.stats["batches"] += 1
+            self.stats["rows_committed" if error is None else "rows_failed"] += len(batch)
+            self._cond.notify_all()
+        if error is not None:
+            log.error("lote de %d filas descartado: %s", len(batch), error)
+            if self._on_failed:
+                try:
+                    self._on_failed([self._public(t) for t in batch])
+                except Exception:
+                    log.exception("on_failed")
+
+_QUEUES: List[AppendQueue] = []
+
+def register_for_exit(queue: AppendQueue) -> AppendQueue:
+    """Al salir del proceso se intenta vaciar la cola (las filas pendientes no se pierden en un cierre limpio)."""
+    _QUEUES.append(queue)
+    return queue
+
+@atexit.register
+def _flush_all_on_exit():
+    for q in _QUEUES:
+        try:
+            q.close(timeout=float(os.getenv("SHEETS_EXIT_FLUSH_TIMEOUT", "15")))
+        except Exception:
+            pass
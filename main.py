@@ -3,12 +3,18 @@ import os
 import json
 import re
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import asyncio
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 
 load_dotenv()
 
@@ -39,14 +45,13 @@ REPO_PATH_DEFAULT = os.getenv("REPO_PATH", os.path.join(SANDBOX_ROOT, "demo-repo
 # Remoto JSON-RPC (HTTP)
 # =========================
 REMOTE_MCP_URL = os.getenv("REMOTE_MCP_URL", "").strip() or "https://hello-mcp-remote-203021435289.us-central1.run.app/rpc"
-
-def jsonrpc_call(url: str, method: str, params: dict | None = None, req_id: int = 1) -> dict:
-    payload = {"jsonrpc": "2.0", "method": method, "id": req_id}
-    if params:
-        payload["params"] = params
-    r = requests.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload), timeout=15)
-    r.raise_for_status()
-    return r.json()
+REMOTE_RPC_TIMEOUT = float(os.getenv("REMOTE_RPC_TIMEOUT", "15"))
+REMOTE_RPC_CONNECT_TIMEOUT = float(os.getenv("REMOTE_RPC_CONNECT_TIMEOUT", "5"))
+REMOTE_RPC_RETRIES = int(os.getenv("REMOTE_RPC_RETRIES", "2"))
+REMOTE_RPC_BACKOFF = float(os.getenv("REMOTE_RPC_BACKOFF", "0.5"))
+# cuerpos de request comprimidos (el servidor debe aceptar Content-Encoding: gzip)
+REMOTE_RPC_GZIP = os.getenv("REMOTE_RPC_GZIP", "0").strip().lower() in ("1", "true", "yes", "si", "sí")
+REMOTE_RPC_GZIP_MIN = int(os.getenv("REMOTE_RPC_GZIP_MIN", "1024"))
 
 # =========================
 # MCP logging helper
@@ -68,30 +73,214 @@ async def log_mcp_call(session, tool_name: str, arguments: dict):
         logging.error(f"mcp-err | tool={tool_name} | ms={dt} | err={repr(e)}")
         raise
 
+# =========================
+# Cliente HTTP compartido (keep-alive)
+# =========================
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "8"))
+LLM_STREAM = os.getenv("LLM_STREAM", "1").strip().lower() not in ("0", "false", "no")
+
+_HTTP: requests.Session | None = None
+_HTTP_LOCK = threading.Lock()
+
+def http_session() -> requests.Session:
+    """
+    Sesión requests compartida: reutiliza las conexiones TCP+TLS entre turnos.
+    """
+    global _HTTP
+    with _HTTP_LOCK:
+        if _HTTP is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            sess.mount("https://", adapter)
+            sess.mount("http://", adapter)
+            _HTTP = sess
+        return _HTTP
+
+def close_http_session():
+    global _HTTP
+    with _HTTP_LOCK:
+        if _HTTP is not None:
+            _HTTP.close()
+            _HTTP = None
+
+class JsonRpcError(Exception):
+    pass
+
+class JsonRpcClient:
+    """
+    Cliente JSON-RPC 2.0 sobre la sesión HTTP compartida (keep-alive).
+    - ids autoincrementales por cliente
+    - batch(): varias llamadas en un solo POST (arreglo JSON-RPC)
+    - gzip opcional del cuerpo (la respuesta gzip la descomprime requests)
+    - reintentos con backoff ante errores de conexión, timeouts y 429/502/503/504
+    call() y batch() devuelven el sobre de respuesta tal cual ({"jsonrpc", "id", "result"|"error"}).
+    """
+    RETRY_STATUS = {429, 502, 503, 504}
+
+    def __init__(self, url: str, timeout: float = REMOTE_RPC_TIMEOUT,
+                 connect_timeout: float = REMOTE_RPC_CONNECT_TIMEOUT,
+                 retries: int = REMOTE_RPC_RETRIES, backoff: float = REMOTE_RPC_BACKOFF,
+                 gzip_requests: bool = REMOTE_RPC_GZIP, gzip_min: int = REMOTE_RPC_GZIP_MIN):
+        self.url = url
+        self.timeout = (connect_timeout, timeout)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.gzip_requests = gzip_requests
+        self.gzip_min = gzip_min
+        self._ids = 0
+        self._ids_lock = threading.Lock()
+        self.stats = {"posts": 0, "calls": 0, "retries": 0}
+
+    def _next_id(self) -> int:
+        with self._ids_lock:
+            self._ids += 1
+            return self._ids
+
+    def _request(self, method: str, params: dict | list | None) -> dict:
+        req = {"jsonrpc": "2.0", "method": method, "id": self._next_id()}
+        if params:
+            req["params"] = params
+        return req
+
+    def _post(self, payload):
+        import gzip
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+        if self.gzip_requests and len(body) >= self.gzip_min:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                r = http_session().post(self.url, headers=headers, data=body, timeout=self.timeout)
+                if r.status_code == 415 and headers.get("Content-Encoding") == "gzip":
+                    # el servidor no acepta gzip: se desactiva para este cliente y se reenvía plano
+                    self.gzip_requests = False
+                    body = gzip.decompress(body)
+                    headers.pop("Content-Encoding")
+                    continue
+                if r.status_code in self.RETRY_STATUS and attempt <= self.retries:
+                    raise requests.HTTPError(f"{r.status_code}", response=r)
+                r.raise_for_status()
+                self.stats["posts"] += 1
+                return r.json()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if attempt > self.retries or (status is not None and status not in self.RETRY_STATUS):
+                    raise
+                self.stats["retries"] += 1
+                delay = self.backoff * (2 ** (attempt - 1))
+                logging.warning(f"rpc-retry | url={self.url} | intento={attempt} | err={e!r} | espera={delay:.1f}s")
+                time.sleep(delay)
+
+    def call(self, method: str, params: dict | list | None = None) -> dict:
+        self.stats["calls"] += 1
+        return self._post(self._request(method, params))
+
+    def notify(self, method: str, params: dict | list | None = None):
+        """Notificación JSON-RPC (sin id): el servidor no responde con contenido."""
+        payload = {"jsonrpc": "2.0", "method": method}
+        if params:
+            payload["params"] = params
+        http_session().post(self.url, headers={"Content-Type": "application/json"},
+                            data=json.dumps(payload, ensure_ascii=False), timeout=self.timeout)
+
+    def batch(self, calls: list[tuple[str, dict | list | None]]) -> list[dict]:
+        """
+        [(method, params), ...] en un solo POST. Devuelve las respuestas en el
+        orden de 'calls' (el servidor puede responder en cualquier orden). Si el
+        servidor no soporta batch, cae a llamadas individuales.
+        """
+        if not calls:
+            return []
+        reqs = [self._request(m, p) for m, p in calls]
+        self.stats["calls"] += len(reqs)
+        if len(reqs) == 1:
+            return [self._post(reqs[0])]
+        try:
+            resp = self._post(reqs)
+        except requests.HTTPError as e:
+            if getattr(e.response, "status_code", None) != 400:
+                raise
+            resp = None
+        if not isinstance(resp, list):
+            logging.info(f"rpc-batch | url={self.url} | sin soporte de batch; llamadas individuales")
+            return [self._post(r) for r in reqs]
+        by_id = {r.get("id"): r for r in resp if isinstance(r, dict)}
+        return [by_id.get(r["id"]) or {"jsonrpc": "2.0", "id": r["id"],
+                                       "error": {"code": -32603, "message": "sin respuesta en el batch"}}
+                for r in reqs]
+
+_RPC_CLIENTS: dict[str, JsonRpcClient] = {}
+
+def rpc_client(url: str = "") -> JsonRpcClient:
+    url = url or REMOTE_MCP_URL
+    with _HTTP_LOCK:
+        cli = _RPC_CLIENTS.get(url)
+        if cli is None:
+            cli = _RPC_CLIENTS[url] = JsonRpcClient(url)
+        return cli
+
+def jsonrpc_call(url: str, method: str, params: dict | None = None) -> dict:
+    return rpc_client(url).call(method, params)
+
+class RpcBatcher:
+    """
+    Junta las llamadas remotas emitidas en el mismo ciclo del event loop (p. ej.
+    pasos paralelos de un "batch" del router) y las envía en un solo POST.
+    """
+
+    def __init__(self, url: str = ""):
+        self.url = url
+        self._pending: list[tuple[str, dict | None, asyncio.Future]] = []
+
+    async def call(self, method: str, params: dict | None = None) -> dict:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((method, params, fut))
+        if len(self._pending) == 1:
+            loop.call_soon(lambda: asyncio.ensure_future(self._flush()))
+        return await fut
+
+    async def _flush(self):
+        pending, self._pending = self._pending, []
+        try:
+            out = await asyncio.to_thread(rpc_client(self.url).batch, [(m, p) for m, p, _ in pending])
+        except Exception as e:
+            for _, _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, _, fut), res in zip(pending, out):
+            if not fut.done():
+                fut.set_result(res)
+
+REMOTE_RPC = RpcBatcher()
+
 # =========================
 # Llamada al LLM (Groq)
 # =========================
-def call_llm(messages, max_tokens=400):
+def _flatten_content(blocks) -> str:
+    if isinstance(blocks, str):
+        return blocks
+    if isinstance(blocks, list):
+        return "".join(
+            b.get("text", "")
+            for b in blocks
+            if isinstance(b, dict) and b.get("type") == "text"
+        )
+    return ""
+
+def _groq_request(messages, max_tokens: int, stream: bool) -> tuple[dict, dict]:
     """
-    Llama al endpoint OpenAI-compatible de Groq con el modelo gemma2-9b-it.
-    Espera 'messages' como lista de dicts con 'role' en {'system','user','assistant'}
-    y 'content' como lista de bloques [{'type':'text','text': '...'}] o str.
+    Arma headers y payload OpenAI-compatible a partir de 'messages' con
+    'content' como lista de bloques [{'type':'text','text': '...'}] o str.
     """
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise RuntimeError("Falta GROQ_API_KEY en .env")
 
-    def _flatten_content(blocks):
-        if isinstance(blocks, str):
-            return blocks
-        if isinstance(blocks, list):
-            return "".join(
-                b.get("text", "")
-                for b in blocks
-                if isinstance(b, dict) and b.get("type") == "text"
-            )
-        return ""
-
     openai_messages = []
     for m in messages:
         role = m.get("role")
@@ -105,15 +294,16 @@ def call_llm(messages, max_tokens=400):
         "max_tokens": max_tokens,
         "temperature": 0.2,
     }
+    if stream:
+        payload["stream"] = True
 
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
+    return headers, payload
 
-    logging.info(f"req | turns={len(openai_messages)}")
-    resp = requests.post(GROQ_URL, headers=headers, data=json.dumps(payload), timeout=60)
-
+def _raise_for_llm_status(resp):
     if resp.status_code >= 400:
         try:
             body = resp.json()
@@ -122,11 +312,151 @@ def call_llm(messages, max_tokens=400):
         logging.error(f"res | status={resp.status_code} | body={body}")
         resp.raise_for_status()
 
+def call_llm(messages, max_tokens=400):
+    """
+    Llama al endpoint OpenAI-compatible de Groq con el modelo gemma2-9b-it.
+    Espera 'messages' como lista de dicts con 'role' en {'system','user','assistant'}
+    y 'content' como lista de bloques [{'type':'text','text': '...'}] o str.
+    """
+    headers, payload = _groq_request(messages, max_tokens, stream=False)
+
+    logging.info(f"req | turns={len(payload['messages'])}")
+    resp = http_session().post(GROQ_URL, headers=headers, data=json.dumps(payload), timeout=60)
+    _raise_for_llm_status(resp)
+
     data = resp.json()
     text = (data.get("choices", [{}])[0].get("message", {}).get("content", "")) or ""
     logging.info(f"res | status={resp.status_code} | chars={len(text)}")
     return text.strip() or "[Respuesta vacía]"
 
+def call_llm_stream(messages, max_tokens=400, on_delta=None, on_early=None):
+    """
+    Igual que call_llm pero con 'stream: true' (SSE). Cada fragmento de texto se
+    pasa a on_delta(fragmento); si on_delta devuelve True (p. ej. cuando el JSON
+    del router ya cerró) se deja de acumular y se llama on_early(texto), pero la
+    respuesta se sigue leyendo hasta [DONE]: cerrarla a medias tira la conexión
+    keep-alive del pool. Devuelve el texto acumulado.
+    """
+    headers, payload = _groq_request(messages, max_tokens, stream=True)
+
+    logging.info(f"req | turns={len(payload['messages'])} | stream=1")
+    t0 = time.monotonic()
+    first_ms = None
+    parts = []
+    done = False
+    with http_session().post(GROQ_URL, headers=headers, data=json.dumps(payload), timeout=60, stream=True) as resp:
+        _raise_for_llm_status(resp)
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            if done:
+                continue
+            try:
+                chunk = json.loads(data)
+            except Exception:
+                continue
+            delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content") or ""
+            if not delta:
+                continue
+            if first_ms is None:
+                first_ms = round((time.monotonic() - t0) * 1000)
+            parts.append(delta)
+            if on_delta is not None and on_delta(delta):
+                done = True
+                if on_early is not None:
+                    on_early("".join(parts).strip())
+
+    text = "".join(parts)
+    logging.info(f"res | status={resp.status_code} | stream=1 | ttft_ms={first_ms} | chars={len(text)}")
+    return text.strip() or "[Respuesta vacía]"
+
+class _IntentStream:
+    """
+    Consume los fragmentos del router: detecta en cuanto cierra el objeto JSON
+    y, si la acción es 'respond', reenvía el campo 'text' a on_text según llega.
+    """
+    _RESPOND = re.compile(r'"action"\s*:\s*"respond"')
+    _TEXT = re.compile(r'"text"\s*:\s*"')
+
+    def __init__(self, on_text=None):
+        self.buf = ""
+        self.on_text = on_text
+        self.streamed = False
+        self._start = -1
+        self._end = -1
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._scanned = 0
+        self._text_at = -1
+        self._emitted = 0
+
+    @property
+    def json_text(self) -> str | None:
+        return self.buf[self._start:self._end + 1] if self._end != -1 else None
+
+    def feed(self, delta: str) -> bool:
+        self.buf += delta
+        self._scan()
+        if self.on_text is not None and self._start != -1:
+            self._emit_text()
+        return self._end != -1
+
+    def _scan(self):
+        buf = self.buf
+        for k in range(self._scanned, len(buf)):
+            c = buf[k]
+            if self._start == -1:
+                if c == "{":
+                    self._start, self._depth = k, 1
+                continue
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c == "{":
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = k
+                    break
+        self._scanned = len(buf)
+
+    def _emit_text(self):
+        if self._text_at == -1:
+            if not self._RESPOND.search(self.buf, self._start):
+                return
+            m = self._TEXT.search(self.buf, self._start)
+            if not m:
+                return
+            self._text_at = m.end()
+        raw = self.buf[self._text_at:]
+        # avanza hasta la comilla de cierre sin partir una secuencia de escape
+        k = end = 0
+        while k < len(raw) and raw[k] != '"':
+            step = (6 if raw[k + 1:k + 2] == "u" else 2) if raw[k] == "\\" else 1
+            if k + step > len(raw):
+                break
+            k += step
+            end = k
+        try:
+            text = json.loads('"' + raw[:end] + '"')
+        except Exception:
+            return
+        if len(text) > self._emitted:
+            self.on_text(text[self._emitted:])
+            self._emitted = len(text)
+            self.streamed = True
+
 # =========================
 # Router prompt
 # =========================
@@ -136,36 +466,160 @@ ROUTER_SYSTEM = (
     "Herramientas disponibles (no menciones que son herramientas):\n"
     "1) list_my_certs(nombre:str)\n"
     "2) add_cert(row:{id, certificacion, nombre, fecha, vigencia_meses, proveedor?, tipo?, costo?})\n"
-    "3) upcoming_expirations(days_before:int)\n"
+    "3) upcoming_expirations(days_before:int, from_date?:YYYY-MM-DD, to_date?:YYYY-MM-DD)\n"
     "4) send_email(to:str, subject:str, html:str)\n"
     "5) fs_write(path:str, content:str)\n"
     "6) git_add_commit(repo_path:str, files:list[str], message:str)\n"
     "7) remote_health()\n"
-    "8) remote_echo(msg:str)\n\n"
+    "8) remote_echo(msg:str)\n"
+    "9) expiration_report(days_before?:int, from_date?:YYYY-MM-DD, to_date?:YYYY-MM-DD)\n"
+    "10) add_certs(rows?:list[row], path?:str (CSV/JSONL), dry_run?:bool) — alta masiva; úsala en vez de varios add_cert\n"
+    "11) search_certs(query:str, limit?:int) — búsqueda aproximada por persona o certificación (sin acentos, parcial)\n"
+    "12) notify_due(days_before?:int, from_date?:YYYY-MM-DD, to_date?:YYYY-MM-DD, dry_run?:bool) — "
+    "envía un correo resumen a cada persona con vencimientos (no repite avisos ya enviados)\n"
+    "13) email_status(ids?:list[str]) — estado de entrega de correos enviados (sin ids: los más recientes)\n"
+    "14) fs_write_many(files:list[{path, content}], repo_path?:str, message?:str, status?:bool) — "
+    "escribe varios archivos y, con message, los commitea juntos; úsala en vez de varios fs_write + git_add_commit\n\n"
     "Salida obligatoria:\n"
     "- Si es UNA sola acción de herramienta, devuelve SOLO:\n"
     "{ \"action\": \"call_tool\", \"tool\": \"<nombre>\", \"args\": { ... } }\n"
     "- Si son VARIAS acciones, devuelve SOLO:\n"
     "{ \"action\": \"batch\", \"actions\": [ {\"tool\":\"<nombre>\",\"args\":{...}}, ... ] }\n"
     "- Si no se requiere herramienta, devuelve SOLO:\n"
-    "{ \"action\": \"respond\", \"text\": \"<respuesta breve y clara>\" }\n"
+    "{ \"action\": \"respond\", \"text\": \"<respuesta breve y clara, con pasos reproducibles cuando proceda>\" }\n"
     "No uses backticks ni bloques de código. Devuelve JSON puro y nada más."
 )
 
+# =========================
+# Historial con presupuesto de tokens
+# =========================
+ROUTER_TOKEN_BUDGET = int(os.getenv("ROUTER_TOKEN_BUDGET", "1500"))
+ROUTER_HISTORY_TURNS = int(os.getenv("ROUTER_HISTORY_TURNS", "8"))
+TOOL_OUTPUT_MAX_LINES = int(os.getenv("TOOL_OUTPUT_MAX_LINES", "4"))
+
+def estimate_tokens(text: str) -> int:
+    # sin tokenizer del modelo: ~4 caracteres por token + overhead por mensaje
+    return (len(text) + 3) // 4 + 4
+
+def abbreviate_tool_output(text: str, max_lines: int = TOOL_OUTPUT_MAX_LINES, max_chars: int = 160) -> str:
+    """Deja el encabezado y las primeras líneas de un resumen de herramienta (listados largos)."""
+    lines = [ln if len(ln) <= max_chars else ln[:max_chars] + "…" for ln in text.splitlines()]
+    if len(lines) > max_lines + 1:
+        lines = lines[:max_lines + 1] + [f"… (+{len(lines) - max_lines - 1} líneas más)"]
+    return "\n".join(lines)
+
+class RouterHistory:
+    """
+    Historial de la conversación para el router. Guarda los últimos turnos
+    (salidas de herramientas abreviadas) y pliega los más viejos en un resumen
+    corto, de modo que cada petición quede bajo ROUTER_TOKEN_BUDGET.
+    """
+    def __init__(self, budget: int = ROUTER_TOKEN_BUDGET, max_turns: int = ROUTER_HISTORY_TURNS):
+        self.budget = budget
+        self.max_turns = max_turns
+        self.turns: list[dict] = []
+        self.summary_lines: list[str] = []
+
+    def add(self, role: str, text: str, tool: bool = False):
+        if tool:
+            text = abbreviate_tool_output(text)
+        self.turns.append({"role": role, "content": [{"type": "text", "text": text}]})
+        # los turnos usan como mucho la mitad del presupuesto; el resto es prompt + resumen
+        while len(self.turns) > self.max_turns or (
+            len(self.turns) > 1 and sum(self._turn_tokens(t) for t in self.turns) > self.budget // 2
+        ):
+            self._fold(self.turns.pop(0))
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def build_messages(self, system_text: str, user_text: str) -> list[dict]:
+        """
+        system (con el resumen) + turnos recientes + mensaje actual, recortando
+        los turnos más viejos si hiciera falta para respetar el presupuesto.
+        """
+        turns = list(self.turns)
+        # el turno actual del usuario ya está al final: se envía aparte
+        if turns and turns[-1]["role"] == "user" and _flatten_content(turns[-1]["content"]) == user_text:
+            turns.pop()
+        summary = self.summary
+        while summary and estimate_tokens(system_text) + estimate_tokens(summary) + estimate_tokens(user_text) > self.budget:
+            summary = summary.split("\n", 1)[1] if "\n" in summary else ""
+        if summary:
+            system_text = f"{system_text}\n\nResumen de la conversación previa:\n{summary}"
+        used = estimate_tokens(system_text) + estimate_tokens(user_text)
+        keep = []
+        for t in reversed(turns):
+            c = self._turn_tokens(t)
+            if used + c > self.budget:
+                break
+            keep.insert(0, t)
+            used += c
+        logging.info(f"router-history | turns={len(keep)}/{len(turns)} | tokens~{used} | budget={self.budget}")
+        return (
+            [{"role": "system", "content": [{"type": "text", "text": system_text}]}]
+            + keep
+            + [{"role": "user", "content": [{"type": "text", "text": user_text}]}]
+        )
+
+    def _turn_tokens(self, turn: dict) -> int:
+        return estimate_tokens(_flatten_content(turn["content"]))
+
+    def _fold(self, turn: dict):
+        first = _flatten_content(turn["content"]).strip().splitlines() or [""]
+        line = first[0] if len(first[0]) <= 100 else first[0][:100] + "…"
+        self.summary_lines.append(f"- {'usuario' if turn['role'] == 'user' else 'asistente'}: {line}")
+        while self.summary_lines and estimate_tokens(self.summary) > self.budget // 4:
+            self.summary_lines.pop(0)
+
 # =========================
 # Parser robusto de intención
 # =========================
-def call_llm_for_intent(history_text_turns: list[dict], user_text: str) -> dict:
+_DRAINS: set[asyncio.Future] = set()
+
+async def _stream_until_intent(messages, max_tokens, on_delta) -> str:
+    """
+    Corre call_llm_stream en un hilo y devuelve el texto en cuanto on_delta da
+    la intención por cerrada; el hilo sigue drenando la respuesta hasta [DONE]
+    por su cuenta (así la conexión vuelve al pool sin sumar latencia al turno).
+    """
+    loop = asyncio.get_running_loop()
+    early = loop.create_future()
+
+    def _on_early(text: str):
+        loop.call_soon_threadsafe(lambda: early.done() or early.set_result(text))
+
+    worker = asyncio.ensure_future(asyncio.to_thread(call_llm_stream, messages, max_tokens, on_delta, _on_early))
+    await asyncio.wait({early, worker}, return_when=asyncio.FIRST_COMPLETED)
+    if not early.done():
+        early.cancel()
+        return worker.result()
+
+    def _drained(t: asyncio.Future):
+        _DRAINS.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logging.warning(f"llm-drain-error | {t.exception()}")
+
+    _DRAINS.add(worker)
+    worker.add_done_callback(_drained)
+    return early.result() or "[Respuesta vacía]"
+
+async def call_llm_for_intent(history: RouterHistory, user_text: str, on_text=None) -> dict:
     """
     Pide al LLM una intención estructurada (JSON puro) y la parsea.
+    La llamada HTTP (bloqueante) corre en un hilo para no frenar el loop.
+    Con LLM_STREAM, el JSON se parsea apenas cierra y el texto de 'respond'
+    se entrega a on_text mientras llega (la intención queda con '_streamed').
     """
-    messages = []
-    messages.append({"role": "system", "content": [{"type": "text", "text": ROUTER_SYSTEM}]})
-    for turn in history_text_turns[-8:]:
-        messages.append(turn)
-    messages.append({"role": "user", "content": [{"type": "text", "text": user_text}]})
+    messages = history.build_messages(ROUTER_SYSTEM, user_text)
 
-    raw = call_llm(messages, max_tokens=450)
+    stream = None
+    if LLM_STREAM:
+        stream = _IntentStream(on_text)
+        raw = await _stream_until_intent(messages, 450, stream.feed)
+    else:
+        raw = await asyncio.to_thread(call_llm, messages, 450)
 
     def _strip_code_fences(s: str) -> str:
         s = s.strip()
@@ -188,104 +642,769 @@ def call_llm_for_intent(history_text_turns: list[dict], user_text: str) -> dict:
         except Exception:
             return None
 
-    intent = _extract_json(raw)
+    intent = _extract_json(stream.json_text or raw) if stream is not None else _extract_json(raw)
     if isinstance(intent, dict):
+        if stream is not None and stream.streamed:
+            intent["_streamed"] = True
         return intent
 
     logging.error(f"router-parse-error | raw={raw[:500]}")
-    return {"action": "respond", "text": raw.strip() or "No tengo una respuesta en este momento."}
+    # '_fallback': respuesta de emergencia (incluye "[Respuesta vacía]"); no debe cachearse
+    fallback = {"action": "respond", "text": raw.strip() or "No tengo una respuesta en este momento.", "_fallback": True}
+    if stream is not None and stream.streamed:
+        fallback["_streamed"] = True  # el texto ya se mostró mientras llegaba
+    return fallback
 
 # =========================
-# Herramientas
+# Pre-router determinista (fast path)
 # =========================
-async def fs_write(path: str, content: str):
-    import os as _os
-    # normaliza ruta
-    if not _os.path.isabs(path):
-        path = _os.path.join(SANDBOX_ROOT, path)
-    fs_params = StdioServerParameters(
+FAST_ROUTER_MIN_CONFIDENCE = float(os.getenv("FAST_ROUTER_MIN_CONFIDENCE", "0.85"))
+ALERTS_DAYS_DEFAULT = int(os.getenv("ALERTS_DAYS_BEFORE", "30") or 30)
+
+_KV_RE = re.compile(r"""(\w+)=(?:"([^"]*)"|'([^']*)'|(\S+))""")
+
+def _parse_kv(text: str) -> dict:
+    """key=valor, key="valor con espacios" o key='...' (las rutas de Windows se respetan)."""
+    out = {}
+    for m in _KV_RE.finditer(text):
+        k, v = m.group(1), next(g for g in m.groups()[1:] if g is not None)
+        out[k.lower()] = v
+    return out
+
+def _rule_add_cert(m):
+    row = _parse_kv(m.group("kv"))
+    if str(row.get("vigencia_meses", "")).isdigit():
+        row["vigencia_meses"] = int(row["vigencia_meses"])
+    return "add_cert", {"row": row}, 1.0
+
+def _rule_send_email(m):
+    kv = _parse_kv(m.group("kv"))
+    return "send_email", {k: kv.get(k, "") for k in ("to", "subject", "html")}, 1.0
+
+def _rule_fs_write(m):
+    kv = _parse_kv(m.group("kv"))
+    return "fs_write", {"path": kv.get("path", ""), "content": kv.get("content", "")}, 1.0
+
+def _rule_git_commit(m):
+    kv = _parse_kv(m.group("kv"))
+    files = [f.strip() for f in kv.get("files", "").split(",") if f.strip()]
+    args = {"repo_path": kv.get("repo_path") or kv.get("repo", ""), "files": files,
+            "message": kv.get("message", "Update via MCP")}
+    return "git_add_commit", args, 1.0
+
+def _rule_import_certs(m):
+    kv = _parse_kv(m.group("kv"))
+    args = {"path": kv.get("path", "")}
+    if kv.get("dry_run", "").lower() in ("1", "true", "si", "sí", "yes"):
+        args["dry_run"] = True
+    return "add_certs", args, 1.0
+
+def _rule_notify_due(m):
+    n = m.group("n")
+    args = {"days_before": int(n) if n else ALERTS_DAYS_DEFAULT}
+    if m.group("dry"):
+        args["dry_run"] = True
+    return "notify_due", args, 1.0
+
+# palabras de cortesía/tiempo que suelen seguir al nombre ("de Ana Gómez por favor", "... hoy")
+_NAME_TAIL_WORDS = {"por", "favor", "porfa", "porfavor", "gracias", "hoy", "ahora", "ya", "ahorita",
+                    "urgente", "please", "pls", "en", "que", "con", "y", "desde", "hasta"}
+NAME_MAX_TOKENS = 4  # nombre + dos apellidos
+
+def _rule_list_certs(m):
+    tokens = m.group("nombre").split()
+    cut = next((i for i, t in enumerate(tokens) if t.lower() in _NAME_TAIL_WORDS), len(tokens))
+    name = tokens[:cut]
+    if not name:
+        return "list_my_certs", {"nombre": ""}, 0.0
+    # cola desconocida o nombre demasiado largo: mejor que decida el LLM
+    confidence = 0.95 if len(name) <= NAME_MAX_TOKENS else 0.6
+    return "list_my_certs", {"nombre": " ".join(name)}, confidence
+
+def _rule_expirations(m):
+    n = m.group("n")
+    if n:
+        confidence = 0.95
+    elif re.search(r"vencimientos|que\s+vencen", m.group(0), re.I):
+        confidence = 0.9  # "próximos vencimientos": pedido claro con el rango por defecto
+    else:
+        confidence = 0.8  # "vence" suelto es ambiguo: lo decide el LLM
+    return "upcoming_expirations", {"days_before": int(n) if n else ALERTS_DAYS_DEFAULT}, confidence
+
+# (regex, constructor) -> (tool, args, confianza). Se prueban en orden; la primera gana.
+_FAST_RULES = [
+    # comandos de consola documentados en el README
+    (re.compile(r"^/mis-certs\s+(?P<nombre>.+)$", re.I),
+     lambda m: ("list_my_certs", {"nombre": m.group("nombre").strip()}, 1.0)),
+    (re.compile(r"^/vencen(?:\s+(?P<n>\d+))?$", re.I),
+     lambda m: ("upcoming_expirations", {"days_before": int(m.group("n") or ALERTS_DAYS_DEFAULT)}, 1.0)),
+    (re.compile(r"^/add-cert\s+(?P<kv>.+)$", re.I), _rule_add_cert),
+    (re.compile(r"^/import-certs\s+(?P<kv>.+)$", re.I), _rule_import_certs),
+    (re.compile(r"^/correo\s+(?P<kv>.+)$", re.I), _rule_send_email),
+    (re.compile(r"^/correo-estado(?:\s+(?P<ids>.+))?$", re.I),
+     lambda m: ("email_status", {"ids": (m.group("ids") or "").replace(",", " ").split()}, 1.0)),
+    (re.compile(r"^/notificar(?:\s+(?P<n>\d+))?(?:\s+(?P<dry>dry_run|prueba))?$", re.I), _rule_notify_due),
+    (re.compile(r"^/fs-write\s+(?P<kv>.+)$", re.I), _rule_fs_write),
+    (re.compile(r"^/commit\s+(?P<kv>.+)$", re.I), _rule_git_commit),
+    (re.compile(r"^/buscar\s+(?P<q>.+)$", re.I),
+     lambda m: ("search_certs", {"query": m.group("q").strip()}, 1.0)),
+    (re.compile(r"^/remote-health$", re.I), lambda m: ("remote_health", {}, 1.0)),
+    (re.compile(r"^/echo\s+(?P<msg>.+)$", re.I), lambda m: ("remote_echo", {"msg": m.group("msg").strip()}, 1.0)),
+    # lenguaje natural frecuente
+    (re.compile(
+        r"^(?:por favor\s+)?(?:lista(?:r|me)?|mu[eé]strame|muestra|mostrar|ver|dame|cu[aá]les son)\s+"
+        r"(?:las?\s+|los\s+)?(?:mis\s+)?(?:certificaciones|certificados|certs)\s+(?:de|para)\s+"
+        r"(?P<nombre>[^\W\d_]+(?:[ '-][^\W\d_]+){0,5})\s*[.!?,]*$", re.I),
+     _rule_list_certs),
+    (re.compile(
+        r"^(?:¿\s*)?(?:(?:mu[eé]strame|muestra|lista(?:r)?|ver|dame|cu[aá]les son|qu[eé])\s+)?"
+        r"(?:(?:los|las|mis)\s+)?(?:pr[oó]ximos\s+)?"
+        r"(?:vencimientos|(?:certificaciones|certificados|certs)\s+que\s+vencen|vencen|vence)"
+        r"(?:\s+(?:en|dentro\s+de)\s+(?:los\s+)?(?:pr[oó]ximos\s+)?(?P<n>\d+)\s+d[ií]as)?\s*[.!?]*$", re.I),
+     _rule_expirations),
+    (re.compile(r"^(?:¿\s*)?(?:estado|salud|health)\s+(?:del\s+)?(?:servicio\s+|servidor\s+)?remoto\s*[.!?]*$", re.I),
+     lambda m: ("remote_health", {}, 0.95)),
+    (re.compile(r"^(?:eco|echo)\s+(?:remoto\s+)?(?P<msg>.+)$", re.I),
+     lambda m: ("remote_echo", {"msg": m.group("msg").strip()}, 0.9)),
+]
+
+class FastRouterStats:
+    """Contadores de aciertos del pre-router (se registran en el log y al salir)."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.by_tool: dict[str, int] = {}
+
+    def record(self, tool: str | None):
+        if tool is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.by_tool[tool] = self.by_tool.get(tool, 0) + 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        return f"fast-path {self.hits}/{total} ({self.hit_rate:.0%}) | por herramienta={self.by_tool}"
+
+FAST_ROUTER_STATS = FastRouterStats()
+
+def fast_route(user_text: str) -> dict | None:
+    """
+    Intenta mapear la entrada a una herramienta sin pasar por el LLM.
+    Devuelve la intención (mismo formato que el router) o None si la confianza
+    no supera FAST_ROUTER_MIN_CONFIDENCE.
+    """
+    text = " ".join(user_text.split())
+    for rx, build in _FAST_RULES:
+        m = rx.match(text)
+        if not m:
+            continue
+        tool, args, confidence = build(m)
+        if confidence <= FAST_ROUTER_MIN_CONFIDENCE:
+            break
+        FAST_ROUTER_STATS.record(tool)
+        logging.info(f"fast-route | tool={tool} | conf={confidence} | {FAST_ROUTER_STATS.summary()}")
+        return {"action": "call_tool", "tool": tool, "args": args, "_route": "fast"}
+    FAST_ROUTER_STATS.record(None)
+    return None
+
+# =========================
+# Caché de intenciones (LRU + TTL)
+# =========================
+INTENT_CACHE_MAX = int(os.getenv("INTENT_CACHE_MAX", "256"))
+INTENT_CACHE_TTL = float(os.getenv("INTENT_CACHE_TTL", "3600"))
+INTENT_CACHE_HISTORY_TURNS = int(os.getenv("INTENT_CACHE_HISTORY_TURNS", "2"))
+INTENT_CACHE_PATH = os.getenv("INTENT_CACHE_PATH", "").strip()
+INTENT_CACHE_ALLOW_SIDE_EFFECTS = os.getenv("INTENT_CACHE_ALLOW_SIDE_EFFECTS", "0").strip().lower() in ("1", "true", "yes")
+
+# herramientas con efectos: repetir la intención cacheada repetiría la acción
+SIDE_EFFECT_TOOLS = {"add_cert", "add_certs", "send_email", "notify_due", "fs_write", "fs_write_many", "git_add_commit"}
+
+def _normalize_user_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w@./-]+", " ", text)
+    return " ".join(text.split())
+
+class IntentCache:
+    """
+    Caché de intenciones del router, clave = texto normalizado + hash de los
+    últimos turnos previos. Expulsión LRU + TTL y, opcionalmente, respaldo en
+    disco (JSON) para sobrevivir reinicios.
+    """
+    def __init__(self, max_entries: int = INTENT_CACHE_MAX, ttl: float = INTENT_CACHE_TTL,
+                 history_turns: int = INTENT_CACHE_HISTORY_TURNS, path: str = INTENT_CACHE_PATH,
+                 allow_side_effects: bool = INTENT_CACHE_ALLOW_SIDE_EFFECTS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.path = path
+        self.allow_side_effects = allow_side_effects
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._load()
+
+    def key(self, history: list[dict], user_text: str) -> str:
+        turns = [t for t in history if t.get("role") != "system"]
+        # el turno actual del usuario ya está en el historial: no forma parte de la ventana
+        if turns and turns[-1].get("role") == "user" and _flatten_content(turns[-1].get("content")) == user_text:
+            turns = turns[:-1]
+        window = turns[-self.history_turns:] if self.history_turns > 0 else []
+        h = hashlib.sha1(json.dumps(
+            [[t.get("role"), _flatten_content(t.get("content"))] for t in window], ensure_ascii=False
+        ).encode("utf-8")).hexdigest()[:16]
+        return f"{_normalize_user_text(user_text)}|{h}"
+
+    def cacheable(self, intent: dict) -> bool:
+        if intent.get("_fallback"):
+            return False  # una falla del LLM no se repite durante todo el TTL
+        if self.allow_side_effects:
+            return True
+        if intent.get("action") == "call_tool":
+            return intent.get("tool") not in SIDE_EFFECT_TOOLS
+        if intent.get("action") == "batch":
+            return not any(step.get("tool") in SIDE_EFFECT_TOOLS for step in intent.get("actions") or [])
+        return True
+
+    def get(self, history: list[dict], user_text: str) -> dict | None:
+        k = self.key(history, user_text)
+        item = self._data.get(k)
+        if item is None or item[0] < time.time():
+            if item is not None:
+                del self._data[k]
+            self.misses += 1
+            return None
+        self._data.move_to_end(k)
+        self.hits += 1
+        return json.loads(json.dumps(item[1]))
+
+    def put(self, history: list[dict], user_text: str, intent: dict):
+        if not self.cacheable(intent):
+            self.skipped += 1
+            return
+        clean = {k: v for k, v in intent.items() if not k.startswith("_")}
+        k = self.key(history, user_text)
+        self._data[k] = (time.time() + self.ttl, clean)
+        self._data.move_to_end(k)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        self._save()
+
+    def summary(self) -> str:
+        return f"intent-cache hits={self.hits} misses={self.misses} skipped={self.skipped} size={len(self._data)}"
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            now = time.time()
+            for k, exp, intent in entries[-self.max_entries:]:
+                if exp >= now:
+                    self._data[k] = (exp, intent)
+        except Exception as e:
+            logging.warning(f"intent-cache | load-error | path={self.path} | err={e!r}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump([[k, exp, intent] for k, (exp, intent) in self._data.items()], f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.warning(f"intent-cache | save-error | path={self.path} | err={e!r}")
+
+INTENT_CACHE = IntentCache()
+
+async def cached_call_llm_for_intent(history: RouterHistory, user_text: str, on_text=None) -> dict:
+    """call_llm_for_intent con INTENT_CACHE delante."""
+    intent = INTENT_CACHE.get(history.turns, user_text)
+    if intent is not None:
+        logging.info(f"intent-cache | hit | {INTENT_CACHE.summary()}")
+        return intent
+    intent = await call_llm_for_intent(history, user_text, on_text=on_text)
+    INTENT_CACHE.put(history.turns, user_text, intent)
+    return intent
+
+# =========================
+# Pool de sesiones MCP (persistentes)
+# =========================
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "60"))
+MCP_PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT", "5"))
+MCP_HEALTHCHECK_INTERVAL = float(os.getenv("MCP_HEALTHCHECK_INTERVAL", "30"))
+# Backends que se arrancan en segundo plano al abrir la consola (certtrack, filesystem, git; vacío o 'none' = ninguno)
+PREWARM_BACKENDS = [b.strip().lower() for b in os.getenv("PREWARM_BACKENDS", "certtrack,filesystem,git").split(",")
+                    if b.strip() and b.strip().lower() not in ("0", "none", "no")]
+# Sesión de reserva ya inicializada por backend precalentado (0 = sin reserva)
+PREWARM_STANDBY = os.getenv("PREWARM_STANDBY", "1").strip().lower() not in ("0", "false", "no")
+PREWARM_CHECK_INTERVAL = float(os.getenv("PREWARM_CHECK_INTERVAL", "15"))
+
+# URL de un CertTrack compartido por HTTP (p. ej. http://127.0.0.1:8000/mcp); vacío = subproceso STDIO
+CERTTRACK_URL = os.getenv("CERTTRACK_URL", "").strip()
+
+def _certtrack_params() -> StdioServerParameters | str:
+    if CERTTRACK_URL:
+        return CERTTRACK_URL
+    return StdioServerParameters(command="python", args=["-m", "certtrack_mcp.server"])
+
+def _http_client(url: str):
+    try:
+        from mcp.client.streamable_http import streamable_http_client
+    except ImportError:  # versiones anteriores del SDK
+        from mcp.client.streamable_http import streamablehttp_client as streamable_http_client
+    return streamable_http_client(url)
+
+def _fs_params() -> StdioServerParameters:
+    return StdioServerParameters(
         command="npx",
         args=["-y", "--silent", "@modelcontextprotocol/server-filesystem", SANDBOX_ROOT],
     )
-    async with stdio_client(fs_params) as (r, w):
-        async with ClientSession(r, w) as sess:
-            await sess.initialize()
-            return await log_mcp_call(sess, "write_file", {"path": path, "content": content})
 
-async def git_add_commit(repo_path: str, files: list[str], message: str):
-    import os as _os
+def _git_params(repo_path: str) -> StdioServerParameters:
+    return StdioServerParameters(
+        command="python",
+        args=["-m", "mcp_server_git", "--repository", repo_path],
+    )
+
+class _PooledSession:
+    """
+    Un servidor MCP vivo: el subproceso (o la conexión HTTP, si params es una URL)
+    y su ClientSession se abren y se cierran dentro de una tarea propia (anyio
+    exige salir del contexto en la misma tarea).
+    """
+    def __init__(self, key: str, params: StdioServerParameters | str):
+        self.key = key
+        self.params = params
+        self.session: ClientSession | None = None
+        self.last_ok = 0.0
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._error: BaseException | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"mcp:{self.key}")
+        ready = asyncio.create_task(self._ready.wait())
+        await asyncio.wait({ready, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if not self._ready.is_set():
+            ready.cancel()
+            raise RuntimeError(f"No se pudo iniciar el servidor MCP '{self.key}': {self._error!r}")
+
+    async def _run(self):
+        try:
+            transport = _http_client(self.params) if isinstance(self.params, str) else stdio_client(self.params)
+            async with transport as streams:
+                read, write = streams[0], streams[1]
+                async with ClientSession(read, write) as sess:
+                    await sess.initialize()
+                    tools = await sess.list_tools()
+                    logging.info(f"mcp-pool | start | key={self.key} | tools={[t.name for t in tools.tools]}")
+                    self.session = sess
+                    self.last_ok = time.monotonic()
+                    self._ready.set()
+                    await self._closing.wait()
+        except Exception as e:
+            self._error = e
+            logging.error(f"mcp-pool | exit | key={self.key} | err={e!r}")
+        finally:
+            self.session = None
+
+    async def ping(self):
+        # si el hijo murió, la tarea runner termina antes que el ping
+        ping = asyncio.ensure_future(self.session.send_ping())
+        done, _ = await asyncio.wait({ping, self._task}, timeout=MCP_PING_TIMEOUT,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if ping not in done:
+            ping.cancel()
+            raise ConnectionError(f"sin respuesta de '{self.key}'")
+        ping.result()
+        self.last_ok = time.monotonic()
+
+    async def close(self):
+        self._closing.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, MCP_PING_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self._task.cancel()
+        logging.info(f"mcp-pool | close | key={self.key}")
+
+def _standby_params(params: StdioServerParameters | str) -> StdioServerParameters | str:
+    """
+    Parámetros de una reserva: MCP_STANDBY=1 le indica al servidor que no arranque
+    servicios de fondo (bandeja de salida, precarga, espejo de Sheets) hasta su
+    primera llamada, así la reserva ociosa no duplica workers ni sondeos.
+    """
+    if isinstance(params, str):
+        return params  # servidor HTTP compartido: la reserva es solo otra conexión
+    return params.model_copy(update={"env": {**(params.env or {}), "MCP_STANDBY": "1"}})
+
+class MCPSessionPool:
+    """
+    Sesiones MCP de larga vida por servidor ('certtrack', 'filesystem', 'git:<repo>').
+    Arranca perezosamente, hace ping si la sesión lleva tiempo ociosa y reinicia
+    los procesos hijos que hayan muerto.
+    Los backends precalentados (prewarm) se arrancan en segundo plano y tienen
+    además una sesión de reserva ya inicializada: si la activa muere, la reserva
+    la reemplaza al instante y se levanta otra reserva en segundo plano.
+    """
+    def __init__(self):
+        self._sessions: dict[str, _PooledSession] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._standby: dict[str, _PooledSession] = {}
+        self._warming: dict[str, asyncio.Task] = {}
+        self._managed: dict[str, StdioServerParameters | str] = {}
+        self._supervisor: asyncio.Task | None = None
+        self._background: set[asyncio.Task] = set()
+
+    async def get(self, key: str, params: StdioServerParameters | str,
+                  max_idle: float = MCP_HEALTHCHECK_INTERVAL) -> ClientSession:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            ps = self._sessions.get(key)
+            if ps is not None and ps.alive and time.monotonic() - ps.last_ok > max_idle:
+                try:
+                    await ps.ping()
+                except Exception as e:
+                    logging.warning(f"mcp-pool | ping-fail | key={key} | err={e!r}")
+                    await ps.close()
+            if ps is None or not ps.alive:
+                if ps is not None:
+                    logging.warning(f"mcp-pool | restart | key={key}")
+                ps = await self._take_standby(key)
+                if ps is None:
+                    ps = _PooledSession(key, params)
+                    await ps.start()
+                self._sessions[key] = ps
+                self._ensure_standby(key)
+            return ps.session
+
+    # --- precalentado ---
+    async def _take_standby(self, key: str) -> "_PooledSession | None":
+        ps = self._standby.pop(key, None)
+        if ps is None or not ps.alive:
+            return None
+        try:
+            await ps.ping()  # una reserva muerta no se promueve
+        except Exception as e:
+            logging.warning(f"mcp-pool | standby-dead | key={key} | err={e!r}")
+            await ps.close()
+            return None
+        ps.key = key
+        logging.info(f"mcp-pool | standby-promote | key={key}")
+        return ps
+
+    def _ensure_standby(self, key: str):
+        """Lanza (en segundo plano) una reserva para 'key' si es un backend precalentado y no la tiene."""
+        if not PREWARM_STANDBY or key not in self._managed:
+            return
+        sb = self._standby.get(key)
+        if (sb is not None and sb.alive) or (key in self._warming and not self._warming[key].done()):
+            return
+        self._warming[key] = asyncio.create_task(self._start_standby(key), name=f"mcp-standby:{key}")
+
+    async def _start_standby(self, key: str):
+        ps = _PooledSession(f"{key}#standby", _standby_params(self._managed[key]))
+        t0 = time.monotonic()
+        try:
+            await ps.start()
+        except Exception as e:
+            logging.warning(f"mcp-pool | standby-fail | key={key} | err={e!r}")
+            return
+        old = self._standby.get(key)
+        self._standby[key] = ps
+        if old is not None:
+            await old.close()
+        logging.info(f"mcp-pool | standby-ready | key={key} | ms={round((time.monotonic() - t0) * 1000)}")
+
+    def prewarm(self, specs: dict[str, StdioServerParameters | str]):
+        """
+        Arranca en segundo plano la sesión activa (y su reserva) de cada backend
+        y deja un supervisor que reemplaza las que mueran. No bloquea: la primera
+        llamada a un backend que aún está arrancando espera ese mismo arranque.
+        """
+        for key, params in specs.items():
+            self._managed[key] = params
+            task = asyncio.create_task(self._warm(key, params), name=f"mcp-prewarm:{key}")
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.create_task(self._supervise(), name="mcp-prewarm-supervisor")
+
+    async def _warm(self, key: str, params: StdioServerParameters | str):
+        t0 = time.monotonic()
+        try:
+            await self.get(key, params)
+            logging.info(f"mcp-pool | prewarm | key={key} | ms={round((time.monotonic() - t0) * 1000)}")
+        except Exception as e:
+            logging.warning(f"mcp-pool | prewarm-fail | key={key} | err={e!r}")
+
+    async def _supervise(self):
+        """Cada PREWARM_CHECK_INTERVAL: ping a activas y reservas ociosas; las caídas se reemplazan ya, no en la próxima llamada."""
+        while True:
+            await asyncio.sleep(PREWARM_CHECK_INTERVAL)
+            for key, params in list(self._managed.items()):
+                if key in self._sessions:
+                    # get() hace el ping y, si falla, promueve la reserva
+                    try:
+                        await self.get(key, params, max_idle=PREWARM_CHECK_INTERVAL)
+                    except Exception as e:
+                        logging.warning(f"mcp-pool | supervise-fail | key={key} | err={e!r}")
+                sb = self._standby.get(key)
+                if sb is not None and (not sb.alive or time.monotonic() - sb.last_ok > PREWARM_CHECK_INTERVAL):
+                    try:
+                        if not sb.alive:
+                            raise ConnectionError("proceso terminado")
+                        await sb.ping()
+                    except Exception as e:
+                        logging.warning(f"mcp-pool | standby-dead | key={key} | err={e!r}")
+                        if self._standby.get(key) is sb:
+                            self._standby.pop(key)
+                        await sb.close()
+                if key in self._sessions:
+                    self._ensure_standby(key)
+
+    def status(self) -> dict:
+        return {key: {"active": bool(self._sessions.get(key) and self._sessions[key].alive),
+                      "standby": bool(self._standby.get(key) and self._standby[key].alive)}
+                for key in set(self._sessions) | set(self._managed)}
+
+    async def call(self, key: str, params: StdioServerParameters | str, tool_name: str, arguments: dict):
+        session = await self.get(key, params)
+        try:
+            res = await asyncio.wait_for(log_mcp_call(session, tool_name, arguments), MCP_CALL_TIMEOUT)
+        except asyncio.TimeoutError:
+            # la respuesta tardía seguiría pendiente en esta sesión: se descarta y la próxima llamada reinicia
+            ps = self._sessions.get(key)
+            if ps is not None and ps.session is session:
+                logging.warning(f"mcp-pool | call-timeout | key={key} | tool={tool_name}")
+                await ps.close()
+            raise
+        ps = self._sessions.get(key)
+        if ps is not None:
+            ps.last_ok = time.monotonic()
+        return res
+
+    async def aclose(self):
+        tasks = [t for t in (self._supervisor, *self._warming.values(), *self._background) if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._supervisor, self._warming, self._background = None, {}, set()
+        sessions = list(self._sessions.values()) + list(self._standby.values())
+        self._sessions, self._standby = {}, {}
+        await asyncio.gather(*(ps.close() for ps in sessions), return_exceptions=True)
+
+MCP_POOL = MCPSessionPool()
+
+def prewarm_specs(backends: list[str] | None = None) -> dict[str, StdioServerParameters | str]:
+    """Claves y parámetros del pool para los nombres de PREWARM_BACKENDS."""
+    specs: dict[str, StdioServerParameters | str] = {}
+    for name in (PREWARM_BACKENDS if backends is None else backends):
+        if name == "certtrack":
+            specs["certtrack"] = _certtrack_params()
+        elif name == "filesystem":
+            specs["filesystem"] = _fs_params()
+        elif name == "git":
+            repo = _resolve_repo_path("")
+            specs[f"git:{repo}"] = _git_params(repo)
+        else:
+            logging.warning(f"prewarm | backend desconocido: {name}")
+    return specs
+
+# =========================
+# Herramientas
+# =========================
+def _resolve_fs_path(path: str) -> str:
+    # normaliza ruta
+    if not os.path.isabs(path):
+        path = os.path.join(SANDBOX_ROOT, path)
+    return path
+
+def _resolve_repo_path(repo_path: str) -> str:
     repo_path = repo_path or REPO_PATH_DEFAULT
-    if not _os.path.isabs(repo_path):
-        repo_path = _os.path.join(SANDBOX_ROOT, repo_path)
+    if not os.path.isabs(repo_path):
+        repo_path = os.path.join(SANDBOX_ROOT, repo_path)
+    return repo_path
 
+async def fs_write(path: str, content: str):
+    path = _resolve_fs_path(path)
+    return await MCP_POOL.call("filesystem", _fs_params(), "write_file", {"path": path, "content": content})
+
+def _repo_relative(repo_path: str, files: list[str]) -> list[str]:
     # normaliza files relativos al repo
     norm_files = []
     for f in (files or []):
-        if _os.path.isabs(f):
+        if os.path.isabs(f):
             try:
-                rel = _os.path.relpath(f, repo_path)
+                rel = os.path.relpath(f, repo_path)
                 norm_files.append(rel if not rel.startswith("..") else f)
             except Exception:
                 norm_files.append(f)
         else:
             norm_files.append(f)
+    return norm_files
+
+async def git_add_commit(repo_path: str, files: list[str], message: str, status: bool = True):
+    repo_path = _resolve_repo_path(repo_path)
+    key, params = f"git:{repo_path}", _git_params(repo_path)
+    # un solo git_add para todos los archivos; git_status es opcional (un round trip menos)
+    added = await MCP_POOL.call(key, params, "git_add", {"repo_path": repo_path, "files": _repo_relative(repo_path, files)})
+    if getattr(added, "isError", False):
+        return {"ok": False, "error": f"git_add: {_mcp_text(added) or 'error'}", "commit": None, "status": None}
+    res = await MCP_POOL.call(key, params, "git_commit", {"repo_path": repo_path, "message": message})
+    if getattr(res, "isError", False):
+        return {"ok": False, "error": f"git_commit: {_mcp_text(res) or 'error'}", "commit": res, "status": None}
+    st = await MCP_POOL.call(key, params, "git_status", {"repo_path": repo_path}) if status else None
+    return {"commit": res, "status": st}
+
+FS_WRITE_CONCURRENCY = int(os.getenv("FS_WRITE_CONCURRENCY", "8"))
+
+def _mcp_text(res) -> str:
+    return "\n".join(getattr(c, "text", "") for c in (getattr(res, "content", None) or [])).strip()
+
+def _fs_many_paths(files: list[dict]) -> list[str]:
+    """Rutas absolutas de fs_write_many, resueltas igual que fs_write (relativas a SANDBOX_ROOT)."""
+    return [os.path.normpath(_resolve_fs_path(str(f.get("path", "")))) for f in files]
+
+def _inside_repo(path: str, repo: str) -> bool:
+    """¿'path' queda dentro de 'repo'? Ambos ya resueltos; se comparan reales (symlinks, '..', mayúsculas)."""
+    path, repo = (os.path.normcase(os.path.realpath(p)) for p in (path, repo))
+    try:
+        return path != repo and os.path.commonpath([path, repo]) == repo
+    except ValueError:  # otra unidad (Windows)
+        return False
 
-    git_params = StdioServerParameters(
-        command="python",
-        args=["-m", "mcp_server_git", "--repository", repo_path],
-    )
-    async with stdio_client(git_params) as (r, w):
-        async with ClientSession(r, w) as sess:
-            await sess.initialize()
-            await log_mcp_call(sess, "git_add", {"repo_path": repo_path, "files": norm_files})
-            res = await log_mcp_call(sess, "git_commit", {"repo_path": repo_path, "message": message})
-            status = await log_mcp_call(sess, "git_status", {"repo_path": repo_path})
-            return {"commit": res, "status": status}
+async def fs_write_many(files: list[dict], repo_path: str = "", message: str = "", status: bool = False):
+    """
+    Escribe varios archivos en paralelo por la sesión de filesystem del pool y, si hay
+    'message', los commitea con un solo git_add + git_commit (git_status opcional).
+    El costo en round trips no crece con la cantidad de archivos: las escrituras viajan
+    juntas por la misma sesión y el commit es siempre 2 (o 3) llamadas.
+    """
+    t0 = time.monotonic()
+    files = [f for f in (files or []) if isinstance(f, dict) and f.get("path")]
+    if not files:
+        return {"ok": False, "error": "sin archivos (se espera files=[{path, content}, ...])"}
+    commit = bool(message)
+    paths = _fs_many_paths(files)
+    if commit:
+        repo = _resolve_repo_path(repo_path)
+        outside = [p for p in paths if not _inside_repo(p, repo)]
+        if outside:
+            return {"ok": False, "error": f"archivos fuera del repositorio: {outside[:5]}"}
+
+    sem = asyncio.Semaphore(max(1, FS_WRITE_CONCURRENCY))
+
+    async def _write(path: str, content: str):
+        async with sem:
+            try:
+                res = await MCP_POOL.call("filesystem", _fs_params(), "write_file", {"path": path, "content": content})
+            except Exception as e:
+                return {"path": path, "error": repr(e)}
+            if getattr(res, "isError", False):
+                return {"path": path, "error": _mcp_text(res) or "error del servidor de archivos"}
+            return None
+
+    results = await asyncio.gather(*(_write(p, str(f.get("content", ""))) for p, f in zip(paths, files)))
+    errors = [r for r in results if r]
+    out = {"ok": not errors, "written": len(paths) - len(errors), "files": paths, "errors": errors}
+    if errors:
+        # sin commit parcial: se informa y el usuario reintenta
+        out["ms"] = round((time.monotonic() - t0) * 1000)
+        return out
+    if commit:
+        res = await git_add_commit(repo_path, paths, message, status=status)
+        out["commit"] = _mcp_text(res["commit"]) if res["commit"] is not None else ""
+        if res.get("ok") is False:
+            out["ok"], out["error"] = False, res["error"]
+        if res["status"] is not None:
+            out["status"] = _mcp_text(res["status"])
+    out["ms"] = round((time.monotonic() - t0) * 1000)
+    return out
 
 async def certtrack_list(nombre: str):
-    params = StdioServerParameters(command="python", args=["-m", "certtrack_mcp.server"])
-    async with stdio_client(params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            tools = await session.list_tools()
-            logging.info(f"certtrack-tools: {[t.name for t in tools.tools]}")
-            res = await log_mcp_call(
-                session, "list_my_certs",
-                {"spreadsheet_id": "local", "nombre": nombre}
-            )
-            return res
+    return await MCP_POOL.call(
+        "certtrack", _certtrack_params(), "list_my_certs",
+        {"spreadsheet_id": "local", "nombre": nombre}
+    )
+
+async def certtrack_search(query: str, limit: int = 10):
+    return await MCP_POOL.call(
+        "certtrack", _certtrack_params(), "search_certs", {"query": query, "limit": int(limit)}
+    )
 
 async def certtrack_add_cert(row: dict):
-    params = StdioServerParameters(command="python", args=["-m", "certtrack_mcp.server"])
-    async with stdio_client(params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            res = await log_mcp_call(session, "sheets_append_cert", {"spreadsheet_id": "local", "row": row})
-            return res
-
-async def certtrack_alerts(days_before: int = 30):
-    params = StdioServerParameters(command="python", args=["-m", "certtrack_mcp.server"])
-    async with stdio_client(params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            res = await log_mcp_call(session, "alerts_schedule_due", {
-                "spreadsheet_id": "local", "days_before": int(days_before)
-            })
-            return res
+    return await MCP_POOL.call(
+        "certtrack", _certtrack_params(), "sheets_append_cert",
+        {"spreadsheet_id": "local", "row": row}
+    )
+
+async def certtrack_add_certs(rows: list | None = None, path: str = "", dry_run: bool = False):
+    args = {"spreadsheet_id": "local", "dry_run": bool(dry_run)}
+    if path:
+        args["path"] = os.path.abspath(path)  # el servidor puede no compartir el cwd
+    else:
+        args["rows"] = rows or []
+    return await MCP_POOL.call("certtrack", _certtrack_params(), "sheets_append_certs", args)
+
+async def certtrack_alerts(days_before: int = 30, from_date: str = "", to_date: str = ""):
+    args = {"spreadsheet_id": "local", "days_before": int(days_before)}
+    if from_date:
+        args["from_date"] = from_date
+    if to_date:
+        args["to_date"] = to_date
+    return await MCP_POOL.call("certtrack", _certtrack_params(), "alerts_schedule_due", args)
+
+async def certtrack_report(days_before: int = 30, from_date: str = "", to_date: str = ""):
+    args = {"spreadsheet_id": "local", "days_before": int(days_before)}
+    if from_date:
+        args["from_date"] = from_date
+    if to_date:
+        args["to_date"] = to_date
+    return await MCP_POOL.call("certtrack", _certtrack_params(), "certs_expiration_report", args)
 
 async def certtrack_send_email(to: str, subject: str, html: str):
-    params = StdioServerParameters(command="python", args=["-m", "certtrack_mcp.server"])
-    async with stdio_client(params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            res = await log_mcp_call(session, "outlook_send_email", {"to": to, "subject": subject, "html": html})
-            return res
+    return await MCP_POOL.call(
+        "certtrack", _certtrack_params(), "outlook_send_email",
+        {"to": to, "subject": subject, "html": html}
+    )
+
+async def certtrack_email_status(ids: list | None = None, limit: int = 10):
+    args = {"limit": int(limit)}
+    if ids:
+        args["ids"] = [str(i) for i in ids]
+    return await MCP_POOL.call("certtrack", _certtrack_params(), "email_status", args)
 
-def remote_health():
-    return jsonrpc_call(REMOTE_MCP_URL, "health", None, 1)
+async def certtrack_notify_due(days_before: int = 30, from_date: str = "", to_date: str = "",
+                               dry_run: bool = False):
+    args = {"spreadsheet_id": "local", "days_before": int(days_before), "dry_run": bool(dry_run)}
+    if from_date:
+        args["from_date"] = from_date
+    if to_date:
+        args["to_date"] = to_date
+    return await MCP_POOL.call("certtrack", _certtrack_params(), "alerts_notify_due", args)
 
-def remote_echo(msg: str):
-    return jsonrpc_call(REMOTE_MCP_URL, "echo", {"msg": msg}, 2)
+async def remote_health():
+    return await REMOTE_RPC.call("health")
+
+async def remote_echo(msg: str):
+    return await REMOTE_RPC.call("echo", {"msg": msg})
 
 # =========================
 # Helpers de extracción y resumen
@@ -348,18 +1467,43 @@ def summarize_tool_result(tool: str, result: object) -> str:
         if tool == "add_cert":
             status = data.get("status") or data.get("ok")
             store = data.get("store") or data.get("source")
+            if status == "queued":
+                return f"Certificación registrada; se escribirá en {store} en el próximo lote (ticket {data.get('ticket')})."
             return f"Certificación registrada ({'ok' if status else 'error'}; backend: {store or 'desconocido'})."
 
+        if tool == "add_certs":
+            if not str(data.get("status", "")).startswith("ok"):
+                return f"No se pudo importar: {data.get('status')}"
+            verbo = "válidas" if data.get("dry_run") else "importadas"
+            head = (f"{data.get('accepted', 0)} de {data.get('received', 0)} certificaciones {verbo} "
+                    f"(backend: {data.get('store')}; {data.get('ms')} ms).")
+            errs = data.get("errors", [])
+            lines = [f"- fila {e.get('row')} ({e.get('id') or 'sin id'}): {e.get('error')}" for e in errs[:10]]
+            if data.get("rejected", 0) > len(lines):
+                lines.append(f"- ... {data.get('rejected')} rechazadas en total: {data.get('errors_by_reason')}")
+            return head + ("\nRechazadas:\n" + "\n".join(lines) if lines else "")
+
         if tool == "list_my_certs":
             count = data.get("count", 0)
             certs = data.get("certs", [])
             if count == 0:
+                sugg = data.get("suggestions") or []
+                if sugg:
+                    return "No encontré certificaciones para esa persona. ¿Quisiste decir: " + ", ".join(sugg) + "?"
                 return "No encontré certificaciones para esa persona."
             lines = [
                 f"- {c.get('certificacion')} · fecha {c.get('fecha')} · vence {c.get('vence_el')}"
                 for c in certs
             ]
-            return "Certificaciones:\n" + "\n".join(lines)
+            head = f"Certificaciones de {data['matched_nombre']}:" if data.get("matched_nombre") else "Certificaciones:"
+            return head + "\n" + "\n".join(lines)
+
+        if tool == "search_certs":
+            results = data.get("results", [])
+            if not results:
+                return "Sin resultados."
+            lines = [f"- {r.get('nombre')} · {r.get('certificacion')} · vence {r.get('vence_el')}" for r in results]
+            return f"Resultados ({len(results)}):\n" + "\n".join(lines)
 
         if tool == "upcoming_expirations":
             count = data.get("count", 0)
@@ -372,18 +1516,80 @@ def summarize_tool_result(tool: str, result: object) -> str:
             ]
             return "Próximos vencimientos:\n" + "\n".join(lines)
 
+        if tool == "expiration_report":
+            if not data.get("ok", True):
+                return f"No se pudo generar el reporte: {data.get('error')}"
+            head = (
+                f"Reporte {data.get('from_date')} → {data.get('to_date')}: "
+                f"{data.get('en_ventana', 0)} vencen en la ventana "
+                f"(costo en riesgo {data.get('costo_en_riesgo', 0)}); "
+                f"{data.get('vencidas', 0)} ya vencidas de {data.get('total', 0)}."
+            )
+            lines = [f"- {g.get('key') or '(sin proveedor)'}: {g.get('count')} · costo {g.get('costo')}"
+                     for g in data.get("por_proveedor", [])]
+            return head + ("\nPor proveedor:\n" + "\n".join(lines) if lines else "")
+
         if tool == "send_email":
+            if data.get("status") == "queued":
+                return f"Correo en cola de envío (id {data.get('message_id')}); consulta /correo-estado {data.get('message_id')}."
             prov = data.get("provider") or data.get("mode") or "desconocido"
             ok = data.get("ok", True)
-            return f"Correo {'enviado' if ok else 'no enviado'} (proveedor: {prov})."
+            if not ok:
+                return f"Correo no enviado: {data.get('error')}"
+            return f"Correo enviado (proveedor: {prov})."
+
+        if tool == "email_status":
+            if not data.get("ok", True):
+                return f"No se pudo consultar la bandeja de salida: {data.get('error')}"
+            msgs = data.get("messages", [])
+            counts = (data.get("outbox") or {}).get("by_status") or {}
+            head = "Bandeja de salida: " + (", ".join(f"{k} {v}" for k, v in sorted(counts.items())) or "vacía") + "."
+            lines = []
+            for m in msgs:
+                line = f"- {m.get('id')}: {m.get('status')}"
+                if m.get("to_addr"):
+                    line += f" → {m.get('to_addr')} (intentos {m.get('attempts')})"
+                if m.get("last_error"):
+                    line += f" · {m.get('last_error')}"
+                lines.append(line)
+            return head + ("\n" + "\n".join(lines) if lines else "")
+
+        if tool == "notify_due":
+            if not data.get("ok", True):
+                return f"No se pudieron enviar los avisos: {data.get('error')}"
+            base = (f"{data.get('alerts', 0)} vencimientos para {data.get('recipients', 0)} personas "
+                    f"({data.get('from_date')} → {data.get('to_date')}); "
+                    f"{data.get('already_notified', 0)} ya avisados antes.")
+            if data.get("dry_run"):
+                return base + f" Se enviarían {data.get('to_send', 0)} correos (prueba, nada enviado)."
+            lines = [f"- {e.get('to')}: {e.get('error')}" for e in data.get("errors", [])[:10]]
+            verbo = "Encolados" if data.get("delivery") == "outbox" else "Enviados"
+            return (base + f" {verbo} {data.get('sent', 0)}, fallidos {data.get('failed', 0)} "
+                    f"(proveedores: {data.get('providers') or '-'}).") + ("\n" + "\n".join(lines) if lines else "")
 
         # Filesystem / Git
         if tool == "fs_write":
             return "Archivo escrito correctamente."
         if tool == "git_add_commit":
+            if data.get("ok") is False:
+                return f"No se pudo hacer el commit: {data.get('error')}"
             return "Commit realizado y repositorio actualizado."
+        if tool == "fs_write_many":
+            if not data.get("ok", True) and not data.get("errors"):
+                return f"No se pudieron escribir los archivos: {data.get('error')}"
+            lines = [f"- {e.get('path')}: {e.get('error')}" for e in data.get("errors", [])[:10]]
+            if lines:
+                return (f"{data.get('written', 0)} de {len(data.get('files', []))} archivos escritos; "
+                        f"sin commit por errores:\n" + "\n".join(lines))
+            head = f"{data.get('written', 0)} archivos escritos ({data.get('ms')} ms)"
+            if "commit" in data:
+                return head + (f"; commit: {data.get('commit')}." if data.get("ok") else f"; commit fallido: {data.get('error')}")
+            return head + "."
 
         # Remoto
+        if tool in ("remote_health", "remote_echo") and isinstance(data, dict) and data.get("error"):
+            err = data["error"]
+            return f"El servicio remoto respondió con error: {err.get('message') if isinstance(err, dict) else err}"
         if tool == "remote_health":
             return "Servicio remoto operativo."
         if tool == "remote_echo":
@@ -397,22 +1603,194 @@ def summarize_tool_result(tool: str, result: object) -> str:
     except Exception:
         return "Operación completada."
 
+# =========================
+# Ejecución concurrente de "batch"
+# =========================
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_STEP_TIMEOUT = float(os.getenv("BATCH_STEP_TIMEOUT", "60"))
+
+def _step_footprint(tool: str, args: dict) -> tuple[set[str], set[str]]:
+    """
+    Recursos que un paso lee y escribe. Las rutas de FS/Git se comparan por prefijo,
+    así un fs_write dentro de un repo queda antes del git_add_commit de ese repo.
+    """
+    if tool in ("list_my_certs", "search_certs", "upcoming_expirations", "expiration_report"):
+        return {"certtrack:"}, set()
+    if tool in ("add_cert", "add_certs"):
+        return set(), {"certtrack:"}
+    if tool == "send_email":
+        return set(), {"mail:" + str(args.get("to", "")).strip().lower(), "mail:outbox"}
+    if tool == "email_status":
+        return {"mail:outbox"}, set()
+    if tool == "notify_due":
+        # lee los vencimientos y escribe el registro de avisos del servidor
+        return {"certtrack:"}, {"certtrack:notify", "mail:outbox"}
+    if tool == "fs_write":
+        return set(), {os.path.normcase(os.path.normpath(_resolve_fs_path(args.get("path", ""))))}
+    if tool == "git_add_commit":
+        return set(), {os.path.normcase(os.path.normpath(_resolve_repo_path(args.get("repo_path", ""))))}
+    if tool == "fs_write_many":
+        files = [f for f in (args.get("files") or []) if isinstance(f, dict) and f.get("path")]
+        writes = {os.path.normcase(p) for p in _fs_many_paths(files)}
+        if args.get("message"):
+            writes.add(os.path.normcase(os.path.normpath(_resolve_repo_path(args.get("repo_path", "")))))
+        return set(), writes
+    # remote_* y herramientas desconocidas no tocan estado local
+    return set(), set()
+
+def _overlaps(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    return a.startswith(b.rstrip("\\/") + os.sep) or b.startswith(a.rstrip("\\/") + os.sep)
+
+def plan_batch(actions: list[dict]) -> list[set[int]]:
+    """
+    Para cada paso, los índices de pasos anteriores de los que depende:
+    hay dependencia si comparten un recurso y al menos uno de los dos escribe.
+    Las lecturas entre sí quedan libres y corren en paralelo.
+    """
+    prints = [_step_footprint(a.get("tool"), a.get("args") or {}) for a in actions]
+    deps = []
+    for i, (ri, wi) in enumerate(prints):
+        dep = set()
+        for j in range(i):
+            rj, wj = prints[j]
+            if any(_overlaps(x, y) for x in wi for y in rj | wj) or any(_overlaps(x, y) for x in ri for y in wj):
+                dep.add(j)
+        deps.append(dep)
+    return deps
+
+def _result_error(result: object) -> str | None:
+    """
+    Error de negocio en lo que devolvió una herramienta (la llamada en sí no falló):
+    resultado MCP con isError, {"ok": false}, {"status": "error: ..."} o un sobre
+    JSON-RPC con "error". None si el resultado es válido.
+    """
+    if getattr(result, "isError", False):
+        return _mcp_text(result) or "la herramienta devolvió un error"
+    data = _extract_json_from_mcp_result(result)
+    if not isinstance(data, dict):
+        return None
+    if data.get("ok") is False:
+        return str(data.get("error") or data.get("status") or "error")
+    status = data.get("status")
+    if isinstance(status, str) and status.lower().startswith("error"):
+        return status
+    if "jsonrpc" in data and data.get("error"):
+        err = data["error"]
+        return str(err.get("message") if isinstance(err, dict) else err)
+    return None
+
+async def run_batch(actions: list[dict], concurrency: int | None = None, step_timeout: float | None = None):
+    """
+    Ejecuta los pasos respetando plan_batch, con un límite de concurrencia y un
+    timeout por paso. Entrega (índice, paso, resultado) en el orden original,
+    a medida que cada paso está listo. El resultado es {"ok", "out"} o {"ok", "error"}.
+    """
+    deps = plan_batch(actions)
+    sem = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+    timeout = step_timeout or BATCH_STEP_TIMEOUT
+    tasks: list[asyncio.Task] = []
+
+    async def _run(i: int, tool: str, args: dict) -> dict:
+        for j in sorted(deps[i]):
+            if not (await tasks[j])["ok"]:
+                return {"ok": False, "error": f"omitido: depende del paso {j + 1}, que falló"}
+        async with sem:
+            t0 = time.monotonic()
+            try:
+                out = await asyncio.wait_for(_dispatch_tool(tool, args), timeout)
+                err = _result_error(out) if out is not None else None
+                if err:
+                    # los pasos que dependen de este no deben correr sobre un resultado fallido
+                    return {"ok": False, "out": out, "error": err}
+                return {"ok": True, "out": out}
+            except asyncio.TimeoutError:
+                return {"ok": False, "error": f"tiempo agotado ({timeout:g}s)"}
+            except Exception as e:
+                logging.exception(f"batch-step-error | i={i} | tool={tool}")
+                return {"ok": False, "error": f"{e}"}
+            finally:
+                logging.info(f"batch-step | i={i} | tool={tool} | ms={round((time.monotonic() - t0) * 1000)}")
+
+    for i, step in enumerate(actions):
+        tasks.append(asyncio.create_task(_run(i, step.get("tool"), step.get("args") or {})))
+    logging.info(f"batch-plan | steps={len(actions)} | deps={[sorted(d) for d in deps]}")
+
+    try:
+        for i, step in enumerate(actions):
+            yield i, step, await tasks[i]
+    finally:
+        for t in tasks:
+            t.cancel()
+
 # =========================
 # Bucle principal
 # =========================
-def main():
+async def ainput(prompt: str) -> str:
+    """
+    input() sin bloquear el loop. Usa un hilo daemon (y no el executor por defecto)
+    para que Ctrl+C no quede esperando a que el usuario pulse Enter.
+    """
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    def _deliver(ok: bool, value):
+        if fut.done():
+            return
+        if ok:
+            fut.set_result(value)
+        else:
+            fut.set_exception(value)
+
+    def _reader():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(_deliver, False, e)
+        else:
+            loop.call_soon_threadsafe(_deliver, True, line)
+
+    threading.Thread(target=_reader, name="console-input", daemon=True).start()
+    return await fut
+
+async def main():
+    """
+    Bucle de consola sobre un único event loop: las sesiones MCP del pool y
+    cualquier tarea de fondo viven durante toda la sesión.
+    """
+    try:
+        if PREWARM_BACKENDS:
+            MCP_POOL.prewarm(prewarm_specs())
+        await _chat_loop()
+    finally:
+        logging.info(f"router-stats | {FAST_ROUTER_STATS.summary()} | {INTENT_CACHE.summary()}")
+        await MCP_POOL.aclose()
+        close_http_session()
+
+class _ConsolePrinter:
+    """Imprime el texto del asistente a medida que llega del stream."""
+    def __init__(self):
+        self.started = False
+
+    def __call__(self, chunk: str):
+        if not self.started:
+            print("Asistente: ", end="", flush=True)
+            self.started = True
+        print(chunk, end="", flush=True)
+
+async def _chat_loop():
     print("Chat listo. Escribe 'salir' para terminar.\n")
 
-    # Memoria de conversación para el router
-    convo = []
-    system_note = (
-        "Eres un asistente técnico para un prototipo de consola. "
-        "Responde de forma breve y directa, con pasos reproducibles cuando proceda."
-    )
-    convo.append({"role": "system", "content": [{"type": "text", "text": system_note}]})
+    # Memoria de conversación para el router (el system prompt lo pone el router)
+    convo = RouterHistory()
 
     while True:
-        user_text = input("Tú: ").strip()
+        try:
+            user_text = (await ainput("Tú: ")).strip()
+        except EOFError:
+            print("Fin de la sesión.")
+            break
         if not user_text:
             continue
         if user_text.lower() in {"salir", "exit", "quit"}:
@@ -420,10 +1798,12 @@ def main():
             break
 
         logging.info(f"user: {user_text}")
-        convo.append({"role": "user", "content": [{"type": "text", "text": user_text}]})
+        convo.add("user", user_text)
 
-        # 1) LLM decide acción
-        intent = call_llm_for_intent(convo, user_text)
+        # 1) Reglas locales; si no hay coincidencia segura, el LLM decide
+        intent = fast_route(user_text)
+        if intent is None:
+            intent = await cached_call_llm_for_intent(convo, user_text, on_text=_ConsolePrinter())
         logging.info(f"router-intent: {intent}")
 
         # 2) Despacho
@@ -432,71 +1812,123 @@ def main():
 
             if action == "respond":
                 text = intent.get("text", "").strip() or "Ok."
-                convo.append({"role": "assistant", "content": [{"type": "text", "text": text}]})
-                print(f"Asistente: {text}\n")
+                convo.add("assistant", text)
+                if intent.get("_streamed"):
+                    print("\n")
+                else:
+                    print(f"Asistente: {text}\n")
                 continue
 
             if action == "batch":
                 actions = intent.get("actions") or []
-                for step in actions:
+                async for _, step, res in run_batch(actions):
                     tool = step.get("tool")
-                    args = step.get("args") or {}
-                    out = _dispatch_tool(tool, args)
-                    summary = summarize_tool_result(tool, out) if out is not None else f"{tool}: acción omitida."
+                    if not res["ok"] and res.get("out") is not None:
+                        summary = summarize_tool_result(tool, res["out"])
+                    elif not res["ok"]:
+                        summary = f"{tool}: {res['error']}"
+                    elif res["out"] is None:
+                        summary = f"{tool}: acción omitida."
+                    else:
+                        summary = summarize_tool_result(tool, res["out"])
+                    convo.add("assistant", summary, tool=True)
                     print(f"Asistente: {summary}\n")
-                # Puedes agregar summaries al historial si lo deseas
                 continue
 
             if action == "call_tool":
                 tool = intent.get("tool")
                 args = intent.get("args") or {}
-                out = _dispatch_tool(tool, args)
+                out = await _dispatch_tool(tool, args)
                 summary = summarize_tool_result(tool, out) if out is not None else f"{tool}: acción omitida."
-                convo.append({"role": "assistant", "content": [{"type": "text", "text": summary}]})
+                convo.add("assistant", summary, tool=True)
                 print(f"Asistente: {summary}\n")
                 continue
 
             # Fallback
             text = intent.get("text") or "Entendido."
-            convo.append({"role": "assistant", "content": [{"type": "text", "text": text}]})
+            convo.add("assistant", text)
             print(f"Asistente: {text}\n")
 
         except Exception as e:
             logging.exception("dispatch-error")
             msg = f"Ocurrió un error al procesar la solicitud: {e}"
-            convo.append({"role": "assistant", "content": [{"type": "text", "text": msg}]})
+            convo.add("assistant", msg)
             print(f"Asistente: {msg}\n")
 
-def _dispatch_tool(tool: str, args: dict):
+def _as_bool(value, default: bool = False) -> bool:
+    # el router puede mandar "false"/"no" como string: bool("false") sería True
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "si", "sí")
+    return bool(value)
+
+async def _dispatch_tool(tool: str, args: dict):
     if tool == "list_my_certs":
-        return asyncio.run(certtrack_list(nombre=args.get("nombre", "")))
+        return await certtrack_list(nombre=args.get("nombre", ""))
+
+    if tool == "search_certs":
+        return await certtrack_search(query=args.get("query", ""), limit=int(args.get("limit", 10)))
 
     if tool == "add_cert":
-        return asyncio.run(certtrack_add_cert(row=args.get("row", {})))
+        return await certtrack_add_cert(row=args.get("row", {}))
+
+    if tool == "add_certs":
+        return await certtrack_add_certs(
+            rows=args.get("rows"), path=args.get("path", ""), dry_run=_as_bool(args.get("dry_run"))
+        )
 
     if tool == "upcoming_expirations":
-        return asyncio.run(certtrack_alerts(days_before=int(args.get("days_before", 30))))
+        return await certtrack_alerts(
+            days_before=int(args.get("days_before", 30)),
+            from_date=args.get("from_date", ""), to_date=args.get("to_date", "")
+        )
+
+    if tool == "expiration_report":
+        return await certtrack_report(
+            days_before=int(args.get("days_before", 30)),
+            from_date=args.get("from_date", ""), to_date=args.get("to_date", "")
+        )
+
+    if tool == "email_status":
+        return await certtrack_email_status(ids=args.get("ids") or [], limit=int(args.get("limit", 10)))
+
+    if tool == "notify_due":
+        return await certtrack_notify_due(
+            days_before=int(args.get("days_before", 30)),
+            from_date=args.get("from_date", ""), to_date=args.get("to_date", ""),
+            dry_run=_as_bool(args.get("dry_run"))
+        )
 
     if tool == "send_email":
-        return asyncio.run(certtrack_send_email(
+        return await certtrack_send_email(
             to=args.get("to", ""), subject=args.get("subject", ""), html=args.get("html", "")
-        ))
+        )
 
     if tool == "fs_write":
-        return asyncio.run(fs_write(path=args.get("path", ""), content=args.get("content", "")))
+        return await fs_write(path=args.get("path", ""), content=args.get("content", ""))
 
     if tool == "git_add_commit":
-        return asyncio.run(git_add_commit(
+        return await git_add_commit(
             repo_path=args.get("repo_path", ""),
             files=args.get("files", []) or [],
-            message=args.get("message", "Update via MCP")
-        ))
+            message=args.get("message", "Update via MCP"),
+            status=_as_bool(args.get("status"), True)
+        )
+
+    if tool == "fs_write_many":
+        return await fs_write_many(
+            files=args.get("files", []) or [],
+            repo_path=args.get("repo_path", ""),
+            message=args.get("message", ""),
+            status=_as_bool(args.get("status"), False)
+        )
 
     if tool == "remote_health":
-        return remote_health()
+        return await remote_health()
 
     if tool == "remote_echo":
-        return remote_echo(args.get("msg", ""))
+        return await remote_echo(args.get("msg", ""))
 
     return None
 
@@ -543,4 +1975,7 @@ async def git_demo():
             await log_mcp_call(git_sess, "git_status", {"repo_path": repo})
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nFin de la sesión.")
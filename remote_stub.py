@@ -0,0 +1,117 @@
+# remote_stub.py — servidor JSON-RPC 2.0 local que imita al remoto (health/echo)
+"""
+Sustituto local del servicio remoto para probar el cliente sin red:
+
+    python remote_stub.py --port 8765
+    REMOTE_MCP_URL=http://127.0.0.1:8765/rpc python main.py
+
+Soporta llamadas individuales, arreglos batch, notificaciones (sin id),
+cuerpos gzip (Content-Encoding) y respuestas gzip (Accept-Encoding), con
+keep-alive HTTP/1.1. --fail-every N responde 503 a cada N-ésimo POST y
+--delay agrega latencia, para ejercitar los reintentos y timeouts.
+"""
+import argparse
+import gzip
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _health(params):
+    return {"status": "ok", "server": "remote-stub"}
+
+def _echo(params):
+    return {"echo": (params or {}).get("msg", "") if isinstance(params, dict) else params}
+
+METHODS = {"health": _health, "echo": _echo}
+
+def _error(code: int, message: str, req_id=None) -> dict:
+    return {"jsonrpc": "2.0", "id": req_id, "error": {"code": code, "message": message}}
+
+def handle_one(req):
+    """Respuesta a un request JSON-RPC (None si es notificación)."""
+    if not isinstance(req, dict) or req.get("jsonrpc") != "2.0" or not isinstance(req.get("method"), str):
+        return _error(-32600, "Invalid Request", req.get("id") if isinstance(req, dict) else None)
+    fn = METHODS.get(req["method"])
+    if "id" not in req:
+        if fn:
+            fn(req.get("params"))
+        return None
+    if fn is None:
+        return _error(-32601, "Method not found", req["id"])
+    try:
+        return {"jsonrpc": "2.0", "id": req["id"], "result": fn(req.get("params"))}
+    except Exception as e:
+        return _error(-32603, str(e), req["id"])
+
+def make_handler(fail_every: int = 0, delay: float = 0.0):
+    counter = itertools.count(1)
+    lock = threading.Lock()
+    stats = {"posts": 0, "connections": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload=None):
+            body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            if payload is not None:
+                self.send_header("Content-Type", "application/json")
+                if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 256:
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                n = next(counter)
+                stats["posts"] += 1
+                stats["connections"].add(self.client_address)
+            if delay:
+                time.sleep(delay)
+            if fail_every and n % fail_every == 0:
+                return self._send(503, {"error": "unavailable"})
+            try:
+                if self.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                payload = json.loads(raw.decode("utf-8"))
+            except Exception:
+                return self._send(200, _error(-32700, "Parse error"))
+            if isinstance(payload, list):
+                if not payload:
+                    return self._send(200, _error(-32600, "Invalid Request"))
+                out = [r for r in (handle_one(req) for req in payload) if r is not None]
+                return self._send(200, out) if out else self._send(204)
+            res = handle_one(payload)
+            return self._send(200, res) if res is not None else self._send(204)
+
+    Handler.stats = stats
+    return Handler
+
+def serve(host: str = "127.0.0.1", port: int = 8765, fail_every: int = 0, delay: float = 0.0) -> ThreadingHTTPServer:
+    """Crea el servidor (sin arrancarlo): serve_forever() o en un hilo para pruebas."""
+    return ThreadingHTTPServer((host, port), make_handler(fail_every, delay))
+
+def main():
+    ap = argparse.ArgumentParser(description="Servidor JSON-RPC local (health/echo) para pruebas.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--fail-every", type=int, default=0, help="responde 503 cada N POST")
+    ap.add_argument("--delay", type=float, default=0.0, help="latencia artificial por POST (s)")
+    args = ap.parse_args()
+    srv = serve(args.host, args.port, args.fail_every, args.delay)
+    print(f"remote stub en http://{args.host}:{srv.server_port}/rpc")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()